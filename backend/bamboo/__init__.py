@@ -1,14 +1,105 @@
-from apiflask import APIFlask
-from flask import current_app, send_from_directory
+import mimetypes
+import re
 
-from bamboo import blueprints, database, jobs
+from apiflask import APIFlask, abort
+from flask import Response, current_app, redirect, request
+from werkzeug.security import safe_join
+from werkzeug.utils import send_from_directory
+from werkzeug.wsgi import wrap_file
+
+from bamboo import blueprints, database, jobs, security, storage
 from bamboo.settings import config
+from bamboo.storage import FileInfo, LocalStorage, S3Storage, get_storage
+
+CONTENT_ADDRESSED = re.compile(r"(?P<sha256>[0-9a-f]{64})(?P<variant>_[^/.]*)?(?:\.[^/.]*)?$")
+# Blobs never change, as their names are derived from their content.
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+
+
+def media_etag(filename: str, info: FileInfo | None) -> tuple[str | None, bool]:
+    """Get a strong ETag for a content-addressed media file without reading it.
+
+    Blobs are named after their content hash. Variants are derived from it, but their
+    bytes also depend on the settings they were generated with, hence the mtime.
+
+    Returns:
+        The ETag, if any, and whether the file is an immutable blob.
+    """
+    if (match := CONTENT_ADDRESSED.search(filename)) is None:
+        return None, False
+    if match["variant"] is None:
+        return match["sha256"], True
+    if info is None:
+        return None, False
+    return f"{match['sha256']}{match['variant']}-{info.mtime_ns:x}", False
+
+
+def remote_media_response(storage: S3Storage, filename: str) -> Response:
+    """Redirect to the public URL of the media, or stream it from the storage."""
+    if storage.public_url is not None:
+        # Not permanent, browsers would keep following it after the public URL changes.
+        return redirect(storage.url(filename), 302)
+    if safe_join("/", filename) is None or (info := storage.stat(filename)) is None:
+        abort(404)
+    etag, immutable = media_etag(filename, info)
+    response = current_app.response_class(
+        mimetype=mimetypes.guess_type(filename)[0] or "application/octet-stream"
+    )
+    response.set_etag(etag or f"{info.size:x}-{info.mtime_ns:x}")
+    response.cache_control.public = True
+    response.cache_control.max_age = (
+        IMMUTABLE_MAX_AGE if immutable else current_app.get_send_file_max_age(filename)
+    )
+    if immutable:
+        response.cache_control.immutable = True
+    response.make_conditional(request)
+    if response.status_code != 304:
+        response.response = wrap_file(request.environ, storage.open(filename))
+        response.direct_passthrough = True
+        response.content_length = info.size
+    return response
 
 
-def media_endpoint(filename: str) -> str:
-    media_dir = current_app.config["BAMBOO_MEDIA_DIR"]
-    max_age = current_app.get_send_file_max_age(filename)
-    return send_from_directory(media_dir, filename, max_age=max_age)
+def media_endpoint(filename: str) -> Response:
+    storage = get_storage()
+    if not isinstance(storage, LocalStorage):
+        return remote_media_response(storage, filename)
+    media_dir = storage.root
+    offload = current_app.config["BAMBOO_MEDIA_OFFLOAD"]
+    info = storage.stat(filename) if safe_join(str(media_dir), filename) else None
+    etag, immutable = media_etag(filename, info)
+    max_age = IMMUTABLE_MAX_AGE if immutable else current_app.get_send_file_max_age(filename)
+    if offload == "x-accel-redirect":
+        # The proxy serves whatever path it is given, unlike send_from_directory.
+        if info is None:
+            abort(404)
+        # Let the front proxy send the body, including range requests.
+        response = current_app.response_class(
+            mimetype=mimetypes.guess_type(filename)[0] or "application/octet-stream"
+        )
+        response.headers[
+            "X-Accel-Redirect"
+        ] = f"{current_app.config['BAMBOO_MEDIA_ACCEL_PREFIX']}/{filename}"
+        if etag is not None:
+            response.set_etag(etag)
+        response.cache_control.public = True
+        response.cache_control.max_age = max_age
+        response.make_conditional(request)
+        if response.status_code == 304:
+            del response.headers["X-Accel-Redirect"]
+    else:
+        response = send_from_directory(
+            media_dir,
+            filename,
+            request.environ,
+            max_age=max_age,
+            etag=etag or True,
+            use_x_sendfile=offload == "x-sendfile",
+            response_class=current_app.response_class,
+        )
+    if immutable:
+        response.cache_control.immutable = True
+    return response
 
 
 def create_app(config_name: str) -> APIFlask:
@@ -20,13 +111,19 @@ def create_app(config_name: str) -> APIFlask:
         docs_oauth2_redirect_path="/_docs/oauth2-redirect",
     )
     app.config.from_object(config[config_name])
+    # To create the same app in job worker processes.
+    app.config["BAMBOO_CONFIG_NAME"] = config_name
 
     # blueprints
     blueprints.init_app(app)
     # database
     database.init_app(app)
+    # media storage
+    storage.init_app(app)
     # jobs
     jobs.init_app(app)
+    # password hashing
+    security.init_app(app)
     # Serve media files for development environment.
     # This will be overriden by nginx in production environment.
     app.add_url_rule(f"{app.config['MEDIA_URL']}/<path:filename>", "media", media_endpoint)
@@ -5,6 +5,7 @@ from bamboo.blueprints.auth import auth
 from bamboo.blueprints.blog import blog
 from bamboo.blueprints.city import city
 from bamboo.blueprints.command import command
+from bamboo.blueprints.job import job
 from bamboo.blueprints.media import media
 from bamboo.blueprints.organization import organization
 from bamboo.blueprints.page import page
@@ -24,6 +25,7 @@ def init_app(app: APIFlask) -> None:
     app.register_blueprint(auth, url_prefix="/api/auth")
     app.register_blueprint(blog, url_prefix="/api/blog")
     app.register_blueprint(media, url_prefix="/api/media")
+    app.register_blueprint(job, url_prefix="/api/jobs")
     app.register_blueprint(page, url_prefix="/api/page")
     app.register_blueprint(site, url_prefix="/api/site")
     app.register_blueprint(talk, url_prefix="/api/talk")
@@ -1,3 +1,35 @@
+import os
+
 from apiflask import APIBlueprint
 
+from bamboo.blueprints.auth import (
+    Permission,
+    get_auth_version_cache,
+    get_token_cache,
+    token_auth,
+)
+from bamboo.database import db
+from bamboo.database.pool import get_pool_stats
+from bamboo.database.routing import get_replicas
+from bamboo.schemas.admin import CacheStatsOut, PoolStatsOut
+
 admin = APIBlueprint("admin", __name__)
+
+
+@admin.get("/pools")
+@admin.output(PoolStatsOut(many=True))
+@token_auth.auth_required(permissions=Permission.SITE)
+def list_pool_stats():
+    """Get the connection pool statistics of the process serving the request."""
+    engines = {key or "default": engine for key, engine in db.engines.items()}
+    engines.update(get_replicas())
+    return [get_pool_stats(name, engine) for name, engine in engines.items()]
+
+
+@admin.get("/caches")
+@admin.output(CacheStatsOut(many=True))
+@token_auth.auth_required(permissions=Permission.SITE)
+def list_cache_stats():
+    """Get the authentication cache statistics of the process serving the request."""
+    caches = {"token": get_token_cache(), "auth_version": get_auth_version_cache()}
+    return [{"name": name, "pid": os.getpid(), **cache.stats()} for name, cache in caches.items()]
@@ -1,17 +1,30 @@
+import dataclasses
 import enum
-from datetime import timedelta
+import hashlib
+import logging
 from typing import Any, Callable, TypeVar, overload
 
+import sqlalchemy as sa
+import sqlalchemy.orm as so
 from apiflask import APIBlueprint, HTTPTokenAuth, abort
-from flask import current_app
+from flask import current_app, has_app_context
 from flask_httpauth import Authorization
 from jose.exceptions import JWTError
+from redis import RedisError
 
 from bamboo.database import db, models
-from bamboo.schemas.auth import CurrentUserSchema, LoginSchema, TokenSchema
-from bamboo.utils import decode_jwt, encode_jwt
+from bamboo.schemas.auth import CurrentUserSchema, LoginSchema, LogoutSchema, TokenSchema
+from bamboo.security import (
+    HashingPoolFull,
+    check_password,
+    get_revocation_list,
+    hash_password,
+    password_needs_rehash,
+)
+from bamboo.utils import TTLCache, decode_jwt, encode_jwt
 
 F = TypeVar("F", bound=Callable)
+logger = logging.getLogger(__name__)
 
 
 class Permission(enum.IntFlag):
@@ -22,26 +35,74 @@ class Permission(enum.IntFlag):
     STAFF = enum.auto()
 
 
+@dataclasses.dataclass(frozen=True)
+class Identity:
+    """A compact snapshot of the authenticated user, cached along with the verified token."""
+
+    user_id: int
+    active: bool
+    is_superuser: bool
+    role_id: int | None
+    permissions: int | None
+    # Only set for identities built from token claims, which must be checked against the user.
+    auth_version: int | None = None
+    token_type: str = "access"
+    jti: str | None = None
+    expires_at: int | None = None
+
+    @classmethod
+    def from_user(cls, user: models.User) -> "Identity":
+        return cls(
+            user_id=user.id,
+            active=user.active,
+            is_superuser=user.is_superuser,
+            role_id=user.role_id,
+            permissions=user.role.permissions if user.role is not None else None,
+        )
+
+    @classmethod
+    def from_claims(cls, payload: dict[str, Any]) -> "Identity":
+        return cls(
+            user_id=payload["user_id"],
+            active=True,
+            is_superuser=payload["su"],
+            role_id=None,
+            permissions=payload["perms"],
+            auth_version=payload["ver"],
+        )
+
+    def to_claims(self, auth_version: int) -> dict[str, Any]:
+        return {"su": self.is_superuser, "perms": self.permissions, "ver": auth_version}
+
+
 class TokenAuth(HTTPTokenAuth):
     def authorize(
-        self, permissions: Permission | None, user: models.User, _: Authorization | None
+        self, permissions: Permission | None, identity: Identity, _: Authorization | None
     ) -> bool:
         """Overriding authorize() to improve efficiency."""
-        if permissions is None or user.is_superuser:
+        if permissions is None or identity.is_superuser:
             return True
 
         if self.get_user_roles_callback is None:
             raise ValueError("get_user_roles callback is not defined")
 
-        user_permissions: Permission = self.ensure_sync(self.get_user_roles_callback)(user)
+        user_permissions: Permission = self.ensure_sync(self.get_user_roles_callback)(identity)
 
         return permissions & user_permissions == permissions
 
     @property
-    def current_user(self) -> models.User | None:
-        """Overriding current_user to offer type information."""
+    def current_identity(self) -> Identity | None:
+        """The identity snapshot of the authenticated user, no database access is needed."""
         return super().current_user
 
+    @property
+    def current_user(self) -> models.User | None:
+        """Overriding current_user to load the user lazily and offer type information."""
+        identity = self.current_identity
+        if identity is None:
+            return None
+        return db.session.get(models.User, identity.user_id)
+
     @overload
     def auth_required(self, f: F) -> F:
         ...
@@ -92,6 +153,85 @@ token_auth = TokenAuth()
 auth = APIBlueprint("auth", __name__)
 
 
+@auth.record_once
+def init_token_cache(state) -> None:
+    config = state.app.config
+    state.app.extensions["bamboo.token_cache"] = TTLCache[str, Identity](
+        maxsize=config["BAMBOO_TOKEN_CACHE_SIZE"], ttl=config["BAMBOO_TOKEN_CACHE_TTL"]
+    )
+    state.app.extensions["bamboo.auth_version_cache"] = TTLCache[int, tuple[int, bool]](
+        maxsize=config["BAMBOO_TOKEN_CACHE_SIZE"], ttl=config["BAMBOO_AUTH_VERSION_CACHE_TTL"]
+    )
+    # The generation of the revocation list the caches are valid for.
+    state.app.extensions["bamboo.auth_generation"] = None
+
+
+def get_token_cache() -> TTLCache[str, Identity]:
+    """Get the verified-token cache of the current application."""
+    return current_app.extensions["bamboo.token_cache"]
+
+
+def get_auth_version_cache() -> TTLCache[int, tuple[int, bool]]:
+    """Get the cache of `(auth_version, active)` pairs keyed by user id."""
+    return current_app.extensions["bamboo.auth_version_cache"]
+
+
+def sync_auth_caches() -> None:
+    """Drop the cached identities when a user or role was changed by any process."""
+    revocation_list = get_revocation_list()
+    revocation_list.sync_if_due()
+    if current_app.extensions["bamboo.auth_generation"] != revocation_list.generation:
+        current_app.extensions["bamboo.auth_generation"] = revocation_list.generation
+        get_token_cache().clear()
+        get_auth_version_cache().clear()
+
+
+def get_auth_state(user_id: int) -> tuple[int, bool] | None:
+    """Get the current auth version and active flag of a user, served from cache."""
+    cache = get_auth_version_cache()
+    if (auth_state := cache.get(user_id)) is None:
+        # Always on the primary, a lagging replica would let revoked tokens through.
+        row = db.session.execute(
+            db.select(models.User.auth_version, models.User.active).filter_by(id=user_id),
+            bind_arguments={"bind": db.engine},
+        ).one_or_none()
+        if row is None:
+            return None
+        auth_state = (row.auth_version, row.active)
+        cache.set(user_id, auth_state)
+    return auth_state
+
+
+def create_access_token(user: models.User) -> str:
+    payload: dict[str, Any] = {"user_id": user.id}
+    if current_app.config["BAMBOO_TOKEN_CLAIMS"]:
+        payload.update(Identity.from_user(user).to_claims(user.auth_version))
+    return encode_jwt(payload=payload, secret_key=current_app.config.get("SECRET_KEY"), jti=True)
+
+
+def create_refresh_token(user: models.User) -> str:
+    return encode_jwt(
+        payload={"user_id": user.id},
+        secret_key=current_app.config.get("SECRET_KEY"),
+        token_type="refresh",
+        expires_delta=current_app.config["BAMBOO_REFRESH_TOKEN_EXPIRES"],
+        jti=True,
+    )
+
+
+def revoke(jti: str, expires_at: float) -> None:
+    try:
+        get_revocation_list().revoke(jti, expires_at)
+    except RedisError:
+        logger.exception("Failed to revoke a token")
+        abort(503, "Tokens can't be revoked now, please retry later.", headers={"Retry-After": "5"})
+
+
+def revoke_token(identity: Identity) -> None:
+    if identity.jti is not None and identity.expires_at is not None:
+        revoke(identity.jti, identity.expires_at)
+
+
 @auth.post("/login")
 @auth.input(LoginSchema)
 @auth.output(TokenSchema)
@@ -99,28 +239,28 @@ def login(json_data):
     user: models.User | None = db.session.scalars(
         db.select(models.User).filter_by(username=json_data["username"])
     ).one_or_none()
-    if user is None or user.validate_password(json_data["password"]) is False:
+    if user is None or user.password_hash is None:
         abort(401, "Incorrect username or password.")
+    try:
+        if not check_password(user.password_hash, json_data["password"]):
+            abort(401, "Incorrect username or password.")
+    except HashingPoolFull:
+        abort(429, "Too many login attempts, please retry later.", headers={"Retry-After": "1"})
+    if password_needs_rehash(user.password_hash):
+        try:
+            user.upgrade_password_hash(hash_password(json_data["password"], block=False))
+            db.session.commit()
+        except HashingPoolFull:
+            # The password is verified already, the hash is upgraded at a later login.
+            pass
 
     # Only the user with a role and the role's permissions is not 0 are allowed to log in.
     if not user.allow_login():
         abort(403)
 
-    access_token = encode_jwt(
-        payload={"user_id": user.id},
-        secret_key=current_app.config.get("SECRET_KEY"),
-    )
-
-    refresh_token = encode_jwt(
-        payload={"user_id": user.id},
-        secret_key=current_app.config.get("SECRET_KEY"),
-        token_type="refresh",
-        expires_delta=timedelta(days=7),
-    )
-
     return {
-        "access_token": access_token,
-        "refresh_token": refresh_token,
+        "access_token": create_access_token(user),
+        "refresh_token": create_refresh_token(user),
     }
 
 
@@ -133,12 +273,36 @@ def refresh():
     if not user.allow_login():
         abort(403)
 
-    access_token = encode_jwt(
-        payload={"user_id": user.id},
-        secret_key=current_app.config.get("SECRET_KEY"),
-    )
+    identity = token_auth.current_identity
+    if identity.token_type != "refresh" or identity.jti is None:
+        return {"access_token": create_access_token(user)}
+    # Rotate the refresh token, the one just used can't be used again.
+    revoke_token(identity)
+    return {
+        "access_token": create_access_token(user),
+        "refresh_token": create_refresh_token(user),
+    }
 
-    return {"access_token": access_token}
+
+@auth.post("/logout")
+@auth.input(LogoutSchema)
+@auth.output({}, status_code=204)
+@token_auth.auth_required
+def logout(json_data):
+    identity = token_auth.current_identity
+    revoke_token(identity)
+    if refresh_token := json_data.get("refresh_token"):
+        try:
+            payload = decode_jwt(
+                encoded_token=refresh_token, secret_key=current_app.config.get("SECRET_KEY")
+            )
+        except JWTError as error:
+            abort(400, str(error))
+        if payload.get("user_id") != identity.user_id or payload.get("type") != "refresh":
+            abort(400, "Invalid refresh token.")
+        if "jti" in payload:
+            revoke(payload["jti"], payload["exp"])
+    return ""
 
 
 @auth.get("/current")
@@ -156,20 +320,101 @@ def current_user():
 
 
 @token_auth.verify_token
-def verify_token(token: str) -> models.User | None:
+def verify_token(token: str) -> Identity | None:
     if not token:
         return None
-    try:
-        payload = decode_jwt(encoded_token=token, secret_key=current_app.config.get("SECRET_KEY"))
-    except JWTError as error:
-        abort(401, str(error))
-    user = db.session.get(models.User, payload.get("user_id"))
-    return user
+    sync_auth_caches()
+    cache = get_token_cache()
+    # Never keep the raw token in memory longer than necessary.
+    digest = hashlib.sha256(token.encode()).hexdigest()
+    identity = cache.get(digest)
+    if identity is None:
+        try:
+            payload = decode_jwt(
+                encoded_token=token, secret_key=current_app.config.get("SECRET_KEY")
+            )
+        except JWTError as error:
+            abort(401, str(error))
+        if current_app.config["BAMBOO_TOKEN_CLAIMS"] and "ver" in payload:
+            identity = Identity.from_claims(payload)
+        else:
+            user = db.session.get(models.User, payload.get("user_id"))
+            if user is None:
+                return None
+            identity = Identity.from_user(user)
+        identity = dataclasses.replace(
+            identity,
+            token_type=payload.get("type", "access"),
+            jti=payload.get("jti"),
+            expires_at=payload["exp"],
+        )
+        cache.set(digest, identity, expires_at=payload["exp"])
+    if identity.jti is not None and get_revocation_list().is_revoked(identity.jti):
+        abort(401, "Token has been revoked.")
+    if identity.auth_version is not None:
+        # The claims are trusted only if nothing has changed since the token was issued.
+        auth_state = get_auth_state(identity.user_id)
+        if auth_state is None or auth_state != (identity.auth_version, True):
+            return None
+    elif not identity.active:
+        return None
+    return identity
 
 
 @token_auth.get_user_roles
-def get_user_permissions(user: models.User) -> Permission:
-    if user.role is None:
+def get_user_permissions(identity: Identity) -> Permission:
+    if identity.permissions is None:
         abort(403)
 
-    return Permission(user.role.permissions)  # type: ignore[union-attr]
+    return Permission(identity.permissions)
+
+
+@sa.event.listens_for(models.User, "after_update")
+def invalidate_updated_user_tokens(mapper, connection, target: models.User) -> None:
+    # Bumped by bump_user_auth_version when the identity or the password changes, not on
+    # other edits or password hash upgrades, which would drop all the caches for nothing.
+    if sa.inspect(target).attrs.auth_version.history.has_changes():
+        invalidate_user_tokens(mapper, connection, target)
+
+
+@sa.event.listens_for(models.User, "after_delete")
+def invalidate_user_tokens(mapper, connection, target: models.User) -> None:
+    if has_app_context():
+        get_token_cache().discard_if(lambda identity: identity.user_id == target.id)
+        get_auth_version_cache().pop(target.id)
+        broadcast_on_commit(target)
+
+
+@sa.event.listens_for(models.Role, "after_update")
+def invalidate_updated_role_tokens(mapper, connection, target: models.Role) -> None:
+    if sa.inspect(target).attrs.permissions.history.has_changes():
+        invalidate_role_tokens(mapper, connection, target)
+
+
+@sa.event.listens_for(models.Role, "after_delete")
+def invalidate_role_tokens(mapper, connection, target: models.Role) -> None:
+    if has_app_context():
+        get_token_cache().discard_if(lambda identity: identity.role_id == target.id)
+        # The auth versions of all users with this role may have been bumped.
+        get_auth_version_cache().clear()
+        broadcast_on_commit(target)
+
+
+def broadcast_on_commit(target: Any) -> None:
+    # The other processes must not reload the old state before it's committed.
+    if (session := so.object_session(target)) is not None:
+        session.info["bamboo.auth_changed"] = True
+
+
+@sa.event.listens_for(so.Session, "after_commit")
+def broadcast_auth_change(session: so.Session) -> None:
+    if session.info.pop("bamboo.auth_changed", False) and has_app_context():
+        try:
+            get_revocation_list().invalidate()
+        except RedisError:
+            logger.exception("Failed to invalidate the cached identities of other processes")
+
+
+@sa.event.listens_for(so.Session, "after_rollback")
+def forget_auth_change(session: so.Session) -> None:
+    session.info.pop("bamboo.auth_changed", None)
@@ -2,8 +2,11 @@ from apiflask import APIBlueprint
 
 from bamboo.blueprints.auth import Permission, token_auth
 from bamboo.database import db
+from bamboo.database.loading import eager_options
 from bamboo.database.models import City, Site
-from bamboo.schemas.city import CityIn, CityOut
+from bamboo.database.pagination import paginate
+from bamboo.schemas.city import CityIn, CityOut, CityPageOut
+from bamboo.schemas.pagination import PaginationIn
 
 city = APIBlueprint("city", __name__)
 
@@ -16,10 +19,11 @@ def get_city(city_id):
 
 
 @city.get("/all")
-@city.output(CityOut(many=True))
+@city.input(PaginationIn, location="query")
+@city.output(CityPageOut)
 @token_auth.auth_required
-def list_cities():
-    return db.session.scalars(db.select(City).order_by(City.created_at.desc())).all()
+def list_cities(query_data):
+    return paginate(db.select(City).options(*eager_options(City, CityOut)), City, query_data)
 
 
 @city.post("")
@@ -1,10 +1,33 @@
+import os
+import time
+from concurrent.futures import Future, ProcessPoolExecutor, as_completed
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import TYPE_CHECKING
+
 import click
-from flask import Blueprint
+import sqlalchemy as sa
+from flask import Blueprint, current_app
+from redis import RedisError
 
 from bamboo.database import db
+from bamboo.storage import LocalStorage, Storage, get_storage
+from bamboo.utils import utc_now
+
+if TYPE_CHECKING:
+    from bamboo.database.models import Media
 
 command = Blueprint("command", __name__, cli_group=None)
 
+# Shipped in the media directory and referenced by path from the admin profile,
+# it's copied into the storage if that's elsewhere.
+DEFAULT_PROFILE_IMAGE = "user.png"
+
+
+@command.cli.group(name="media")
+def media_group() -> None:
+    """Manage media files."""
+
 
 @command.cli.command(name="create-tables")
 def create_tables() -> None:
@@ -20,6 +43,31 @@ def drop_tables() -> None:
     click.echo("Tables dropped.")
 
 
+@command.cli.command(name="schedule-jobs")
+def schedule_jobs() -> None:
+    """Register the periodic jobs, which are queued by `flask rq scheduler`."""
+    from bamboo.jobs import get_job_policy, optimize_database, rq
+
+    if current_app.config["BAMBOO_JOB_BACKEND"] != "rq":
+        # The in-process backends have no scheduler, and there may be no Redis.
+        click.echo("Skipped the periodic jobs, which need the rq job backend.")
+        return
+    pattern = current_app.config["BAMBOO_SQLITE_OPTIMIZE_CRON"]
+    try:
+        if pattern and any(engine.dialect.name == "sqlite" for engine in db.engines.values()):
+            policy = get_job_policy("optimize_database")
+            optimize_database.cron(
+                pattern, "optimize-database", queue=policy.queue, timeout=policy.timeout
+            )
+            click.echo(f"Scheduled optimize-database at {pattern}.")
+        else:
+            # Only SQLite databases need it.
+            rq.get_scheduler().cancel("cron-optimize-database")
+    except RedisError as e:
+        # Not worth keeping the app from starting.
+        click.echo(f"Failed to schedule the periodic jobs: {e}", err=True)
+
+
 @command.cli.command(name="create-admin")
 @click.option("--username", prompt=True, help="Admin username.")
 @click.option(
@@ -30,11 +78,19 @@ def drop_tables() -> None:
 def create_admin(username: str, password: str, fullname: str, email: str) -> None:
     """Create admin user."""
     from bamboo.database import models
+    from bamboo.security import hash_password
 
+    storage = get_storage()
+    bundled = Path(current_app.config["BAMBOO_MEDIA_DIR"]) / DEFAULT_PROFILE_IMAGE
+    if storage.stat(DEFAULT_PROFILE_IMAGE) is None and bundled.is_file():
+        with bundled.open("rb") as f:
+            storage.put(DEFAULT_PROFILE_IMAGE, f)
     if (
-        profile := db.session.scalars(db.select(models.Media).filter_by(path="user.png")).first()
+        profile := db.session.scalars(
+            db.select(models.Media).filter_by(path=DEFAULT_PROFILE_IMAGE)
+        ).first()
     ) is None:
-        profile = models.Media.from_file("user.png")
+        profile = models.Media.from_file(DEFAULT_PROFILE_IMAGE)
         db.session.add(profile)
 
     user = models.User(
@@ -45,7 +101,252 @@ def create_admin(username: str, password: str, fullname: str, email: str) -> Non
         username=username,
         email=email,
     )
-    user.password = password
+    user.password_hash = hash_password(password)
     db.session.add(user)
     db.session.commit()
     click.echo(f"Admin user {username} has been created.")
+
+
+def variants_are_current(storage: Storage, media: "Media", spec: str, small_suffix: str) -> bool:
+    """Whether the variants were generated with the current settings after the image."""
+    if media.variant_spec != spec:
+        return False
+    source, *infos = (
+        storage.stat(path) for path in media_files(media.path, media.variants, small_suffix)
+    )
+    if source is None or None in infos:
+        return False
+    return all(info.mtime_ns >= source.mtime_ns for info in infos)
+
+
+@media_group.command(name="rebuild-variants")
+@click.option("--workers", type=int, help="Number of worker processes, defaults to CPU count.")
+@click.option("--batch-size", default=500, show_default=True, help="Media rows per page.")
+@click.option("--force", is_flag=True, help="Rebuild the variants even if they are current.")
+@click.option(
+    "--enqueue", is_flag=True, help="Queue the rebuilds on the low priority queue for workers."
+)
+def rebuild_variants(workers: int | None, batch_size: int, force: bool, enqueue: bool) -> None:
+    """Rebuild the small images and responsive variants of all images.
+
+    Images in a remote storage are rebuilt by the workers, with `--enqueue`.
+    """
+    from bamboo.database import models
+    from bamboo.jobs import (
+        gen_small_image,
+        render_variants,
+        save_image_metadata,
+        variant_options,
+        variant_spec,
+    )
+
+    config = current_app.config
+    media_dir = Path(config["BAMBOO_MEDIA_DIR"])
+    storage = get_storage()
+    if not enqueue and not isinstance(storage, LocalStorage):
+        raise click.UsageError("The images aren't stored locally, use --enqueue.")
+    options = variant_options(config)
+    spec = variant_spec(config)
+    seen: set[str] = set()
+    built = skipped = failed = 0
+    action = "queued" if enqueue else "rebuilt"
+    start = time.perf_counter()
+    last_id = 0
+    with ProcessPoolExecutor(workers or os.cpu_count()) as pool:
+        while True:
+            page = db.session.scalars(
+                db.select(models.Media)
+                .filter(models.Media.file_type == "image", models.Media.id > last_id)
+                .order_by(models.Media.id)
+                .limit(batch_size)
+            ).all()
+            if not page:
+                break
+            last_id = page[-1].id
+            futures: dict[Future, Path] = {}
+            for media in page:
+                # Media of the same blob share the variants.
+                if media.path in seen:
+                    continue
+                seen.add(media.path)
+                image_path = media_dir / media.path
+                if not force and variants_are_current(
+                    storage, media, spec, options["small_suffix"]
+                ):
+                    skipped += 1
+                    continue
+                if enqueue:
+                    # Collapses into the job of a recent upload if it's still pending.
+                    gen_small_image.queue(image_path, queue="low")
+                    built += 1
+                    continue
+                futures[pool.submit(render_variants, image_path, **options)] = image_path
+            for future in as_completed(futures):
+                try:
+                    save_image_metadata(futures[future], future.result())
+                except Exception as e:
+                    failed += 1
+                    click.echo(f"Failed to rebuild {futures[future]}: {e}", err=True)
+                else:
+                    built += 1
+            elapsed = time.perf_counter() - start
+            click.echo(
+                f"{built} {action}, {skipped} skipped, {failed} failed, "
+                f"{built / elapsed:.1f} images/s"
+            )
+    click.echo(f"Done in {time.perf_counter() - start:.1f}s.")
+
+
+def media_files(
+    path: str, variants: list | None, small_suffix: str, previews: list | None = None
+) -> list[str]:
+    """The files of a media relative to the media directory: the file, the small image,
+    the responsive variants and the slide previews.
+    """
+    from bamboo.jobs import variant_path
+
+    files = [path, variant_path(Path(path), small_suffix).as_posix()]
+    files.extend(variant["path"] for variant in [*(variants or []), *(previews or [])])
+    return files
+
+
+def unreferenced_media(cutoff: datetime) -> sa.ColumnElement[bool]:
+    """Media created before the cutoff that no foreign key points to.
+
+    The foreign keys are discovered from the metadata, so that new references are
+    protected without touching this.
+    """
+    from bamboo.database import models
+
+    media_id = models.Media.__table__.c.id
+    clauses = [models.Media.created_at < cutoff]
+    for table in db.metadata.sorted_tables:
+        for fk in table.foreign_keys:
+            if fk.column is media_id:
+                clauses.append(~sa.exists().where(fk.parent == media_id))
+    return sa.and_(*clauses)
+
+
+def remove_files(storage: Storage, files: list[str], dry_run: bool) -> tuple[int, int]:
+    """Remove the files that exist, returning their count and total size."""
+    count = size = 0
+    for file in files:
+        if (info := storage.stat(file)) is None:
+            continue
+        if not dry_run:
+            storage.delete(file)
+        count += 1
+        size += info.size
+    return count, size
+
+
+@media_group.command(name="gc")
+@click.option("--dry-run", is_flag=True, help="Only report what would be deleted.")
+@click.option(
+    "--batch-size", default=500, show_default=True, help="Media rows deleted per transaction."
+)
+@click.option(
+    "--min-age",
+    default=24.0,
+    show_default=True,
+    help="Hours before unreferenced media and files are deleted, to spare uploads in flight.",
+)
+def gc(dry_run: bool, batch_size: int, min_age: float) -> None:
+    """Delete unreferenced media, their blobs and files, and files without media."""
+    from bamboo.database import models
+
+    Media, Blob = models.Media, models.Blob
+    config = current_app.config
+    storage = get_storage()
+    small_suffix = config["BAMBOO_SMALL_IMAGE_SUFFIX"]
+    cutoff = utc_now() - timedelta(hours=min_age)
+    # created_at is stored as naive UTC.
+    unreferenced = unreferenced_media(cutoff.replace(tzinfo=None))
+    rows = blobs = files = size = 0
+    seen: set[str] = set()
+    last_id = 0
+    while True:
+        batch = db.session.execute(
+            db.select(Media.id, Media.path, Media.variants, Media.previews, Media.blob_id)
+            .where(unreferenced, Media.id > last_id)
+            .order_by(Media.id)
+            .limit(batch_size)
+        ).all()
+        if not batch:
+            break
+        last_id = batch[-1].id
+        if dry_run:
+            # The rows referencing the same files and staying.
+            kept = db.select(Media.path).where(~unreferenced)
+        else:
+            # Checked again, in case the media got referenced in the meantime.
+            batch = db.session.execute(
+                db.delete(Media)
+                .where(Media.id.in_([row.id for row in batch]), unreferenced)
+                .returning(Media.id, Media.path, Media.variants, Media.previews, Media.blob_id)
+                .execution_options(synchronize_session=False)
+            ).all()
+            kept = db.select(Media.path)
+            blob_ids = {row.blob_id for row in batch if row.blob_id is not None}
+            if blob_ids:
+                used = sa.exists().where(Media.blob_id == Blob.id)
+                blobs += len(
+                    db.session.execute(
+                        db.delete(Blob)
+                        .where(Blob.id.in_(blob_ids), ~used)
+                        .returning(Blob.id)
+                        .execution_options(synchronize_session=False)
+                    ).all()
+                )
+                db.session.execute(
+                    db.update(Blob)
+                    .where(Blob.id.in_(blob_ids))
+                    .values(
+                        ref_count=db.select(sa.func.count())
+                        .where(Media.blob_id == Blob.id)
+                        .scalar_subquery()
+                    )
+                    .execution_options(synchronize_session=False)
+                )
+        paths = {row.path: row for row in batch if row.path not in seen}
+        kept_paths = set(
+            db.session.scalars(kept.where(Media.path.in_(paths)).distinct()) if paths else []
+        )
+        # The files are removed once the rows are gone for good.
+        db.session.commit()
+        rows += len(batch)
+        for path, row in paths.items():
+            if path in kept_paths or path == DEFAULT_PROFILE_IMAGE:
+                continue
+            seen.add(path)
+            if dry_run and row.blob_id is not None:
+                blobs += 1
+            removed, removed_size = remove_files(
+                storage, media_files(path, row.variants, small_suffix, row.previews), dry_run
+            )
+            files += removed
+            size += removed_size
+    verb = "Would delete" if dry_run else "Deleted"
+    click.echo(f"{verb} {rows} media, {blobs} blobs and {files} files ({size / 1e6:.1f} MB).")
+
+    # Any file left without media, along with stale temporary files and uploads.
+    referenced = {DEFAULT_PROFILE_IMAGE}
+    for path, variants, previews in db.session.execute(
+        db.select(Media.path, Media.variants, Media.previews).execution_options(yield_per=1000)
+    ):
+        referenced.update(media_files(path, variants, small_suffix, previews))
+    orphans = orphans_size = 0
+    threshold = int(cutoff.timestamp() * 1e9)
+    stores = [storage]
+    if not isinstance(storage, LocalStorage):
+        # Uploads are staged in the media directory all the same.
+        stores.append(LocalStorage(Path(config["BAMBOO_MEDIA_DIR"]), config["MEDIA_URL"]))
+    for store in stores:
+        for info in store.iter_files():
+            if info.path in referenced or info.mtime_ns >= threshold:
+                continue
+            if not dry_run:
+                store.delete(info.path)
+            orphans += 1
+            orphans_size += info.size
+    click.echo(f"{verb} {orphans} files without media ({orphans_size / 1e6:.1f} MB).")
@@ -0,0 +1,24 @@
+from apiflask import APIBlueprint, abort
+
+from bamboo.blueprints.auth import token_auth
+from bamboo.jobs import get_job_state, get_queue_metrics
+from bamboo.schemas.job import JobOut, QueueMetricsOut
+
+job = APIBlueprint("job", __name__)
+
+
+@job.get("/queues")
+@job.output(QueueMetricsOut(many=True))
+@token_auth.auth_required
+def list_queue_metrics():
+    """Get the depth, the age of the oldest job and the execution times of each queue."""
+    return get_queue_metrics()
+
+
+@job.get("/<job_id>")
+@job.output(JobOut)
+@token_auth.auth_required
+def get_job(job_id):
+    if (state := get_job_state(job_id)) is None:
+        abort(404, message="Job not found")
+    return state
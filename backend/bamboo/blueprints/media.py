@@ -1,33 +1,206 @@
+import os
 from pathlib import Path
 
-from apiflask import APIBlueprint
-from flask import current_app
+from apiflask import APIBlueprint, abort
+from flask import current_app, request
+from PIL import Image, UnidentifiedImageError
+from sqlalchemy.exc import IntegrityError
 from werkzeug.datastructures import FileStorage
+from werkzeug.http import parse_content_range_header
 
 from bamboo.database import db
-from bamboo.database.models import Media
-from bamboo.jobs import gen_small_image
-from bamboo.schemas.media import MediaIn, MediaOut
-from bamboo.utils import gen_uuid
+from bamboo.database.models import Blob, Media
+from bamboo.jobs import (
+    ImageTooLarge,
+    check_image_size,
+    gen_slide_previews,
+    gen_small_image,
+    slides_supported,
+)
+from bamboo.schemas.media import (
+    MediaIn,
+    MediaOut,
+    UploadFinalizeIn,
+    UploadSessionIn,
+    UploadSessionOut,
+)
+from bamboo.storage import (
+    StagedFile,
+    UploadBusyError,
+    UploadError,
+    UploadOffsetError,
+    UploadSession,
+    blob_path,
+    get_storage,
+    stage_file,
+)
 
 media = APIBlueprint("media", __name__)
 
 
-@media.post("/")
-@media.input(MediaIn, location="files")
-@media.output(MediaOut)
-def upload_media(files_data: dict) -> dict | tuple[dict, int]:
-    file: FileStorage = files_data["file"]
-    upload_filename: str = file.filename
-    filename = f"{gen_uuid()}_{upload_filename}"
-    media_dir = Path(current_app.config["BAMBOO_MEDIA_DIR"])
-    media_dir.mkdir(parents=True, exist_ok=True)
-    media_file = media_dir / filename
-    file.save(media_file)
+def get_or_create_blob(staged: StagedFile, suffix: str) -> tuple[Blob, bool]:
+    """Find the blob with the same content or move the staged file into the storage as a new one.
+
+    Returns:
+        The blob and whether it was created.
+    """
+    blob = db.session.scalars(db.select(Blob).filter_by(sha256=staged.sha256)).one_or_none()
+    if blob is not None:
+        staged.discard()
+        return blob, False
+    path = blob_path(staged.sha256, suffix)
+    get_storage().put_file(path, staged.path)
+    blob = Blob(sha256=staged.sha256, path=path, size=staged.size)
+    try:
+        with db.session.begin_nested():
+            db.session.add(blob)
+    except IntegrityError:
+        # The same content was uploaded concurrently.
+        return db.session.scalars(db.select(Blob).filter_by(sha256=staged.sha256)).one(), False
+    return blob, True
+
+
+# The fields computed from the content, which are the same for all media of a blob.
+DERIVED_FIELDS = (
+    "width",
+    "height",
+    "lqip",
+    "dominant_color",
+    "variants",
+    "variant_spec",
+    "variant_state",
+    "encoding",
+    "page_count",
+    "previews",
+    "text",
+)
+
+
+def create_media(staged: StagedFile, filename: str) -> Media:
+    """Create a media from a staged upload, sharing the blob with identical uploads.
+
+    Raises:
+        ImageTooLarge: If the image has more pixels than allowed, the upload is discarded.
+    """
     media_o = Media.from_file(filename)
     if media_o.file_type == "image":
-        # async generate small image
-        gen_small_image.queue(media_file)
+        # Only the header is read, the image isn't decoded.
+        try:
+            with Image.open(staged.path) as image:
+                check_image_size(image, current_app.config["BAMBOO_IMAGE_MAX_PIXELS"])
+                media_o.width, media_o.height = image.size
+        except ImageTooLarge:
+            staged.discard()
+            raise
+        except Image.DecompressionBombError as e:
+            # Pillow's own limit, when BAMBOO_IMAGE_MAX_PIXELS is over it.
+            staged.discard()
+            raise ImageTooLarge(str(e)) from e
+        except (OSError, UnidentifiedImageError):
+            pass
+    blob, created = get_or_create_blob(staged, os.path.splitext(filename)[1])
+    sibling = (
+        None if created else db.session.scalars(db.select(Media).filter_by(blob_id=blob.id)).first()
+    )
+    media_o.path = blob.path
+    media_o.filename = filename
+    media_o.blob = blob
+    media_o.size = blob.size
+    if sibling is not None:
+        for field in DERIVED_FIELDS:
+            setattr(media_o, field, getattr(sibling, field))
+    if media_o.file_type == "image":
+        job = gen_small_image
+    elif media_o.file_type == "slides" and slides_supported(blob.path):
+        job = gen_slide_previews
+    else:
+        job = None
+    if job is not None and sibling is None:
+        media_o.variant_state = "pending"
     db.session.add(media_o)
     db.session.commit()
+    if job is not None:
+        path = Path(current_app.config["BAMBOO_MEDIA_DIR"]) / blob.path
+        if created:
+            # async generate small image or slide previews
+            media_o.job_id = job.queue(path).id
+        elif media_o.variant_state == "pending":
+            # The derived files of the same content may still be generated.
+            media_o.job_id = job.job_id(path)
     return media_o
+
+
+@media.post("/")
+@media.input(MediaIn, location="files")
+@media.output(MediaOut)
+def upload_media(files_data: dict) -> dict | tuple[dict, int]:
+    file: FileStorage = files_data["file"]
+    staged = stage_file(file.stream, Path(current_app.config["BAMBOO_MEDIA_DIR"]))
+    try:
+        return create_media(staged, file.filename)
+    except ImageTooLarge as e:
+        abort(422, message=str(e))
+
+
+def get_upload_session_or_404(upload_id: str) -> UploadSession:
+    session = UploadSession.load(Path(current_app.config["BAMBOO_MEDIA_DIR"]), upload_id)
+    if session is None:
+        abort(404, message="Upload not found")
+    return session
+
+
+@media.post("/uploads")
+@media.input(UploadSessionIn, location="json")
+@media.output(UploadSessionOut, status_code=201)
+def create_upload(json_data):
+    """Start a resumable upload, whose chunks are sent with `PUT /uploads/<id>`."""
+    return UploadSession.create(Path(current_app.config["BAMBOO_MEDIA_DIR"]), **json_data)
+
+
+@media.get("/uploads/<upload_id>")
+@media.output(UploadSessionOut)
+def get_upload(upload_id):
+    """Get the offset to resume the upload from."""
+    return get_upload_session_or_404(upload_id)
+
+
+@media.put("/uploads/<upload_id>")
+@media.output(UploadSessionOut)
+def upload_chunk(upload_id):
+    """Append the request body, whose position is given by the `Content-Range` header.
+
+    `Content-Range: bytes */<size>` without a body asks for the offset to resume from.
+    """
+    session = get_upload_session_or_404(upload_id)
+    content_range = parse_content_range_header(request.headers.get("Content-Range"))
+    if content_range is None or content_range.length != session.size:
+        abort(400, message="Invalid Content-Range header")
+    if content_range.start is None:
+        return session
+    try:
+        session.append(
+            request.stream, content_range.start, content_range.stop - content_range.start
+        )
+    except UploadOffsetError as e:
+        abort(409, message="Chunk doesn't start at the current offset", detail={"offset": e.offset})
+    except UploadBusyError as e:
+        abort(409, message=str(e))
+    except UploadError as e:
+        abort(400, message=str(e))
+    return session
+
+
+@media.post("/uploads/<upload_id>/finalize")
+@media.input(UploadFinalizeIn, location="json")
+@media.output(MediaOut)
+def finalize_upload(upload_id, json_data):
+    """Verify the checksum of the complete upload and create the media."""
+    session = get_upload_session_or_404(upload_id)
+    try:
+        staged = session.stage(json_data.get("sha256"))
+    except UploadError as e:
+        abort(422, message=str(e))
+    try:
+        return create_media(staged, session.filename)
+    except ImageTooLarge as e:
+        abort(422, message=str(e))
@@ -1,12 +1,15 @@
 from apiflask import APIBlueprint, abort
 
 from bamboo.database import db
+from bamboo.database.loading import eager_options
 from bamboo.database.models import City, Organization, Partnership
+from bamboo.database.pagination import empty_page, paginate
 from bamboo.schemas.partnership import (
     PartnershipByCityIn,
     PartnershipByPrimaryIn,
     PartnershipIn,
     PartnershipOut,
+    PartnershipPageOut,
 )
 
 partnership = APIBlueprint("partnership", __name__)
@@ -21,15 +24,15 @@ def get_partnership(query_data):
 
 @partnership.get("/list")
 @partnership.input(PartnershipByCityIn, location="query")
-@partnership.output(PartnershipOut(many=True))
+@partnership.output(PartnershipPageOut)
 def get_partnership_query(query_data):
-    query = db.select(Partnership)
+    query = db.select(Partnership).options(*eager_options(Partnership, PartnershipOut))
     if "city_id" in query_data:
         city = db.session.get(City, query_data.pop("city_id"))
         if not city:
-            return []
+            return empty_page(query_data)
         query = query.filter_by(city=city)
-    return db.session.execute(query).scalars()
+    return paginate(query, Partnership, query_data)
 
 
 @partnership.post("/")
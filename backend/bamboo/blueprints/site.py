@@ -2,8 +2,11 @@ from apiflask import APIBlueprint
 
 from bamboo.blueprints.auth import Permission, token_auth
 from bamboo.database import db
+from bamboo.database.loading import eager_options
 from bamboo.database.models import Site
-from bamboo.schemas.site import SiteIn, SiteOut
+from bamboo.database.pagination import paginate
+from bamboo.schemas.pagination import PaginationIn
+from bamboo.schemas.site import SiteIn, SiteOut, SitePageOut
 
 site = APIBlueprint("site", __name__)
 
@@ -16,10 +19,11 @@ def get_site(site_id):
 
 
 @site.get("/all")
-@site.output(SiteOut(many=True))
+@site.input(PaginationIn, location="query")
+@site.output(SitePageOut)
 @token_auth.auth_required
-def list_sites():
-    return db.session.scalars(db.select(Site).order_by(Site.created_at.desc())).all()
+def list_sites(query_data):
+    return paginate(db.select(Site).options(*eager_options(Site, SiteOut)), Site, query_data)
 
 
 @site.post("")
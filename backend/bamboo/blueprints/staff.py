@@ -2,8 +2,16 @@ from apiflask import APIBlueprint, abort
 
 from bamboo.blueprints.auth import Permission, token_auth
 from bamboo.database import db
+from bamboo.database.loading import eager_options
 from bamboo.database.models import City, Staff, User
-from bamboo.schemas.staff import StaffByCityIn, StaffByPrimaryIn, StaffIn, StaffOut
+from bamboo.database.pagination import empty_page, paginate
+from bamboo.schemas.staff import (
+    StaffByCityIn,
+    StaffByPrimaryIn,
+    StaffIn,
+    StaffOut,
+    StaffPageOut,
+)
 
 staff = APIBlueprint("staff", __name__)
 
@@ -18,20 +26,16 @@ def get_staff(query_data):
 
 @staff.get("/list")
 @staff.input(StaffByCityIn, location="query")
-@staff.output(StaffOut(many=True))
+@staff.output(StaffPageOut)
 @token_auth.auth_required
 def list_staffs(query_data):
-    query = db.select(Staff)
+    query = db.select(Staff).options(*eager_options(Staff, StaffOut))
     if "city_id" in query_data:
         city = db.session.get(City, query_data.pop("city_id"))
         if not city:
-            return []
+            return empty_page(query_data)
         query = query.filter_by(city=city)
-    return db.session.scalars(
-        query.join(User, Staff.staff)
-        .filter(User.active.is_(True))
-        .order_by(Staff.created_at.desc())
-    ).all()
+    return paginate(query.join(User, Staff.staff).filter(User.active.is_(True)), Staff, query_data)
 
 
 @staff.post("")
@@ -11,7 +11,9 @@ venue = APIBlueprint("venue", __name__)
 @venue.output(VenueTalkOut)
 def get_venue(venue_id):
     venue = Venue.query.get_or_404(venue_id)
-    schedule_items = ScheduleItem.query.filter_by(venue_id=venue_id).all()
+    schedule_items = (
+        ScheduleItem.query.filter_by(venue_id=venue_id).order_by(ScheduleItem.start).all()
+    )
     talk_ids = list({item.talk_id for item in schedule_items if item.talk_id is not None})
     if talk_ids is not None:
         talks = Talk.query.filter(Talk.id.in_(talk_ids)).all()
@@ -25,7 +27,9 @@ def get_venue(venue_id):
 @venue.output(VenueSchedulesOut)
 def get_venue_schedules(venue_id):
     venue = Venue.query.get_or_404(venue_id)
-    schedule_items = ScheduleItem.query.filter_by(venue_id=venue_id).all()
+    schedule_items = (
+        ScheduleItem.query.filter_by(venue_id=venue_id).order_by(ScheduleItem.start).all()
+    )
     return {
         "venue": venue,
         "schedule_items": schedule_items,
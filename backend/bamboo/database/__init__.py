@@ -3,7 +3,8 @@ from pathlib import Path
 from flask import Flask
 from flask_migrate import Migrate
 
-from bamboo.database.models import db
+from bamboo.database.models import db, use_sqlite_pragmas
+from bamboo.database.routing import configure_replicas, get_replicas
 
 migrate = Migrate(db=db, directory=Path(__file__).with_name("migrations"))
 
@@ -11,3 +12,7 @@ migrate = Migrate(db=db, directory=Path(__file__).with_name("migrations"))
 def init_app(app: Flask) -> None:
     db.init_app(app)
     migrate.init_app(app)
+    configure_replicas(app)
+    with app.app_context():
+        for engine in [*db.engines.values(), *get_replicas().values()]:
+            use_sqlite_pragmas(engine, app.config["BAMBOO_SQLITE_PRAGMAS"])
@@ -0,0 +1,39 @@
+import functools
+from typing import Any
+
+import sqlalchemy as sa
+import sqlalchemy.orm as so
+from apiflask import Schema
+from apiflask.fields import List, Nested
+
+
+def _nested_schema(field: Any) -> Schema | None:
+    if isinstance(field, List):
+        field = field.inner
+    return field.schema if isinstance(field, Nested) else None
+
+
+def _loader_options(model: Any, schema: Schema) -> list[so.Load]:
+    relationships = sa.inspect(model).relationships
+    options = []
+    for name, field in schema.dump_fields.items():
+        nested = _nested_schema(field)
+        relationship = relationships.get(field.attribute or name)
+        if nested is None or relationship is None or relationship.lazy in ("write_only", "dynamic"):
+            continue
+        # A join doesn't multiply the rows for a single related object, which a collection
+        # would, so these are loaded in a second query.
+        loader = so.selectinload if relationship.uselist else so.joinedload
+        option = loader(relationship.class_attribute)
+        if sub_options := _loader_options(relationship.mapper.class_, nested):
+            option = option.options(*sub_options)
+        options.append(option)
+    return options
+
+
+@functools.cache
+def eager_options(model: Any, schema: type[Schema]) -> tuple[so.Load, ...]:
+    """Get the loader options of the relationships dumped by `schema`, nested ones included,
+    so that dumping a list of `model` objects takes a fixed number of queries.
+    """
+    return tuple(_loader_options(model, schema()))
@@ -0,0 +1,84 @@
+"""Operations shared by the migrations.
+
+Databases set up with `flask create-tables` have the latest schema already, which the
+migrations are run against too, so the operations skip what exists.
+
+Indexes are built and dropped concurrently on PostgreSQL, so that the tables stay writable,
+which can't run in a transaction: use them in `op.get_context().autocommit_block()`.
+"""
+import sqlalchemy as sa
+from alembic import op
+from sqlalchemy.schema import CreateColumn
+
+
+def column_names(table: str) -> set[str]:
+    return {column["name"] for column in sa.inspect(op.get_bind()).get_columns(table)}
+
+
+def create_table(name: str, *columns: sa.Column) -> None:
+    if not sa.inspect(op.get_bind()).has_table(name):
+        op.create_table(name, *columns)
+
+
+def drop_table(name: str) -> None:
+    if sa.inspect(op.get_bind()).has_table(name):
+        op.drop_table(name)
+
+
+def add_column(table: str, column: sa.Column) -> None:
+    if column.name in column_names(table):
+        return
+    dialect = op.get_bind().dialect
+    if dialect.name == "sqlite" and column.foreign_keys:
+        # SQLite can't add constraints to a table, but takes them in the column definition.
+        [foreign_key] = column.foreign_keys
+        quote = dialect.identifier_preparer.quote
+        target_table, target_column = foreign_key.target_fullname.split(".")
+        definition = CreateColumn(column).compile(dialect=dialect)
+        references = f"REFERENCES {quote(target_table)} ({quote(target_column)})"
+        if foreign_key.ondelete:
+            references += f" ON DELETE {foreign_key.ondelete}"
+        op.execute(f"ALTER TABLE {quote(table)} ADD COLUMN {definition} {references}")
+    else:
+        op.add_column(table, column)
+
+
+def drop_column(table: str, name: str) -> None:
+    if name not in column_names(table):
+        return
+    bind = op.get_bind()
+    if bind.dialect.name == "sqlite" and any(
+        name in foreign_key["constrained_columns"]
+        for foreign_key in sa.inspect(bind).get_foreign_keys(table)
+    ):
+        # SQLite can only drop it by copying the table, and dropping the old one would
+        # cascade to the rows referencing it, so the column is left in place.
+        return
+    op.drop_column(table, name)
+
+
+def create_index(name: str, table: str, columns: list[str], unique: bool = False) -> None:
+    if op.get_bind().dialect.name == "postgresql":
+        # A failed concurrent build leaves an invalid index, which IF NOT EXISTS would keep.
+        invalid = op.get_bind().scalar(
+            sa.text(
+                "SELECT 1 FROM pg_index JOIN pg_class ON pg_class.oid = pg_index.indexrelid"
+                " WHERE pg_class.relname = :name AND NOT pg_index.indisvalid"
+            ),
+            {"name": name},
+        )
+        if invalid:
+            op.drop_index(name, table_name=table, postgresql_concurrently=True)
+    op.create_index(
+        name, table, columns, unique=unique, if_not_exists=True, postgresql_concurrently=True
+    )
+
+
+def drop_index(name: str, table: str) -> None:
+    op.drop_index(name, table_name=table, if_exists=True, postgresql_concurrently=True)
+
+
+def disable_statement_timeout() -> None:
+    if op.get_bind().dialect.name == "postgresql":
+        # Building indexes of large tables may take longer than the app's statement timeout.
+        op.execute("SET statement_timeout = 0")
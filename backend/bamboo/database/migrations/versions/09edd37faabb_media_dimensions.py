@@ -0,0 +1,30 @@
+"""Add the dimensions and placeholders of media
+
+Revision ID: 09edd37faabb
+Revises: 4f1745e73e8d
+Create Date: 2026-10-18 21:52:16.094872
+
+"""
+import sqlalchemy as sa
+
+from bamboo.database.migration_ops import add_column, drop_column
+
+# revision identifiers, used by Alembic.
+revision = "09edd37faabb"
+down_revision = "4f1745e73e8d"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    add_column("media", sa.Column("width", sa.Integer()))
+    add_column("media", sa.Column("height", sa.Integer()))
+    add_column("media", sa.Column("lqip", sa.Text()))
+    add_column("media", sa.Column("dominant_color", sa.String()))
+
+
+def downgrade():
+    drop_column("media", "dominant_color")
+    drop_column("media", "lqip")
+    drop_column("media", "height")
+    drop_column("media", "width")
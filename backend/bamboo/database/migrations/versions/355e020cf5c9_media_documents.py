@@ -0,0 +1,28 @@
+"""Add the pages, previews and text of documents
+
+Revision ID: 355e020cf5c9
+Revises: 5ba2da5990e0
+Create Date: 2026-10-18 22:04:51.205466
+
+"""
+import sqlalchemy as sa
+
+from bamboo.database.migration_ops import add_column, drop_column
+
+# revision identifiers, used by Alembic.
+revision = "355e020cf5c9"
+down_revision = "5ba2da5990e0"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    add_column("media", sa.Column("page_count", sa.Integer()))
+    add_column("media", sa.Column("previews", sa.JSON()))
+    add_column("media", sa.Column("text", sa.Text()))
+
+
+def downgrade():
+    drop_column("media", "text")
+    drop_column("media", "previews")
+    drop_column("media", "page_count")
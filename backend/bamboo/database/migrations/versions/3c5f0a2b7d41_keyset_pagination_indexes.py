@@ -0,0 +1,44 @@
+"""Add the indexes of the paginated lists
+
+Revision ID: 3c5f0a2b7d41
+Revises: eeeaa7daa99d
+Create Date: 2026-10-18 19:52:06.118430
+
+The lists are ordered by (created_at, *primary key), the indexes cover the whole sort key
+so that a page reads only its own rows. They are built concurrently on PostgreSQL.
+"""
+from alembic import op
+
+from bamboo.database.migration_ops import create_index, disable_statement_timeout, drop_index
+
+# revision identifiers, used by Alembic.
+revision = "3c5f0a2b7d41"
+down_revision = "eeeaa7daa99d"
+branch_labels = None
+depends_on = None
+
+# name, table, columns
+INDEXES = [
+    ("ix_site_created_at_id", "site", ["created_at", "id"]),
+    ("ix_city_created_at_id", "city", ["created_at", "id"]),
+    (
+        "ix_partnership_city_id_created_at_organization_id",
+        "partnership",
+        ["city_id", "created_at", "organization_id"],
+    ),
+]
+
+
+def upgrade():
+    # Concurrent builds can't run in a transaction.
+    with op.get_context().autocommit_block():
+        disable_statement_timeout()
+        for name, table, columns in INDEXES:
+            create_index(name, table, columns)
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        disable_statement_timeout()
+        for name, table, _ in reversed(INDEXES):
+            drop_index(name, table)
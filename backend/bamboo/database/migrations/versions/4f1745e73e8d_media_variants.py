@@ -0,0 +1,24 @@
+"""Add the variants of media
+
+Revision ID: 4f1745e73e8d
+Revises: d37587dcf985
+Create Date: 2026-10-18 21:48:52.730415
+
+"""
+import sqlalchemy as sa
+
+from bamboo.database.migration_ops import add_column, drop_column
+
+# revision identifiers, used by Alembic.
+revision = "4f1745e73e8d"
+down_revision = "d37587dcf985"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    add_column("media", sa.Column("variants", sa.JSON()))
+
+
+def downgrade():
+    drop_column("media", "variants")
@@ -0,0 +1,24 @@
+"""Add the encoding of media
+
+Revision ID: 5ba2da5990e0
+Revises: 739bfac35f8a
+Create Date: 2026-10-18 22:01:27.870932
+
+"""
+import sqlalchemy as sa
+
+from bamboo.database.migration_ops import add_column, drop_column
+
+# revision identifiers, used by Alembic.
+revision = "5ba2da5990e0"
+down_revision = "739bfac35f8a"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    add_column("media", sa.Column("encoding", sa.JSON()))
+
+
+def downgrade():
+    drop_column("media", "encoding")
@@ -0,0 +1,24 @@
+"""Add the auth version of users
+
+Revision ID: 5d16bfcecef4
+Revises:
+Create Date: 2026-10-18 21:04:37.216893
+
+"""
+import sqlalchemy as sa
+
+from bamboo.database.migration_ops import add_column, drop_column
+
+# revision identifiers, used by Alembic.
+revision = "5d16bfcecef4"
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    add_column("user", sa.Column("auth_version", sa.Integer(), nullable=False, server_default="0"))
+
+
+def downgrade():
+    drop_column("user", "auth_version")
@@ -0,0 +1,24 @@
+"""Add the variant state of media
+
+Revision ID: 739bfac35f8a
+Revises: 7f3c5cc56966
+Create Date: 2026-10-18 21:58:03.318547
+
+"""
+import sqlalchemy as sa
+
+from bamboo.database.migration_ops import add_column, drop_column
+
+# revision identifiers, used by Alembic.
+revision = "739bfac35f8a"
+down_revision = "7f3c5cc56966"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    add_column("media", sa.Column("variant_state", sa.String()))
+
+
+def downgrade():
+    drop_column("media", "variant_state")
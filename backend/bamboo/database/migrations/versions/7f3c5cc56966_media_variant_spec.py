@@ -0,0 +1,24 @@
+"""Add the variant spec of media
+
+Revision ID: 7f3c5cc56966
+Revises: 09edd37faabb
+Create Date: 2026-10-18 21:55:40.661203
+
+"""
+import sqlalchemy as sa
+
+from bamboo.database.migration_ops import add_column, drop_column
+
+# revision identifiers, used by Alembic.
+revision = "7f3c5cc56966"
+down_revision = "09edd37faabb"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    add_column("media", sa.Column("variant_spec", sa.String()))
+
+
+def downgrade():
+    drop_column("media", "variant_spec")
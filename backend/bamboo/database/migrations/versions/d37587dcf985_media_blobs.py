@@ -0,0 +1,45 @@
+"""Add the content-addressed blobs of media
+
+Revision ID: d37587dcf985
+Revises: 5d16bfcecef4
+Create Date: 2026-10-18 21:31:09.482116
+
+"""
+import sqlalchemy as sa
+from alembic import op
+
+from bamboo.database.migration_ops import add_column, create_table, drop_column, drop_table
+
+# revision identifiers, used by Alembic.
+revision = "d37587dcf985"
+down_revision = "5d16bfcecef4"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    create_table(
+        "blob",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("created_at", sa.DateTime(), nullable=False),
+        sa.Column("updated_at", sa.DateTime(), nullable=False),
+        sa.Column("sha256", sa.String(), nullable=False),
+        sa.Column("path", sa.String(), nullable=False),
+        sa.Column("size", sa.Integer(), nullable=False),
+        sa.Column("ref_count", sa.Integer(), nullable=False),
+    )
+    op.create_index("ix_blob_sha256", "blob", ["sha256"], unique=True, if_not_exists=True)
+    add_column("media", sa.Column("filename", sa.String()))
+    add_column(
+        "media", sa.Column("blob_id", sa.Integer(), sa.ForeignKey("blob.id", ondelete="SET NULL"))
+    )
+    op.create_index("ix_media_blob_id", "media", ["blob_id"], if_not_exists=True)
+    add_column("media", sa.Column("size", sa.Integer()))
+
+
+def downgrade():
+    op.drop_index("ix_media_blob_id", table_name="media", if_exists=True)
+    drop_column("media", "size")
+    drop_column("media", "blob_id")
+    drop_column("media", "filename")
+    drop_table("blob")
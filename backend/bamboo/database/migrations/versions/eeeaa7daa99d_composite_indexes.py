@@ -0,0 +1,52 @@
+"""Add the composite indexes of the listing queries
+
+Revision ID: eeeaa7daa99d
+Revises: 355e020cf5c9
+Create Date: 2026-10-18 10:12:41.508213
+
+The indexes are built concurrently on PostgreSQL, and replace the single-column indexes on
+their leading column.
+"""
+from alembic import op
+
+from bamboo.database.migration_ops import create_index, disable_statement_timeout, drop_index
+
+# revision identifiers, used by Alembic.
+revision = "eeeaa7daa99d"
+down_revision = "355e020cf5c9"
+branch_labels = None
+depends_on = None
+
+# name, table, columns, unique
+INDEXES = [
+    ("ix_schedule_item_venue_id_start", "schedule_item", ["venue_id", "start"], False),
+    ("ix_staff_city_id_created_at_staff_id", "staff", ["city_id", "created_at", "staff_id"], False),
+    ("ix_city_site_id_start", "city", ["site_id", "start"], False),
+    ("ix_page_site_id_path", "page", ["site_id", "path"], True),
+    ("ix_blog_site_id_path", "blog", ["site_id", "path"], True),
+]
+REPLACED_INDEXES = [
+    ("ix_schedule_item_venue_id", "schedule_item", ["venue_id"]),
+    ("ix_city_site_id", "city", ["site_id"]),
+    ("ix_page_site_id", "page", ["site_id"]),
+    ("ix_blog_site_id", "blog", ["site_id"]),
+]
+
+
+def upgrade():
+    # Concurrent builds can't run in a transaction.
+    with op.get_context().autocommit_block():
+        disable_statement_timeout()
+        for name, table, columns, unique in INDEXES:
+            create_index(name, table, columns, unique)
+        for name, table, _ in REPLACED_INDEXES:
+            drop_index(name, table)
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        disable_statement_timeout()
+        for name, table, columns in REPLACED_INDEXES:
+            create_index(name, table, columns)
+        for name, table, _, _ in reversed(INDEXES):
+            drop_index(name, table)
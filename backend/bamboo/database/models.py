@@ -1,7 +1,9 @@
+import functools
 import mimetypes
 import os
+import re
 from datetime import datetime
-from typing import TYPE_CHECKING, Optional
+from typing import TYPE_CHECKING, Any, Mapping, Optional
 
 import sqlalchemy as sa
 import sqlalchemy.orm as so
@@ -11,20 +13,38 @@ from flask_sqlalchemy.model import Model
 from sqlalchemy import func
 from werkzeug.security import check_password_hash, generate_password_hash
 
-db = SQLAlchemy()
+from bamboo.database.routing import RoutingSession
+from bamboo.storage import get_storage
+
+db = SQLAlchemy(session_options={"class_": RoutingSession})
 
 
 # https://docs.sqlalchemy.org/en/20/dialects/sqlite.html#sqlite-foreign-keys
-@sa.event.listens_for(sa.engine.Engine, "connect")
-def set_sqlite_pragma(dbapi_connection, connection_record):
+def set_sqlite_pragma(
+    dbapi_connection, connection_record, pragmas: Mapping[str, Any] | None = None
+):
+    """Turn on the foreign keys and apply the pragmas to a new connection.
+
+    Registered on SQLite engines by `use_sqlite_pragmas()`, so it runs once per connection
+    rather than on every checkout.
+    """
     import sqlite3
 
     if isinstance(dbapi_connection, sqlite3.Connection):
         cursor = dbapi_connection.cursor()
         cursor.execute("PRAGMA foreign_keys=ON")
+        for name, value in (pragmas or {}).items():
+            if not re.fullmatch(r"\w+", name) or not re.fullmatch(r"[\w-]+", str(value)):
+                raise ValueError(f"Invalid SQLite pragma: {name}={value}")
+            cursor.execute(f"PRAGMA {name}={value}")
         cursor.close()
 
 
+def use_sqlite_pragmas(engine: sa.Engine, pragmas: Mapping[str, Any]) -> None:
+    if engine.dialect.name == "sqlite":
+        sa.event.listen(engine, "connect", functools.partial(set_sqlite_pragma, pragmas=pragmas))
+
+
 if TYPE_CHECKING:
 
     class BaseModel(Model, so.DeclarativeBase):
@@ -73,6 +93,8 @@ class User(Base):
     introduction: so.Mapped[Optional[str]]
     active: so.Mapped[bool] = so.mapped_column(default=True)
     is_superuser: so.Mapped[bool] = so.mapped_column(default=False)
+    # Bumped whenever a change may affect the tokens issued to the user.
+    auth_version: so.Mapped[int] = so.mapped_column(default=0, server_default="0")
     profile_image_id: so.Mapped[int] = so.mapped_column(
         sa.ForeignKey("media.id", ondelete="CASCADE"), index=True
     )
@@ -94,7 +116,14 @@ class User(Base):
 
     @password.setter
     def password(self, password: str) -> None:
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = generate_password_hash(
+            password, method=current_app.config["BAMBOO_PASSWORD_HASH_METHOD"]
+        )
+
+    def upgrade_password_hash(self, password_hash: str) -> None:
+        """Replace the hash with one of the same password, keeping the issued tokens valid."""
+        self.password_hash = password_hash
+        self._password_hash_upgraded = True
 
     def validate_password(self, password: str) -> bool:
         if self.password_hash is None:
@@ -108,16 +137,74 @@ class User(Base):
         return self.is_superuser or (self.role is not None and self.role.permissions != 0)
 
 
+@sa.event.listens_for(User, "before_update")
+def bump_user_auth_version(mapper, connection, target: User) -> None:
+    state = sa.inspect(target)
+    names = ["active", "is_superuser", "role_id", "role"]
+    if not target.__dict__.pop("_password_hash_upgraded", False):
+        names.append("password_hash")
+    if any(state.attrs[name].history.has_changes() for name in names):
+        target.auth_version = (target.auth_version or 0) + 1
+
+
 class Role(Base):
     name: so.Mapped[str]
     permissions: so.Mapped[int]
     users: so.WriteOnlyMapped["User"] = so.relationship(back_populates="role")
 
 
+@sa.event.listens_for(Role, "after_update")
+def bump_role_auth_version(mapper, connection, target: Role) -> None:
+    if sa.inspect(target).attrs.permissions.history.has_changes():
+        user_table = User.__table__
+        connection.execute(
+            user_table.update()
+            .where(user_table.c.role_id == target.id)
+            .values(auth_version=user_table.c.auth_version + 1)
+        )
+
+
+class Blob(Base):
+    """A stored file, shared by all media with the same content."""
+
+    sha256: so.Mapped[str] = so.mapped_column(unique=True, index=True)
+    path: so.Mapped[str]
+    size: so.Mapped[int]
+    ref_count: so.Mapped[int] = so.mapped_column(default=0)
+
+
 class Media(Base):
     path: so.Mapped[str]
     content_type: so.Mapped[str]
     file_type: so.Mapped[str]
+    filename: so.Mapped[Optional[str]]
+    blob_id: so.Mapped[Optional[int]] = so.mapped_column(
+        sa.ForeignKey("blob.id", ondelete="SET NULL"), index=True
+    )
+    blob: so.Mapped[Optional["Blob"]] = so.relationship()
+    size: so.Mapped[Optional[int]]
+    # Image metadata, so that pages can lay out images and show placeholders without
+    # fetching them.
+    width: so.Mapped[Optional[int]]
+    height: so.Mapped[Optional[int]]
+    lqip: so.Mapped[Optional[str]] = so.mapped_column(sa.Text)
+    dominant_color: so.Mapped[Optional[str]]
+    # The responsive variants of images: [{"path", "width", "height", "content_type"}]
+    variants: so.Mapped[Optional[list]] = so.mapped_column(type_=sa.JSON)
+    # The settings the variants were generated with.
+    variant_spec: so.Mapped[Optional[str]]
+    # The encoding profiles of the small image and the variants, by name.
+    encoding: so.Mapped[Optional[dict]] = so.mapped_column(type_=sa.JSON)
+    # "pending", "ready" or "failed", the small image and variants, or the slide previews,
+    # exist once ready.
+    variant_state: so.Mapped[Optional[str]]
+    # The previews of the first pages of slides: [{"path", "page", "width", "height",
+    # "content_type"}], and their text, which is only loaded when accessed.
+    page_count: so.Mapped[Optional[int]]
+    previews: so.Mapped[Optional[list]] = so.mapped_column(type_=sa.JSON)
+    text: so.Mapped[Optional[str]] = so.mapped_column(sa.Text, deferred=True)
+    # Not stored, the job generating the variants is only known when uploading.
+    job_id = None
 
     @staticmethod
     def get_file_type(filename: str, content_type: str) -> str:
@@ -134,22 +221,67 @@ class Media(Base):
             return "unknown"
 
     @classmethod
-    def from_file(cls, filename: str) -> "Media":
+    def from_file(cls, filename: str, path: str | None = None) -> "Media":
         content_type = mimetypes.guess_type(filename)[0] or ""
         file_type = cls.get_file_type(filename, content_type)
-        return cls(path=filename, content_type=content_type, file_type=file_type)
+        return cls(
+            path=filename if path is None else path,
+            content_type=content_type,
+            file_type=file_type,
+        )
 
     @property
     def url(self) -> str:
-        return f"{current_app.config['MEDIA_URL']}/{self.path}"
+        return get_storage().url(self.path)
 
     @property
     def url_small(self) -> str:
+        if self.variant_state in ("pending", "failed"):
+            return self.url
+        if self.previews:
+            return get_storage().url(self.previews[0]["path"])
         stem, ext = os.path.splitext(self.path)
-        return f"{current_app.config['MEDIA_URL']}/{stem}{current_app.config['BAMBOO_SMALL_IMAGE_SUFFIX']}{ext}"
+        return get_storage().url(f"{stem}{current_app.config['BAMBOO_SMALL_IMAGE_SUFFIX']}{ext}")
+
+    @property
+    def srcset(self) -> list[dict]:
+        """The variants with their URLs, ordered by width, ready to build a srcset."""
+        storage = get_storage()
+        return [{**variant, "url": storage.url(variant["path"])} for variant in self.variants or []]
+
+    @property
+    def preview_images(self) -> list[dict]:
+        """The page previews of slides with their URLs."""
+        storage = get_storage()
+        return [{**preview, "url": storage.url(preview["path"])} for preview in self.previews or []]
+
+
+@sa.event.listens_for(Media, "after_insert")
+def acquire_blob(mapper, connection, target: Media) -> None:
+    if target.blob_id is not None:
+        blob_table = Blob.__table__
+        connection.execute(
+            blob_table.update()
+            .where(blob_table.c.id == target.blob_id)
+            .values(ref_count=blob_table.c.ref_count + 1)
+        )
+
+
+@sa.event.listens_for(Media, "after_delete")
+def release_blob(mapper, connection, target: Media) -> None:
+    if target.blob_id is not None:
+        blob_table = Blob.__table__
+        connection.execute(
+            blob_table.update()
+            .where(blob_table.c.id == target.blob_id)
+            .values(ref_count=blob_table.c.ref_count - 1)
+        )
 
 
 class Site(Base):
+    # The lists are paginated on (created_at, id), see bamboo.database.pagination.
+    __table_args__ = (sa.Index("ix_site_created_at_id", "created_at", "id"),)
+
     name: so.Mapped[str]
     config: so.Mapped[Optional[dict]] = so.mapped_column(type_=sa.JSON)
     template_url: so.Mapped[Optional[str]]
@@ -183,12 +315,13 @@ class Site(Base):
 
 
 class Page(Base):
+    # Pages are looked up by their path in the site.
+    __table_args__ = (sa.Index("ix_page_site_id_path", "site_id", "path", unique=True),)
+
     title: so.Mapped[str]
     path: so.Mapped[str]
     content: so.Mapped[str] = so.mapped_column(sa.Text)
-    site_id: so.Mapped[int] = so.mapped_column(
-        sa.ForeignKey("site.id", ondelete="CASCADE"), index=True
-    )
+    site_id: so.Mapped[int] = so.mapped_column(sa.ForeignKey("site.id", ondelete="CASCADE"))
     site: so.Mapped["Site"] = so.relationship(back_populates="pages")
 
 
@@ -265,6 +398,11 @@ class Category(Base):
 
 
 class Staff(BaseModel):
+    # The staff of a city are listed by creation time, the primary key breaking ties.
+    __table_args__ = (
+        sa.Index("ix_staff_city_id_created_at_staff_id", "city_id", "created_at", "staff_id"),
+    )
+
     created_at: so.Mapped[datetime] = so.mapped_column(default=func.now())
     updated_at: so.Mapped[datetime] = so.mapped_column(default=func.now(), onupdate=func.now())
     city_id: so.Mapped[int] = so.mapped_column(
@@ -279,6 +417,12 @@ class Staff(BaseModel):
 
 
 class City(Base):
+    # The cities of a site are listed by their start.
+    __table_args__ = (
+        sa.Index("ix_city_site_id_start", "site_id", "start"),
+        sa.Index("ix_city_created_at_id", "created_at", "id"),
+    )
+
     name: so.Mapped[str] = so.mapped_column(index=True)
     address: so.Mapped[Optional[str]]
     latitude: so.Mapped[Optional[str]]
@@ -287,9 +431,7 @@ class City(Base):
     end: so.Mapped[Optional[datetime]]
     registration_url: so.Mapped[Optional[str]]
     live_urls: so.Mapped[Optional[str]]
-    site_id: so.Mapped[int] = so.mapped_column(
-        sa.ForeignKey("site.id", ondelete="CASCADE"), index=True
-    )
+    site_id: so.Mapped[int] = so.mapped_column(sa.ForeignKey("site.id", ondelete="CASCADE"))
     site: so.Mapped["Site"] = so.relationship(back_populates="cities")
     staffs: so.WriteOnlyMapped["Staff"] = so.relationship(
         back_populates="city", cascade="all, delete-orphan", passive_deletes=True
@@ -303,6 +445,15 @@ class City(Base):
 
 
 class Partnership(BaseModel):
+    __table_args__ = (
+        sa.Index(
+            "ix_partnership_city_id_created_at_organization_id",
+            "city_id",
+            "created_at",
+            "organization_id",
+        ),
+    )
+
     city_id: so.Mapped[int] = so.mapped_column(
         sa.ForeignKey("city.id", ondelete="CASCADE"), primary_key=True
     )
@@ -329,12 +480,13 @@ class Organization(Base):
 
 
 class Blog(Base):
+    # Blogs are looked up by their path in the site.
+    __table_args__ = (sa.Index("ix_blog_site_id_path", "site_id", "path", unique=True),)
+
     title: so.Mapped[str]
     path: so.Mapped[str]
     content: so.Mapped[str] = so.mapped_column(sa.Text)
-    site_id: so.Mapped[int] = so.mapped_column(
-        sa.ForeignKey("site.id", ondelete="CASCADE"), index=True
-    )
+    site_id: so.Mapped[int] = so.mapped_column(sa.ForeignKey("site.id", ondelete="CASCADE"))
     site: so.Mapped["Site"] = so.relationship(back_populates="blogs")
     authors: so.WriteOnlyMapped["User"] = so.relationship(
         back_populates="blogs", secondary=blog_author
@@ -342,9 +494,10 @@ class Blog(Base):
 
 
 class ScheduleItem(Base):
-    venue_id: so.Mapped[int] = so.mapped_column(
-        sa.ForeignKey("venue.id", ondelete="CASCADE"), index=True
-    )
+    # The schedule of a venue is listed in time order.
+    __table_args__ = (sa.Index("ix_schedule_item_venue_id_start", "venue_id", "start"),)
+
+    venue_id: so.Mapped[int] = so.mapped_column(sa.ForeignKey("venue.id", ondelete="CASCADE"))
     talk_id: so.Mapped[Optional[int]] = so.mapped_column(
         sa.ForeignKey("talk.id", ondelete="CASCADE"), index=True
     )
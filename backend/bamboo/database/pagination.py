@@ -0,0 +1,56 @@
+from datetime import datetime
+from typing import Any, Mapping
+
+import sqlalchemy as sa
+from apiflask import abort
+
+from bamboo.database.models import db
+
+
+def sort_key_column(model: Any) -> sa.ColumnElement:
+    if db.session.get_bind().dialect.name == "sqlite":
+        # SQLite orders the datetimes as text, which is without the microseconds for the
+        # CURRENT_TIMESTAMP defaults and with them when written by SQLAlchemy. The cursor
+        # keeps the text as stored to compare exactly like the rows are ordered.
+        return sa.type_coerce(model.created_at, sa.String)
+    return model.created_at
+
+
+def paginate(query: sa.Select, model: Any, page_data: Mapping[str, Any]) -> dict[str, Any]:
+    """Get a page of the `model` items selected by `query`, newest first.
+
+    The pages are delimited by the `(created_at, *primary_key)` of their last item rather
+    than by an offset, so the deep pages are as cheap as the first one and don't shift
+    when items are added.
+    """
+    sort_key = sort_key_column(model)
+    columns = [sort_key, *sa.inspect(model).primary_key]
+    total = None
+    if page_data["total"]:
+        total = db.session.scalar(
+            sa.select(sa.func.count()).select_from(query.order_by(None).subquery())
+        )
+    if (cursor := page_data.get("cursor")) is not None:
+        if len(cursor) != len(columns):
+            abort(400, message="The cursor is not for this list.")
+        created_at, *key = cursor
+        if sort_key is model.created_at:
+            created_at = datetime.fromisoformat(created_at)
+        query = query.where(sa.tuple_(*columns) < sa.tuple_(created_at, *key))
+    limit = page_data["limit"]
+    rows = db.session.execute(
+        query.add_columns(sort_key.label("sort_key"))
+        .order_by(None)
+        .order_by(*(column.desc() for column in columns))
+        .limit(limit + 1)
+    ).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        item, created_at = rows[-1]
+        next_cursor = (created_at, *sa.inspect(item).identity)
+    return {"items": [row[0] for row in rows], "next": next_cursor, "total": total}
+
+
+def empty_page(page_data: Mapping[str, Any]) -> dict[str, Any]:
+    return {"items": [], "next": None, "total": 0 if page_data["total"] else None}
@@ -0,0 +1,57 @@
+import os
+import threading
+import time
+from typing import Any
+
+import sqlalchemy as sa
+from sqlalchemy.pool import QueuePool
+
+
+class InstrumentedQueuePool(QueuePool):
+    """A queue pool that also counts the checkouts that had to wait for a connection,
+    the time spent waiting and the checkouts that timed out.
+
+    The counters are per process, like the pool itself.
+    """
+
+    def __init__(self, *args: Any, **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+        self._stats_lock = threading.Lock()
+        self.waits = 0
+        self.wait_time = 0.0
+        self.timeouts = 0
+
+    def _do_get(self) -> Any:
+        # Neither an idle connection nor room for an overflow one.
+        waiting = (
+            self._pool.empty() and self._max_overflow > -1 and self._overflow >= self._max_overflow
+        )
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        except sa.exc.TimeoutError:
+            with self._stats_lock:
+                self.timeouts += 1
+            raise
+        finally:
+            if waiting:
+                with self._stats_lock:
+                    self.waits += 1
+                    self.wait_time += time.perf_counter() - start
+
+
+def get_pool_stats(name: str, engine: sa.Engine) -> dict[str, Any]:
+    pool = engine.pool
+    stats: dict[str, Any] = {"name": name, "pid": os.getpid(), "pool": type(pool).__name__}
+    if isinstance(pool, QueuePool):
+        stats.update(
+            size=pool.size(),
+            max_overflow=pool._max_overflow,
+            checked_out=pool.checkedout(),
+            checked_in=pool.checkedin(),
+            overflow=max(pool.overflow(), 0),
+        )
+    if isinstance(pool, InstrumentedQueuePool):
+        with pool._stats_lock:
+            stats.update(waits=pool.waits, wait_time=pool.wait_time, timeouts=pool.timeouts)
+    return stats
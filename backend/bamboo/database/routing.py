@@ -0,0 +1,83 @@
+import random
+from typing import Any
+
+import sqlalchemy as sa
+from flask import Flask, Response, current_app, g, has_app_context, request
+from flask_sqlalchemy.session import Session
+
+REPLICA_PREFIX = "replica-"
+# Set after a write, the reads of the client go to the primary until it expires.
+STICKY_COOKIE = "bamboo_primary"
+SAFE_METHODS = ("GET", "HEAD", "OPTIONS")
+# Views named so only read, they may be served by a replica.
+READ_VIEW_PREFIXES = ("get_", "list_")
+
+
+class RoutingSession(Session):
+    """Sends the SELECT statements of read-only requests to the replica picked for the
+    request, and everything else to the primary.
+    """
+
+    def get_bind(
+        self,
+        mapper: Any | None = None,
+        clause: Any | None = None,
+        bind: sa.Engine | sa.Connection | None = None,
+        **kwargs: Any,
+    ) -> sa.Engine | sa.Connection:
+        if (
+            bind is None
+            and not self._flushing
+            and isinstance(clause, sa.Select)
+            and clause._for_update_arg is None
+            and has_app_context()
+            and (replica := g.get("db_replica")) is not None
+        ):
+            return get_replicas()[replica]
+        return super().get_bind(mapper, clause=clause, bind=bind, **kwargs)
+
+
+def use_replica() -> None:
+    """Pick a replica for safe requests to read views, unless the client wrote recently."""
+    replicas = list(get_replicas())
+    if (
+        replicas
+        and request.method in SAFE_METHODS
+        and request.endpoint
+        and request.endpoint.rpartition(".")[2].startswith(READ_VIEW_PREFIXES)
+        and STICKY_COOKIE not in request.cookies
+    ):
+        g.db_replica = random.choice(replicas)
+
+
+def stick_to_primary(response: Response) -> Response:
+    if get_replicas() and request.method not in SAFE_METHODS and response.status_code < 400:
+        response.set_cookie(
+            STICKY_COOKIE,
+            "1",
+            max_age=current_app.config["BAMBOO_DB_STICKY_SECONDS"],
+            httponly=True,
+            samesite="Lax",
+        )
+    return response
+
+
+def forget_replica(exc: BaseException | None) -> None:
+    # The app context, and so g, outlives the request when it was pushed before it.
+    g.pop("db_replica", None)
+
+
+def get_replicas() -> dict[str, sa.Engine]:
+    return current_app.extensions["bamboo.replicas"]
+
+
+def configure_replicas(app: Flask) -> None:
+    # Not binds: Flask-SQLAlchemy would make a metadata for each, and create_all() the tables.
+    options = app.config.get("SQLALCHEMY_ENGINE_OPTIONS", {})
+    app.extensions["bamboo.replicas"] = {
+        f"{REPLICA_PREFIX}{i}": sa.create_engine(url, **options)
+        for i, url in enumerate(app.config["BAMBOO_DB_REPLICA_URLS"])
+    }
+    app.before_request(use_replica)
+    app.after_request(stick_to_primary)
+    app.teardown_request(forget_replica)
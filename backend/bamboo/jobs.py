@@ -1,25 +1,901 @@
+import base64
+import dataclasses
+import hashlib
+import io
+import logging
+import math
+import multiprocessing
+import os
+import posixpath
+import threading
+import time
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime
 from pathlib import Path
+from typing import Any, Callable, ClassVar, Iterable, Iterator, Mapping
 
 from flask import Flask, current_app
 from flask_rq2 import RQ
-from PIL import Image
+from flask_rq2.functions import JobFunctions
+from PIL import ExifTags, Image
+from redis import Redis
+from rq.exceptions import NoSuchJobError
+from rq.job import Callback, Job, JobStatus, Retry
+from rq.utils import str_to_date, utcnow
 
-rq = RQ()
+from bamboo.database import db
+from bamboo.database.models import Media
+from bamboo.storage import TEMP_DIR, get_storage
+from bamboo.utils import TTLCache, gen_uuid
+
+try:
+    from PIL import ImageCms
+except ImportError:  # Pillow built without LittleCMS
+    ImageCms = None
+
+try:
+    import pypdfium2 as pdfium
+except ImportError:  # Slides aren't processed without the slides extra
+    pdfium = None
+
+logger = logging.getLogger(__name__)
+
+
+@dataclasses.dataclass(frozen=True)
+class JobPolicy:
+    """How a job type is queued.
+
+    Jobs with a key get a deterministic id, so a job queued again while the previous one
+    is still pending collapses into it.
+    """
+
+    queue: str = "default"
+    timeout: int = 180
+    retries: int = 0
+    retry_intervals: tuple[int, ...] = (60,)
+    key: Callable[..., str] | None = None
+
+
+# Statuses of a job that will still run.
+PENDING_STATUSES = (JobStatus.QUEUED, JobStatus.STARTED, JobStatus.DEFERRED, JobStatus.SCHEDULED)
+
+
+def get_job_policy(name: str) -> JobPolicy:
+    """Get the policy of a job type, with the overrides from `BAMBOO_JOB_POLICIES`."""
+    policy = JOB_POLICIES.get(name, JobPolicy())
+    if overrides := current_app.config["BAMBOO_JOB_POLICIES"].get(name):
+        policy = dataclasses.replace(policy, **overrides)
+    return policy
+
+
+def make_job_id(name: str, key: str) -> str:
+    return f"{name}-{hashlib.blake2b(key.encode(), digest_size=16).hexdigest()}"
+
+
+@dataclasses.dataclass
+class LocalJob:
+    """A job run by an in-process backend, with the status of an RQ job.
+
+    The future is the outcome of the job, `attempt` the run in progress, which is None
+    while waiting to be retried.
+    """
+
+    id: str
+    future: "Future[Any]"
+    attempt: "Future[Any] | None" = None
+    enqueued_at: datetime = dataclasses.field(default_factory=utcnow)
+
+    def get_status(self) -> JobStatus:
+        if self.future.cancelled():
+            return JobStatus.CANCELED
+        if not self.future.done():
+            if (attempt := self.attempt) is None:
+                return JobStatus.SCHEDULED
+            return JobStatus.STARTED if attempt.running() else JobStatus.QUEUED
+        return JobStatus.FAILED if self.future.exception() is not None else JobStatus.FINISHED
+
+    def running(self) -> bool:
+        return (attempt := self.attempt) is not None and attempt.running()
+
+
+def call_job_in_context(app: Flask, func: Callable[..., Any], args: tuple, kwargs: dict) -> Any:
+    with app.app_context():
+        return func(*args, **kwargs)
+
+
+def init_job_worker(config_name: str) -> None:
+    """Create the app of a job worker process and keep its context pushed."""
+    from bamboo import create_app
+
+    create_app(config_name).app_context().push()
+
+
+class LocalJobBackend:
+    """Runs jobs in a thread or process pool of the app, or right away without one.
+
+    At most `max_pending` jobs are queued, running or waiting to be retried, further jobs
+    wait for a slot. Failed jobs are submitted again after the retry interval, the workers
+    don't wait for it. Without a pool, jobs run once in the caller, which would wait for
+    the retries otherwise. Unlike RQ, the job timeouts aren't enforced and pending jobs are
+    lost on exit.
+    """
+
+    def __init__(self, app: Flask, executor: Executor | None, max_pending: int) -> None:
+        self._app = app
+        self._executor = executor
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._pending: dict[str, LocalJob] = {}
+        # Finished jobs are kept for a while, so that their status can be checked.
+        self._finished: TTLCache[str, LocalJob] = TTLCache(maxsize=1024, ttl=3600)
+        self._lock = threading.Lock()
+
+    def get_job(self, job_id: str) -> LocalJob | None:
+        return self._pending.get(job_id) or self._finished.get(job_id)
+
+    def metrics(self) -> dict[str, Any]:
+        queued = [job for job in list(self._pending.values()) if not job.running()]
+        oldest = min((job.enqueued_at for job in queued), default=None)
+        return {
+            "name": "local",
+            "depth": len(queued),
+            "oldest_age": None if oldest is None else (utcnow() - oldest).total_seconds(),
+            "samples": 0,
+            "p50": None,
+            "p95": None,
+        }
+
+    def submit(
+        self,
+        func: Callable[..., Any],
+        args: tuple,
+        kwargs: dict,
+        job_id: str | None = None,
+        retry_intervals: Iterable[int] = (),
+    ) -> LocalJob:
+        if job_id is not None and (job := self._pending.get(job_id)) is not None:
+            return job
+        job_id = job_id or gen_uuid()
+        if self._executor is None:
+            future: Future[Any] = Future()
+            future.set_running_or_notify_cancel()
+            try:
+                future.set_result(func(*args, **kwargs))
+            except Exception as e:
+                logger.exception("Job %s failed", func.__name__)
+                future.set_exception(e)
+            job = LocalJob(job_id, future, attempt=future)
+            self._finished.set(job_id, job)
+            return job
+        self._slots.acquire()
+        with self._lock:
+            if (job := self._pending.get(job_id)) is not None:
+                self._slots.release()
+                return job
+            job = LocalJob(job_id, Future())
+            try:
+                self._run(self._executor, job, func, args, kwargs, iter(retry_intervals))
+            except BaseException:
+                self._slots.release()
+                raise
+            self._pending[job_id] = job
+        job.future.add_done_callback(lambda _: self._finish(job_id))
+        return job
+
+    def _run(
+        self,
+        executor: Executor,
+        job: LocalJob,
+        func: Callable[..., Any],
+        args: tuple,
+        kwargs: dict,
+        retry_intervals: Iterator[int],
+    ) -> None:
+        if isinstance(executor, ProcessPoolExecutor):
+            # The worker processes have their own app context.
+            attempt = executor.submit(func, *args, **kwargs)
+        else:
+            attempt = executor.submit(call_job_in_context, self._app, func, args, kwargs)
+        job.attempt = attempt
+
+        def done(attempt: "Future[Any]") -> None:
+            if attempt.cancelled():
+                job.future.cancel()
+            elif (e := attempt.exception()) is None:
+                job.future.set_result(attempt.result())
+            elif (interval := next(retry_intervals, None)) is None:
+                logger.error("Job %s failed", func.__name__, exc_info=e)
+                job.future.set_exception(e)
+            else:
+                logger.error("Job %s failed, retrying in %ss", func.__name__, interval, exc_info=e)
+                job.attempt = None
+                timer = threading.Timer(interval, retry)
+                timer.daemon = True
+                timer.start()
+
+        def retry() -> None:
+            try:
+                self._run(executor, job, func, args, kwargs, retry_intervals)
+            except Exception as e:  # The pool was shut down
+                job.future.set_exception(e)
+
+        attempt.add_done_callback(done)
+
+    def _finish(self, job_id: str) -> None:
+        with self._lock:
+            self._finished.set(job_id, self._pending.pop(job_id))
+        self._slots.release()
+
+
+def create_job_backend(app: Flask) -> LocalJobBackend | None:
+    """Create the in-process backend set by `BAMBOO_JOB_BACKEND`, or None for RQ."""
+    backend = app.config["BAMBOO_JOB_BACKEND"]
+    workers = app.config["BAMBOO_JOB_WORKERS"]
+    executor: Executor | None
+    if backend == "rq":
+        return None
+    elif backend == "thread":
+        executor = ThreadPoolExecutor(workers, thread_name_prefix="bamboo-jobs")
+    elif backend == "process":
+        executor = ProcessPoolExecutor(
+            workers,
+            # Fresh processes don't inherit the connections and locks of the app.
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=init_job_worker,
+            initargs=(app.config["BAMBOO_CONFIG_NAME"],),
+        )
+    elif backend == "sync":
+        executor = None
+    else:
+        raise ValueError(f"Unknown job backend: {backend}")
+    return LocalJobBackend(app, executor, app.config["BAMBOO_JOB_QUEUE_SIZE"])
+
+
+class PolicyJobFunctions(JobFunctions):
+    """Job functions queued according to the policy of their job type."""
+
+    functions: ClassVar[list[str]] = [*JobFunctions.functions, "job_id"]
+
+    def job_id(self, *args: Any, **kwargs: Any) -> str | None:
+        """Get the deterministic id of the job queued with these arguments, if it has one."""
+        name = self.wrapped.__name__
+        policy = get_job_policy(name)
+        if policy.key is None:
+            return None
+        return make_job_id(name, policy.key(*args, **kwargs))
+
+    def queue(self, *args: Any, **kwargs: Any) -> Job | LocalJob:
+        name = self.wrapped.__name__
+        policy = get_job_policy(name)
+        queue_name = kwargs.pop("queue", None) or policy.queue
+        timeout = kwargs.pop("timeout", policy.timeout)
+        job_id = kwargs.pop("job_id", None)
+        if job_id is None:
+            job_id = self.job_id(*args, **kwargs)
+
+        backend: LocalJobBackend | None = current_app.extensions.get("bamboo.job_backend")
+        if backend is not None:
+            # Retries like RQ does, the last interval repeats.
+            intervals = [
+                policy.retry_intervals[min(i, len(policy.retry_intervals) - 1)]
+                for i in range(policy.retries)
+            ]
+            return backend.submit(self.wrapped, args, kwargs, job_id, intervals)
+        queue = self.rq.get_queue(queue_name)
+
+        def enqueue() -> Job:
+            return queue.enqueue_call(
+                self.wrapped,
+                args=args,
+                kwargs=kwargs,
+                timeout=timeout,
+                result_ttl=self.result_ttl,
+                ttl=self.ttl,
+                job_id=job_id,
+                retry=Retry(policy.retries, list(policy.retry_intervals))
+                if policy.retries
+                else None,
+                description=self._description,
+                on_success=Callback(record_duration),
+                on_failure=Callback(record_duration),
+            )
+
+        if job_id is None:
+            return enqueue()
+        try:
+            job = queue.job_class.fetch(job_id, connection=queue.connection)
+        except NoSuchJobError:
+            pass
+        else:
+            if job.get_status() in PENDING_STATUSES:
+                return job
+        claim = f"bamboo:job-claim:{job_id}"
+        if not queue.connection.set(claim, 1, nx=True, ex=10):
+            # The same job is being queued concurrently.
+            return queue.job_class(job_id, connection=queue.connection)
+        try:
+            return enqueue()
+        finally:
+            queue.connection.delete(claim)
+
+
+# The latest execution times of the jobs of each queue.
+DURATIONS_KEY = "bamboo:job_durations:{}"
+DURATION_SAMPLES = 1000
+
+
+def record_duration(job: Job, connection: Redis, *args: Any) -> None:
+    """An RQ success and failure callback recording the execution time of the job."""
+    key = DURATIONS_KEY.format(job.origin)
+    pipe = connection.pipeline()
+    pipe.lpush(key, (job.ended_at - job.started_at).total_seconds())
+    pipe.ltrim(key, 0, DURATION_SAMPLES - 1)
+    pipe.execute()
+
+
+def percentile(values: list[float], p: float) -> float | None:
+    """Get the nearest-rank percentile of the sorted values."""
+    if not values:
+        return None
+    return values[max(math.ceil(p * len(values)) - 1, 0)]
+
+
+JOB_STATE_FIELDS = ("status", "origin", "enqueued_at", "started_at", "ended_at")
+
+
+def get_job_state(job_id: str) -> dict[str, Any] | None:
+    """Get the status and times of a job in one Redis round trip, or None if it's unknown."""
+    backend: LocalJobBackend | None = current_app.extensions.get("bamboo.job_backend")
+    if backend is not None:
+        if (job := backend.get_job(job_id)) is None:
+            return None
+        return {
+            "id": job_id,
+            "status": job.get_status().value,
+            "queue": "local",
+            "enqueued_at": job.enqueued_at,
+        }
+    status, origin, *times = rq.connection.hmget(Job.key_for(job_id), JOB_STATE_FIELDS)
+    if status is None:
+        return None
+    return {
+        "id": job_id,
+        "status": status.decode(),
+        "queue": origin and origin.decode(),
+        **{
+            field: str_to_date(value)
+            for field, value in zip(JOB_STATE_FIELDS[2:], times, strict=True)
+        },
+    }
+
+
+def get_queue_metrics() -> list[dict[str, Any]]:
+    """Get the depth, the age of the oldest job and the execution time percentiles
+    of each queue.
+    """
+    backend: LocalJobBackend | None = current_app.extensions.get("bamboo.job_backend")
+    if backend is not None:
+        return [backend.metrics()]
+    queues = [rq.get_queue(name) for name in current_app.config["RQ_QUEUES"]]
+    pipe = rq.connection.pipeline()
+    for queue in queues:
+        pipe.llen(queue.key)
+        pipe.lindex(queue.key, 0)
+        pipe.lrange(DURATIONS_KEY.format(queue.name), 0, -1)
+    results = pipe.execute()
+    heads = [head for head in results[1::3] if head is not None]
+    pipe = rq.connection.pipeline()
+    for head in heads:
+        pipe.hget(Job.key_for(head.decode()), "enqueued_at")
+    enqueued = dict(zip(heads, pipe.execute(), strict=True))
+    now = utcnow()
+    metrics = []
+    for queue, depth, head, durations in zip(
+        queues, results[0::3], results[1::3], results[2::3], strict=False
+    ):
+        oldest = str_to_date(enqueued.get(head))
+        durations = sorted(float(duration) for duration in durations)
+        metrics.append(
+            {
+                "name": queue.name,
+                "depth": depth,
+                "oldest_age": None if oldest is None else (now - oldest).total_seconds(),
+                "samples": len(durations),
+                "p50": percentile(durations, 0.5),
+                "p95": percentile(durations, 0.95),
+            }
+        )
+    return metrics
+
+
+class BambooRQ(RQ):
+    functions_class = "bamboo.jobs.PolicyJobFunctions"
+
+
+rq = BambooRQ()
+
+
+def variant_path(image_path: Path, suffix: str, ext: str | None = None) -> Path:
+    return image_path.parent / f"{image_path.stem}{suffix}{ext or image_path.suffix}"
+
+
+def save_atomic(image: Image.Image, path: Path, **params: Any) -> None:
+    """Save the image to a temporary file next to the path and move it into place,
+    so that the file is never seen half-written.
+    """
+    temp_path = path.with_name(f".{path.name}.{gen_uuid()}.tmp")
+    try:
+        image.save(temp_path, Image.registered_extensions()[path.suffix.lower()], **params)
+        os.replace(temp_path, path)
+    except BaseException:
+        temp_path.unlink(missing_ok=True)
+        raise
+
+
+class ImageTooLarge(Exception):
+    """Raised for images with more pixels than allowed, before they are decoded."""
+
+
+def check_image_size(image: Image.Image, max_pixels: int | None) -> None:
+    """Reject decompression bombs from the dimensions in the header."""
+    width, height = image.size
+    if max_pixels is not None and width * height > max_pixels:
+        raise ImageTooLarge(f"The image has {width}x{height} pixels, over {max_pixels}.")
+
+
+LQIP_SIZE = 16
+
+
+def image_placeholder(image: Image.Image) -> tuple[str, str]:
+    """Get a tiny base64 WebP placeholder and the dominant color of the image."""
+    thumb = image.convert("RGB")
+    thumb.thumbnail((64, 64))
+    palette = thumb.quantize(colors=8)
+    _, index = max(palette.getcolors())
+    red, green, blue = palette.getpalette()[index * 3 : index * 3 + 3]
+    thumb.thumbnail((LQIP_SIZE, LQIP_SIZE))
+    buffer = io.BytesIO()
+    thumb.save(buffer, "WEBP", quality=40)
+    lqip = "data:image/webp;base64," + base64.b64encode(buffer.getvalue()).decode()
+    return lqip, f"#{red:02x}{green:02x}{blue:02x}"
+
+
+# The transpositions applying the EXIF orientation, as in ImageOps.exif_transpose().
+ORIENTATION_TRANSPOSE = {
+    2: Image.Transpose.FLIP_LEFT_RIGHT,
+    3: Image.Transpose.ROTATE_180,
+    4: Image.Transpose.FLIP_TOP_BOTTOM,
+    5: Image.Transpose.TRANSPOSE,
+    6: Image.Transpose.ROTATE_270,
+    7: Image.Transpose.TRANSVERSE,
+    8: Image.Transpose.ROTATE_90,
+}
+
+
+@dataclasses.dataclass(frozen=True)
+class EncodingProfile:
+    """How generated images are encoded."""
+
+    quality: int = 80
+    progressive: bool = True
+    optimize: bool = True
+    # PNG images are quantized to this many colors, 0 keeps the full color.
+    png_colors: int = 256
+    # Drop EXIF and color profiles, the pixels are converted to sRGB first.
+    # The orientation is applied to the pixels either way.
+    strip_metadata: bool = True
+    # Also save the image in these formats, e.g. ("webp", "avif").
+    extra_formats: tuple[str, ...] = ()
+
+    def save_params(self, fmt: str) -> dict[str, Any]:
+        if fmt == "JPEG":
+            return {
+                "quality": self.quality,
+                "optimize": self.optimize,
+                "progressive": self.progressive,
+            }
+        if fmt == "PNG":
+            return {"optimize": self.optimize}
+        if fmt == "WEBP":
+            return {"quality": self.quality, "method": 6 if self.optimize else 4}
+        if fmt == "AVIF":
+            return {"quality": self.quality}
+        return {}
+
+
+ENCODING_PROFILES: dict[str, EncodingProfile] = {
+    # The small image of lists and cards.
+    "small": EncodingProfile(quality=70),
+    # The width-targeted variants, a profile named after the width ("w480") takes precedence.
+    "variant": EncodingProfile(quality=80, extra_formats=("webp",)),
+    # The page previews of slides.
+    "preview": EncodingProfile(quality=70),
+}
+
+
+def to_srgb(image: Image.Image, icc_profile: bytes | None) -> Image.Image:
+    if not icc_profile or ImageCms is None:
+        return image
+    try:
+        return ImageCms.profileToProfile(
+            image,
+            ImageCms.ImageCmsProfile(io.BytesIO(icc_profile)),
+            ImageCms.createProfile("sRGB"),
+            outputMode=image.mode,
+        )
+    except (ImageCms.PyCMSError, OSError, ValueError):
+        return image
+
+
+def encode_image(
+    image: Image.Image,
+    path: Path,
+    profile: EncodingProfile,
+    icc_profile: bytes | None,
+    exif: Image.Exif,
+) -> None:
+    fmt = Image.registered_extensions()[path.suffix.lower()]
+    params = profile.save_params(fmt)
+    if profile.strip_metadata:
+        image = to_srgb(image, icc_profile)
+    else:
+        if icc_profile:
+            params["icc_profile"] = icc_profile
+        params["exif"] = exif.tobytes()
+    if fmt == "PNG" and profile.png_colors:
+        method = Image.Quantize.FASTOCTREE if image.mode == "RGBA" else Image.Quantize.MEDIANCUT
+        image = image.quantize(profile.png_colors, method=method)
+    save_atomic(image, path, **params)
+
+
+def render_variants(
+    image_path: Path,
+    small_suffix: str,
+    small_ratio: float,
+    widths: Iterable[int],
+    profiles: Mapping[str, EncodingProfile] = ENCODING_PROFILES,
+    max_pixels: int | None = None,
+) -> dict[str, Any]:
+    """Generate the small image and the width-targeted variants from a single decode.
+
+    Variants are produced from the largest to the smallest, each one reduced from the
+    previous one. Widths not smaller than the original are skipped. The EXIF orientation
+    is applied, so the dimensions are those of the displayed image.
+
+    Images over `max_pixels` are rejected before decoding. JPEG images are decoded at the
+    smallest scale that covers the largest variant, other formats are decoded in full and
+    freed as soon as the largest variant is made from them.
+
+    Returns:
+        The image metadata: width, height, lqip, dominant_color, the width-targeted
+        variants, whose paths are relative to the image directory, and the encoding
+        profiles used.
+    """
+    with Image.open(image_path) as image:
+        check_image_size(image, max_pixels)
+        exif = image.getexif()
+        transpose = ORIENTATION_TRANSPOSE.get(exif.pop(ExifTags.Base.Orientation, 1))
+        icc_profile = image.info.get("icc_profile")
+        swapped = transpose in (
+            Image.Transpose.TRANSPOSE,
+            Image.Transpose.ROTATE_270,
+            Image.Transpose.TRANSVERSE,
+            Image.Transpose.ROTATE_90,
+        )
+        width, height = image.size[::-1] if swapped else image.size
+        targets = {
+            small_suffix: (max(int(width * small_ratio), 1), max(int(height * small_ratio), 1))
+        }
+        for target_width in widths:
+            if target_width < width:
+                targets[f"_w{target_width}"] = (
+                    target_width,
+                    max(round(height * target_width / width), 1),
+                )
+        largest = max(targets.values())
+        stored_largest = largest[::-1] if swapped else largest
+        # JPEG images can be decoded at a reduced scale directly.
+        image.draft(image.mode, stored_largest)
+        current: Image.Image = image
+        if current.mode in ("1", "P"):
+            current = current.convert("RGBA" if "transparency" in current.info else "RGB")
+        # The reducing gap shrinks by whole factors before resampling, without a full-size copy.
+        current = current.resize(stored_largest, Image.Resampling.LANCZOS, reducing_gap=3.0)
+    # Only the largest variant is kept in memory from here on.
+    if current.mode not in ("RGB", "RGBA"):
+        current = current.convert("RGBA" if "A" in current.mode else "RGB")
+    if transpose is not None:
+        current = current.transpose(transpose)
+    # The metadata is written by encode_image() only.
+    current.info = {}
+    variants = []
+    used_profiles = {}
+    for suffix, size in sorted(targets.items(), key=lambda item: item[1], reverse=True):
+        if current.size != size:
+            current = current.resize(size, Image.Resampling.LANCZOS, reducing_gap=3.0)
+        name = "small" if suffix == small_suffix else f"w{size[0]}"
+        profile = profiles.get(name) or profiles["variant"]
+        used_profiles[name] = dataclasses.asdict(profile)
+        exts = [image_path.suffix]
+        # Formats Pillow wasn't built with are skipped.
+        exts += [
+            f".{fmt}" for fmt in profile.extra_formats if f".{fmt}" in Image.registered_extensions()
+        ]
+        for ext in exts:
+            path = variant_path(image_path, suffix, ext)
+            encode_image(current, path, profile, icc_profile, exif)
+            if suffix != small_suffix:
+                variants.append(
+                    {
+                        "path": path.name,
+                        "width": size[0],
+                        "height": size[1],
+                        "content_type": Image.MIME[Image.registered_extensions()[ext]],
+                    }
+                )
+    lqip, dominant_color = image_placeholder(current)
+    return {
+        "width": width,
+        "height": height,
+        "lqip": lqip,
+        "dominant_color": dominant_color,
+        "variants": sorted(variants, key=lambda variant: variant["width"]),
+        "encoding": used_profiles,
+    }
+
+
+# PDFium isn't thread-safe.
+PDFIUM_LOCK = threading.Lock()
+# Previews of pages taller than this many times the width are cropped.
+PREVIEW_MAX_ASPECT = 4
+
+
+def slides_supported(path: str) -> bool:
+    return pdfium is not None and path.lower().endswith(".pdf")
+
+
+def render_slides(
+    pdf_path: Path,
+    preview_pages: int,
+    preview_width: int,
+    text_max_pages: int,
+    text_max_chars: int,
+    time_limit: float,
+    profile: EncodingProfile = ENCODING_PROFILES["preview"],
+) -> dict[str, Any]:
+    """Render JPEG previews of the first pages of a PDF and extract its text.
+
+    Pages are loaded one at a time and closed right after, and previews are rendered at
+    their final width, so the memory doesn't grow with the document. Pages are no longer
+    processed once `time_limit` seconds have passed, the text stops at `text_max_pages`
+    pages or `text_max_chars` characters.
+
+    Returns:
+        The page count, the previews, whose paths are relative to the PDF directory,
+        and the text, with the pages separated by form feeds.
+    """
+    deadline = time.monotonic() + time_limit
+    previews = []
+    texts: list[str] = []
+    chars = 0
+    with PDFIUM_LOCK:
+        pdf = pdfium.PdfDocument(pdf_path)
+        try:
+            page_count = len(pdf)
+            for index in range(min(page_count, max(preview_pages, text_max_pages))):
+                if index >= preview_pages and chars >= text_max_chars:
+                    # The remaining pages would produce nothing.
+                    break
+                if time.monotonic() > deadline:
+                    logger.warning("Stopped processing %s at page %d", pdf_path, index)
+                    break
+                page = pdf[index]
+                try:
+                    if index < preview_pages:
+                        width, height = page.get_size()
+                        scale = preview_width / width
+                        crop = max(height * scale - preview_width * PREVIEW_MAX_ASPECT, 0) / scale
+                        bitmap = page.render(scale=scale, crop=(0, crop, 0, 0))
+                        try:
+                            image = bitmap.to_pil()
+                        finally:
+                            bitmap.close()
+                        path = variant_path(pdf_path, f"_p{index + 1}", ".jpg")
+                        encode_image(image.convert("RGB"), path, profile, None, Image.Exif())
+                        previews.append(
+                            {
+                                "path": path.name,
+                                "page": index + 1,
+                                "width": image.width,
+                                "height": image.height,
+                                "content_type": "image/jpeg",
+                            }
+                        )
+                    if index < text_max_pages and chars < text_max_chars:
+                        textpage = page.get_textpage()
+                        try:
+                            # NUL can't be stored in PostgreSQL text.
+                            text = textpage.get_text_bounded().replace("\x00", "")
+                        finally:
+                            textpage.close()
+                        texts.append(text[: text_max_chars - chars])
+                        # Along with the separator.
+                        chars += len(texts[-1]) + 1
+                finally:
+                    page.close()
+        finally:
+            pdf.close()
+    return {"page_count": page_count, "previews": previews, "text": "\f".join(texts)}
+
+
+def encoding_profiles(config: Mapping[str, Any]) -> dict[str, EncodingProfile]:
+    """Get the encoding profiles, with the overrides from `BAMBOO_IMAGE_PROFILES`."""
+    extra_formats = tuple(
+        fmt
+        for fmt, enabled in (
+            ("webp", config["BAMBOO_IMAGE_VARIANT_WEBP"]),
+            ("avif", config["BAMBOO_IMAGE_VARIANT_AVIF"]),
+        )
+        if enabled
+    )
+    profiles = {
+        **ENCODING_PROFILES,
+        "variant": dataclasses.replace(ENCODING_PROFILES["variant"], extra_formats=extra_formats),
+    }
+    for name, overrides in config["BAMBOO_IMAGE_PROFILES"].items():
+        if "extra_formats" in overrides:
+            overrides = {**overrides, "extra_formats": tuple(overrides["extra_formats"])}
+        profiles[name] = dataclasses.replace(profiles.get(name, profiles["variant"]), **overrides)
+    return profiles
+
+
+def variant_options(config: Mapping[str, Any]) -> dict[str, Any]:
+    """Get the keyword arguments of `render_variants()` from the app config."""
+    return {
+        "small_suffix": config["BAMBOO_SMALL_IMAGE_SUFFIX"],
+        "small_ratio": config["BAMBOO_SMALL_IMAGE_RATIO"],
+        "widths": tuple(config["BAMBOO_IMAGE_VARIANT_WIDTHS"]),
+        "profiles": encoding_profiles(config),
+        "max_pixels": config["BAMBOO_IMAGE_MAX_PIXELS"],
+    }
+
+
+def variant_spec(config: Mapping[str, Any]) -> str:
+    """A signature of the variant settings, the variants are rebuilt when it changes."""
+    options = variant_options(config)
+    profiles = repr(sorted(options["profiles"].items())).encode()
+    return (
+        "{small_suffix}:{small_ratio}:{widths}:".format(**options)
+        + hashlib.blake2b(profiles, digest_size=8).hexdigest()
+    )
+
+
+def update_image_media(image_path: Path, **values: Any) -> None:
+    """Update all media of the image, or of any other file."""
+    media_dir = Path(current_app.config["BAMBOO_MEDIA_DIR"])
+    if not image_path.is_relative_to(media_dir):
+        return
+    path = image_path.relative_to(media_dir).as_posix()
+    db.session.execute(db.update(Media).where(Media.path == path).values(**values))
+    db.session.commit()
+
+
+def save_image_metadata(image_path: Path, metadata: dict[str, Any]) -> None:
+    """Record the result of `render_variants()` on all media of the image."""
+    config = current_app.config
+    media_dir = Path(config["BAMBOO_MEDIA_DIR"])
+    if not image_path.is_relative_to(media_dir):
+        return
+    path = image_path.relative_to(media_dir)
+    for variant in metadata["variants"]:
+        variant["path"] = (path.parent / variant["path"]).as_posix()
+    update_image_media(
+        image_path, variant_spec=variant_spec(config), variant_state="ready", **metadata
+    )
 
 
 @rq.job
 def gen_small_image(image_path: Path) -> None:
-    """Generate a small image from the given image."""
-    small_suffix = current_app.config["BAMBOO_SMALL_IMAGE_SUFFIX"]
-    small_ratio = current_app.config["BAMBOO_SMALL_IMAGE_RATIO"]
-    small_image_path = image_path.parent / f"{image_path.stem}{small_suffix}{image_path.suffix}"
-    with Image.open(image_path) as image:
-        width, height = image.size
-        small_width = int(width * small_ratio)
-        small_height = int(height * small_ratio)
-        with image.resize((small_width, small_height)) as small_image:
-            small_image.save(small_image_path)
+    """Generate a small image and the responsive variants from the given image,
+    and record them along with the image metadata on the media.
+
+    The image path is under the media directory, the image itself may be in another storage,
+    it's downloaded then and the generated files are uploaded next to it.
+    """
+    config = current_app.config
+    media_dir = Path(config["BAMBOO_MEDIA_DIR"])
+    options = variant_options(config)
+    storage = get_storage()
+    path = image_path.relative_to(media_dir).as_posix()
+    try:
+        with storage.local_copy(path, media_dir / TEMP_DIR) as local_path:
+            metadata = render_variants(local_path, **options)
+            names = [variant_path(local_path, options["small_suffix"]).name]
+            names += [variant["path"] for variant in metadata["variants"]]
+            for name in names:
+                storage.put_file(
+                    posixpath.join(posixpath.dirname(path), name), local_path.parent / name
+                )
+    except (ImageTooLarge, Image.DecompressionBombError):
+        # Uploads are checked already, retrying won't help.
+        logger.warning("Skipped the variants of %s, which is too large", image_path)
+        update_image_media(image_path, variant_state="failed")
+        return
+    except Exception:
+        # Retried jobs set it again when they succeed.
+        update_image_media(image_path, variant_state="failed")
+        raise
+    save_image_metadata(image_path, metadata)
+
+
+@rq.job
+def gen_slide_previews(pdf_path: Path) -> None:
+    """Render the page previews of PDF slides and extract their text,
+    and record them on the media.
+    """
+    config = current_app.config
+    media_dir = Path(config["BAMBOO_MEDIA_DIR"])
+    storage = get_storage()
+    path = pdf_path.relative_to(media_dir).as_posix()
+    try:
+        with storage.local_copy(path, media_dir / TEMP_DIR) as local_path:
+            result = render_slides(
+                local_path,
+                preview_pages=config["BAMBOO_SLIDE_PREVIEW_PAGES"],
+                preview_width=config["BAMBOO_SLIDE_PREVIEW_WIDTH"],
+                text_max_pages=config["BAMBOO_SLIDE_TEXT_MAX_PAGES"],
+                text_max_chars=config["BAMBOO_SLIDE_TEXT_MAX_CHARS"],
+                time_limit=config["BAMBOO_SLIDE_TIME_LIMIT"],
+                profile=encoding_profiles(config)["preview"],
+            )
+            for preview in result["previews"]:
+                name = preview["path"]
+                preview["path"] = posixpath.join(posixpath.dirname(path), name)
+                storage.put_file(preview["path"], local_path.parent / name)
+    except pdfium.PdfiumError:
+        # Broken or encrypted documents, retrying won't help.
+        logger.warning("Failed to process the slides %s", pdf_path, exc_info=True)
+        update_image_media(pdf_path, variant_state="failed")
+        return
+    except Exception:
+        update_image_media(pdf_path, variant_state="failed")
+        raise
+    update_image_media(pdf_path, variant_state="ready", **result)
+
+
+@rq.job
+def optimize_database() -> None:
+    """Refresh the query planner statistics of SQLite databases and checkpoint their WAL,
+    without waiting for the readers and writers.
+    """
+    for engine in db.engines.values():
+        if engine.dialect.name != "sqlite":
+            continue
+        with engine.connect() as connection:
+            connection.exec_driver_sql("PRAGMA optimize")
+            busy, frames, checkpointed = connection.exec_driver_sql(
+                "PRAGMA wal_checkpoint(PASSIVE)"
+            ).one()
+            logger.info(
+                "Checkpointed %s of %s WAL frames of %s", checkpointed, frames, engine.url.database
+            )
+
+
+def small_image_key(image_path: Path) -> str:
+    # Media of the same content share the image, so the path identifies the work.
+    return f"{image_path}:{variant_spec(current_app.config)}"
+
+
+JOB_POLICIES: dict[str, JobPolicy] = {
+    "gen_small_image": JobPolicy(
+        queue="high", timeout=300, retries=2, retry_intervals=(10, 60), key=small_image_key
+    ),
+    "gen_slide_previews": JobPolicy(queue="default", timeout=300, retries=1, key=str),
+    # A single job at a time, its key is always "".
+    "optimize_database": JobPolicy(queue="low", timeout=600, key=str),
+}
 
 
 def init_app(app: Flask) -> None:
     rq.init_app(app)
+    if (backend := create_job_backend(app)) is not None:
+        app.extensions["bamboo.job_backend"] = backend
@@ -0,0 +1,26 @@
+from apiflask import Schema
+from apiflask.fields import Float, Integer, String
+
+
+class CacheStatsOut(Schema):
+    name = String()
+    pid = Integer()
+    size = Integer()
+    hits = Integer()
+    misses = Integer()
+
+
+class PoolStatsOut(Schema):
+    name = String()
+    pid = Integer()
+    pool = String()
+    size = Integer()
+    max_overflow = Integer()
+    checked_out = Integer()
+    checked_in = Integer()
+    overflow = Integer()
+    # Checkouts that waited for a connection, the seconds spent waiting, and those that
+    # gave up after the pool timeout, since the process started.
+    waits = Integer()
+    wait_time = Float()
+    timeouts = Integer()
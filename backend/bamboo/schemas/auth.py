@@ -7,6 +7,10 @@ class LoginSchema(Schema):
     password = String(required=True)
 
 
+class LogoutSchema(Schema):
+    refresh_token = String()
+
+
 class TokenSchema(Schema):
     access_token = String()
     refresh_token = String()
@@ -1,6 +1,7 @@
 from apiflask import Schema
 from apiflask.fields import DateTime, Dict, Float, Integer, Nested, String
 
+from bamboo.schemas.pagination import page_of
 from bamboo.schemas.site import SiteOut
 
 
@@ -27,3 +28,6 @@ class CityOut(Schema):
     registration_url = String()
     live_urls = Dict()
     site = Nested(SiteOut)
+
+
+CityPageOut = page_of(CityOut)
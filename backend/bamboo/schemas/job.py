@@ -0,0 +1,21 @@
+from apiflask import Schema
+from apiflask.fields import DateTime, Float, Integer, String
+
+
+class JobOut(Schema):
+    id = String()
+    status = String()
+    queue = String()
+    enqueued_at = DateTime()
+    started_at = DateTime()
+    ended_at = DateTime()
+
+
+class QueueMetricsOut(Schema):
+    name = String()
+    depth = Integer()
+    # In seconds
+    oldest_age = Float()
+    samples = Integer()
+    p50 = Float()
+    p95 = Float()
@@ -1,9 +1,18 @@
+import os
+
 from apiflask import Schema
-from apiflask.fields import File, Integer, String
-from apiflask.validators import FileSize, FileType
+from apiflask.fields import File, Integer, List, Nested, String
+from apiflask.validators import FileSize, FileType, Range, Regexp, ValidationError
 
 IMAGE_SUFFIXES = {".png", ".jpg", ".jpeg"}
 SLIDES_SUFFIXES = {".ppt", ".pptx", ".pdf"}
+# 50 MB, in the decimal units of the FileSize validator
+MAX_UPLOAD_SIZE = 50_000_000
+
+
+def validate_suffix(filename: str) -> None:
+    if os.path.splitext(filename)[1].lower() not in IMAGE_SUFFIXES | SLIDES_SUFFIXES:
+        raise ValidationError("Not an allowed file type.")
 
 
 class MediaIn(Schema):
@@ -16,9 +25,50 @@ class MediaIn(Schema):
     )
 
 
+class MediaVariantOut(Schema):
+    url = String()
+    width = Integer()
+    height = Integer()
+    content_type = String()
+
+
+class MediaPreviewOut(MediaVariantOut):
+    page = Integer()
+
+
 class MediaOut(Schema):
     id = Integer()
     path = String()
     file_type = String()
     url = String()
     url_small = String()
+    srcset = List(Nested(MediaVariantOut))
+    size = Integer()
+    width = Integer()
+    height = Integer()
+    lqip = String()
+    dominant_color = String()
+    page_count = Integer()
+    previews = List(Nested(MediaPreviewOut), attribute="preview_images")
+    # url_small and srcset fall back to the original until it's "ready".
+    variant_state = String()
+    # The job generating the variants, only returned by uploads.
+    job_id = String()
+
+
+class UploadSessionIn(Schema):
+    filename = String(required=True, validate=validate_suffix)
+    size = Integer(required=True, validate=Range(min=1, max=MAX_UPLOAD_SIZE))
+    sha256 = String(validate=Regexp(r"^[0-9a-fA-F]{64}$"))
+
+
+class UploadSessionOut(Schema):
+    id = String()
+    filename = String()
+    size = Integer()
+    offset = Integer()
+
+
+class UploadFinalizeIn(Schema):
+    # Required unless given when creating the upload.
+    sha256 = String(validate=Regexp(r"^[0-9a-fA-F]{64}$"))
@@ -0,0 +1,58 @@
+import base64
+import binascii
+import json
+from datetime import datetime
+from typing import Any
+
+from apiflask import Schema
+from apiflask.fields import Boolean, Integer, List, Nested, String
+from apiflask.validators import Range, ValidationError
+
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+
+class Cursor(String):
+    """The sort key of the last item of a page, `(created_at, *primary_key)`, opaque to
+    the clients. The ISO `created_at` is kept as text, see bamboo.database.pagination.
+    """
+
+    def _serialize(self, value: Any, attr: str | None, obj: Any, **kwargs: Any) -> str | None:
+        if value is None:
+            return None
+        created_at, *key = value
+        if isinstance(created_at, datetime):
+            created_at = created_at.isoformat()
+        data = json.dumps([created_at, *key], separators=(",", ":"))
+        return base64.urlsafe_b64encode(data.encode()).decode().rstrip("=")
+
+    def _deserialize(self, value: Any, attr: str | None, data: Any, **kwargs: Any) -> tuple:
+        value = super()._deserialize(value, attr, data, **kwargs)
+        try:
+            created_at, *key = json.loads(base64.urlsafe_b64decode(value + "=" * (-len(value) % 4)))
+            datetime.fromisoformat(created_at)
+        except (binascii.Error, UnicodeDecodeError, TypeError, ValueError) as e:
+            raise ValidationError("Not a valid cursor.") from e
+        if not key or not all(isinstance(part, int) and not isinstance(part, bool) for part in key):
+            raise ValidationError("Not a valid cursor.")
+        return (created_at, *key)
+
+
+class PaginationIn(Schema):
+    limit = Integer(load_default=DEFAULT_PAGE_SIZE, validate=Range(min=1, max=MAX_PAGE_SIZE))
+    # The `next` cursor of the previous page.
+    cursor = Cursor()
+    # Counting all the items costs a query over the whole list.
+    total = Boolean(load_default=False)
+
+
+def page_of(item_schema: type[Schema]) -> type[Schema]:
+    """Make the output schema of a page of `item_schema` items, newest first."""
+    return Schema.from_dict(
+        {
+            "items": List(Nested(item_schema)),
+            "next": Cursor(allow_none=True),
+            "total": Integer(allow_none=True),
+        },
+        name=item_schema.__name__.removesuffix("Out") + "PageOut",
+    )
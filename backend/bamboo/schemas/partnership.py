@@ -1,6 +1,8 @@
 from apiflask import Schema
 from apiflask.fields import DateTime, Integer, String
 
+from bamboo.schemas.pagination import PaginationIn, page_of
+
 
 class PartnershipIn(Schema):
     city_id = Integer(required=True)
@@ -8,7 +10,7 @@ class PartnershipIn(Schema):
     category = String()
 
 
-class PartnershipByCityIn(Schema):
+class PartnershipByCityIn(PaginationIn):
     city_id = Integer()
 
 
@@ -23,3 +25,6 @@ class PartnershipOut(Schema):
     category = String()
     created_at = DateTime()
     updated_at = DateTime()
+
+
+PartnershipPageOut = page_of(PartnershipOut)
@@ -1,6 +1,8 @@
 from apiflask import Schema
 from apiflask.fields import Dict, Integer, String
 
+from bamboo.schemas.pagination import page_of
+
 
 class SiteIn(Schema):
     name = String(required=True)
@@ -19,3 +21,6 @@ class SiteOut(Schema):
     deploy_target = String()
     deploy_method = String()
     deploy_secret = String()
+
+
+SitePageOut = page_of(SiteOut)
@@ -3,6 +3,7 @@ from apiflask.fields import DateTime, Integer, Nested, String
 
 from bamboo.schemas.city import CityOut
 from bamboo.schemas.media import MediaOut
+from bamboo.schemas.pagination import PaginationIn, page_of
 
 
 class StaffIn(Schema):
@@ -11,7 +12,7 @@ class StaffIn(Schema):
     category = String(required=True)
 
 
-class StaffByCityIn(Schema):
+class StaffByCityIn(PaginationIn):
     city_id = Integer()
 
 
@@ -33,3 +34,6 @@ class StaffOut(Schema):
     category = String()
     created_at = DateTime()
     updated_at = DateTime()
+
+
+StaffPageOut = page_of(StaffOut)
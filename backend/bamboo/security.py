@@ -0,0 +1,221 @@
+import logging
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, TypeVar
+
+from flask import Flask, current_app
+from redis import Redis, RedisError
+from werkzeug.security import (
+    DEFAULT_PBKDF2_ITERATIONS,
+    check_password_hash,
+    generate_password_hash,
+)
+
+from bamboo.jobs import rq
+from bamboo.utils import BloomFilter
+
+T = TypeVar("T")
+logger = logging.getLogger(__name__)
+
+
+class HashingPoolFull(Exception):
+    """Raised when the hashing pool can't accept more work."""
+
+
+class HashingPool:
+    """A bounded executor for password hashing.
+
+    At most `max_workers` hashes are computed at the same time and at most `max_queue`
+    more are waiting, any further submission is rejected immediately instead of piling up.
+    """
+
+    def __init__(self, max_workers: int, max_queue: int) -> None:
+        self._executor = ThreadPoolExecutor(max_workers, thread_name_prefix="bamboo-hashing")
+        self._slots = threading.BoundedSemaphore(max_workers + max_queue)
+
+    def submit(self, fn: Callable[..., T], *args: Any, block: bool = False) -> "Future[T]":
+        if not self._slots.acquire(blocking=block):
+            raise HashingPoolFull("The password hashing pool is saturated.")
+        try:
+            future = self._executor.submit(fn, *args)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+
+def normalize_hash_method(method: str) -> str:
+    """Expand a werkzeug hash method to the full form stored in the hashes."""
+    name, *params = method.split(":")
+    if name == "scrypt" and not params:
+        return "scrypt:32768:8:1"
+    if name == "pbkdf2":
+        if not params:
+            params = ["sha256"]
+        if len(params) == 1:
+            params.append(str(DEFAULT_PBKDF2_ITERATIONS))
+        return ":".join([name, *params])
+    return method
+
+
+def get_hashing_pool() -> HashingPool:
+    return current_app.extensions["bamboo.hashing_pool"]
+
+
+def hash_password(password: str, block: bool = True) -> str:
+    """Hash the password with the configured method in the hashing pool."""
+    method = current_app.config["BAMBOO_PASSWORD_HASH_METHOD"]
+    return get_hashing_pool().submit(generate_password_hash, password, method, block=block).result()
+
+
+def check_password(password_hash: str, password: str, block: bool = False) -> bool:
+    """Check the password against the hash in the hashing pool.
+
+    Raises:
+        HashingPoolFull: If the pool is saturated and `block` is False.
+    """
+    return (
+        get_hashing_pool()
+        .submit(check_password_hash, password_hash, password, block=block)
+        .result()
+    )
+
+
+def password_needs_rehash(password_hash: str) -> bool:
+    """Whether the hash was generated with parameters other than the configured ones."""
+    method = current_app.config["BAMBOO_PASSWORD_HASH_METHOD"]
+    return password_hash.split("$", 1)[0] != normalize_hash_method(method)
+
+
+class RevocationList:
+    """Revoked token ids stored in Redis, fronted by an in-process Bloom filter.
+
+    The revoked ids live in a sorted set scored by the token expiry, so they can be pruned
+    once the tokens expire anyway. A second sorted set scored by the revocation time lets
+    every process pull only the ids revoked since its last sync. Ids not in the local filter
+    are known not to be revoked without asking Redis, which happens only on filter hits.
+
+    The syncs also pull a generation counter, bumped by `invalidate()` when users or roles
+    change, for the processes to drop the identities they cached.
+    """
+
+    key = "bamboo:revoked_jti"
+    log_key = "bamboo:revoked_jti:log"
+    generation_key = "bamboo:auth_generation"
+    # Ids revoked this long before the last one seen are fetched again in case of clock skew.
+    clock_skew = 5.0
+
+    def __init__(
+        self,
+        get_connection: Callable[[], Redis],
+        capacity: int,
+        error_rate: float,
+        sync_interval: float,
+        retention: float,
+    ) -> None:
+        self._get_connection = get_connection
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.sync_interval = sync_interval
+        self.retention = retention
+        self._bloom: BloomFilter | None = None
+        self._bloom_capacity = capacity
+        self._cursor = 0.0
+        self._synced_at = float("-inf")
+        # Redis isn't asked again before then after it failed.
+        self._retry_at = float("-inf")
+        self._lock = threading.Lock()
+        # Unknown until the first sync.
+        self.generation: int | None = None
+
+    @property
+    def connection(self) -> Redis:
+        return self._get_connection()
+
+    def revoke(self, jti: str, expires_at: float) -> None:
+        now = time.time()
+        pipe = self.connection.pipeline()
+        pipe.zadd(self.key, {jti: expires_at})
+        pipe.zadd(self.log_key, {jti: now})
+        pipe.zremrangebyscore(self.key, "-inf", now)
+        pipe.zremrangebyscore(self.log_key, "-inf", now - self.retention)
+        pipe.execute()
+        with self._lock:
+            if self._bloom is not None:
+                self._bloom.add(jti)
+
+    def invalidate(self) -> None:
+        """Bump the generation, for every process to drop its cached identities."""
+        self.connection.incr(self.generation_key)
+
+    def sync(self) -> None:
+        """Pull the ids revoked since the last sync, or rebuild the filter from scratch."""
+        with self._lock:
+            self._synced_at = time.monotonic()
+            try:
+                if self._bloom is None or self._bloom.count > self._bloom_capacity:
+                    self._rebuild()
+                else:
+                    revoked = self.connection.zrangebyscore(
+                        self.log_key, self._cursor - self.clock_skew, "+inf", withscores=True
+                    )
+                    for jti, revoked_at in revoked:
+                        self._bloom.add(jti.decode())
+                        self._cursor = max(self._cursor, revoked_at)
+                self.generation = int(self.connection.get(self.generation_key) or 0)
+            except RedisError as e:
+                self._retry_at = self._synced_at + self.sync_interval
+                logger.warning("Failed to sync the revoked tokens: %s", e)
+
+    def _rebuild(self) -> None:
+        now = time.time()
+        pipe = self.connection.pipeline()
+        pipe.zrangebyscore(self.key, now, "+inf")
+        pipe.zrevrange(self.log_key, 0, 0, withscores=True)
+        revoked, latest = pipe.execute()
+        self._bloom_capacity = max(self.capacity, 2 * len(revoked))
+        bloom = BloomFilter(self._bloom_capacity, self.error_rate)
+        for jti in revoked:
+            bloom.add(jti.decode())
+        self._bloom = bloom
+        self._cursor = latest[0][1] if latest else now
+
+    def sync_if_due(self) -> None:
+        if time.monotonic() - self._synced_at >= self.sync_interval:
+            self.sync()
+
+    def is_revoked(self, jti: str) -> bool:
+        self.sync_if_due()
+        bloom = self._bloom
+        if bloom is not None and jti not in bloom:
+            return False
+        # Only trust a filter hit when Redis can't confirm it, without a filter every token
+        # is accepted until Redis is back.
+        if time.monotonic() < self._retry_at:
+            return bloom is not None
+        try:
+            return self.connection.zscore(self.key, jti) is not None
+        except RedisError as e:
+            self._retry_at = time.monotonic() + self.sync_interval
+            logger.warning("Failed to check the revoked tokens: %s", e)
+            return bloom is not None
+
+
+def get_revocation_list() -> RevocationList:
+    return current_app.extensions["bamboo.revocation_list"]
+
+
+def init_app(app: Flask) -> None:
+    app.extensions["bamboo.hashing_pool"] = HashingPool(
+        max_workers=app.config["BAMBOO_HASHING_WORKERS"],
+        max_queue=app.config["BAMBOO_HASHING_QUEUE_SIZE"],
+    )
+    app.extensions["bamboo.revocation_list"] = RevocationList(
+        lambda: rq.connection,
+        capacity=app.config["BAMBOO_REVOCATION_CAPACITY"],
+        error_rate=app.config["BAMBOO_REVOCATION_ERROR_RATE"],
+        sync_interval=app.config["BAMBOO_REVOCATION_SYNC_INTERVAL"],
+        retention=app.config["BAMBOO_REFRESH_TOKEN_EXPIRES"].total_seconds(),
+    )
@@ -1,6 +1,11 @@
+import json
 import os
 import sys
+from datetime import timedelta
 from pathlib import Path
+from typing import Any, ClassVar
+
+from bamboo.database.pool import InstrumentedQueuePool
 
 BASE_DIR = Path(__file__).resolve().parent.parent.parent
 DATA_DIR = Path(data_dir) if (data_dir := os.getenv("DATA_DIR")) else BASE_DIR / "data"
@@ -9,13 +14,102 @@ DATA_DIR = Path(data_dir) if (data_dir := os.getenv("DATA_DIR")) else BASE_DIR /
 prefix = "sqlite:///" if sys.platform.startswith("win") else "sqlite:////"
 
 
+def getenv_bool(name: str, default: bool) -> bool:
+    if (value := os.getenv(name)) is None:
+        return default
+    return value.lower() in ("1", "true", "yes", "on")
+
+
 class BaseConfig:
     SECRET_KEY = os.getenv("SECRET_KEY", "dev key")
     MEDIA_URL = "/media"
     BAMBOO_MEDIA_DIR = os.getenv("BAMBOO_MEDIA_DIR", (DATA_DIR / "media").as_posix())
     BAMBOO_SMALL_IMAGE_SUFFIX = os.getenv("BAMBOO_SMALL_IMAGE_SUFFIX", "_small")
     BAMBOO_SMALL_IMAGE_RATIO: float = float(os.getenv("BAMBOO_SMALL_IMAGE_RATIO", "0.3"))
+    # Widths of the responsive image variants, each one is also saved as WebP if enabled.
+    BAMBOO_IMAGE_VARIANT_WIDTHS: tuple[int, ...] = tuple(
+        int(width) for width in os.getenv("BAMBOO_IMAGE_VARIANT_WIDTHS", "160,480,1024").split(",")
+    )
+    BAMBOO_IMAGE_VARIANT_WEBP = getenv_bool("BAMBOO_IMAGE_VARIANT_WEBP", True)
+    # Only used if Pillow supports AVIF.
+    BAMBOO_IMAGE_VARIANT_AVIF = getenv_bool("BAMBOO_IMAGE_VARIANT_AVIF", False)
+    # Overrides of the encoding profiles in bamboo.jobs, e.g. {"small": {"quality": 60}}
+    BAMBOO_IMAGE_PROFILES: dict[str, dict] = json.loads(os.getenv("BAMBOO_IMAGE_PROFILES", "{}"))
+    # PDF slides get previews of their first pages and their text extracted, with pypdfium2.
+    BAMBOO_SLIDE_PREVIEW_PAGES = int(os.getenv("BAMBOO_SLIDE_PREVIEW_PAGES", "3"))
+    BAMBOO_SLIDE_PREVIEW_WIDTH = int(os.getenv("BAMBOO_SLIDE_PREVIEW_WIDTH", "480"))
+    # The text extraction stops at whichever limit comes first, the time limit is in seconds.
+    BAMBOO_SLIDE_TEXT_MAX_PAGES = int(os.getenv("BAMBOO_SLIDE_TEXT_MAX_PAGES", "300"))
+    BAMBOO_SLIDE_TEXT_MAX_CHARS = int(os.getenv("BAMBOO_SLIDE_TEXT_MAX_CHARS", "200000"))
+    BAMBOO_SLIDE_TIME_LIMIT = float(os.getenv("BAMBOO_SLIDE_TIME_LIMIT", "60"))
+    # Images with more pixels are rejected from their header, before they are decoded.
+    BAMBOO_IMAGE_MAX_PIXELS = int(os.getenv("BAMBOO_IMAGE_MAX_PIXELS", "50000000"))
+    # Hand media bodies to the front proxy: "x-accel-redirect" (nginx) or "x-sendfile".
+    # For nginx, BAMBOO_MEDIA_ACCEL_PREFIX must be an internal location aliased to the media dir.
+    BAMBOO_MEDIA_OFFLOAD = os.getenv("BAMBOO_MEDIA_OFFLOAD", "")
+    BAMBOO_MEDIA_ACCEL_PREFIX = os.getenv("BAMBOO_MEDIA_ACCEL_PREFIX", "/_media")
+    # "local" keeps the media in BAMBOO_MEDIA_DIR, "s3" in a bucket shared by all the nodes.
+    # Uploads are staged in BAMBOO_MEDIA_DIR either way. The S3 credentials are read by boto3.
+    BAMBOO_STORAGE = os.getenv("BAMBOO_STORAGE", "local")
+    BAMBOO_S3_BUCKET = os.getenv("BAMBOO_S3_BUCKET", "")
+    BAMBOO_S3_PREFIX = os.getenv("BAMBOO_S3_PREFIX", "")
+    BAMBOO_S3_ENDPOINT_URL = os.getenv("BAMBOO_S3_ENDPOINT_URL")
+    BAMBOO_S3_REGION = os.getenv("BAMBOO_S3_REGION")
+    # The bucket or CDN URL the media are linked to, they are streamed by the app if unset.
+    BAMBOO_S3_PUBLIC_URL = os.getenv("BAMBOO_S3_PUBLIC_URL")
+    BAMBOO_S3_MAX_CONNECTIONS = int(os.getenv("BAMBOO_S3_MAX_CONNECTIONS", "10"))
+    BAMBOO_S3_MULTIPART_THRESHOLD = int(
+        os.getenv("BAMBOO_S3_MULTIPART_THRESHOLD", str(8 * 1024 * 1024))
+    )
+    # Applied to every new SQLite connection: readers don't block the writer in WAL mode,
+    # and NORMAL sync is still durable against application crashes in WAL mode.
+    BAMBOO_SQLITE_PRAGMAS: ClassVar[dict[str, str | int]] = {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "busy_timeout": 5000,
+        # In KiB when negative, per connection.
+        "cache_size": -16000,
+        "mmap_size": 256 * 1024 * 1024,
+        "temp_store": "MEMORY",
+        # The WAL file is truncated to this size after checkpoints.
+        "journal_size_limit": 64 * 1024 * 1024,
+        **json.loads(os.getenv("BAMBOO_SQLITE_PRAGMAS", "{}")),
+    }
+    # Read-only replicas, the get_*/list_* views read from one of them picked per request.
+    BAMBOO_DB_REPLICA_URLS: ClassVar[list[str]] = [
+        url for url in os.getenv("BAMBOO_DB_REPLICA_URLS", "").split(",") if url.strip()
+    ]
+    # Reads go to the primary for this long after a client writes, to see its own writes.
+    BAMBOO_DB_STICKY_SECONDS = int(os.getenv("BAMBOO_DB_STICKY_SECONDS", "10"))
+    # When the statistics are refreshed and the WAL checkpointed, empty to disable.
+    # Only with the rq job backend, the others don't run periodic jobs.
+    BAMBOO_SQLITE_OPTIMIZE_CRON = os.getenv("BAMBOO_SQLITE_OPTIMIZE_CRON", "17 * * * *")
     RQ_REDIS_URL = os.getenv("RQ_REDIS_URL", "redis://localhost:6379/0")
+    # "rq", or run the jobs in the app: "thread" or "process" pool, or "sync" right away.
+    BAMBOO_JOB_BACKEND = os.getenv("BAMBOO_JOB_BACKEND", "rq")
+    BAMBOO_JOB_WORKERS = int(os.getenv("BAMBOO_JOB_WORKERS", "2"))
+    BAMBOO_JOB_QUEUE_SIZE = int(os.getenv("BAMBOO_JOB_QUEUE_SIZE", "64"))
+    # Workers take jobs from the queues in this order.
+    RQ_QUEUES = os.getenv("RQ_QUEUES", "high,default,low").split(",")
+    # Overrides of the job policies in bamboo.jobs, e.g. {"gen_small_image": {"timeout": 600}}
+    BAMBOO_JOB_POLICIES: dict[str, dict] = json.loads(os.getenv("BAMBOO_JOB_POLICIES", "{}"))
+    BAMBOO_REFRESH_TOKEN_EXPIRES = timedelta(days=7)
+    # Revoked token ids are synced from Redis into a local Bloom filter every interval seconds.
+    BAMBOO_REVOCATION_SYNC_INTERVAL = float(os.getenv("BAMBOO_REVOCATION_SYNC_INTERVAL", "5"))
+    BAMBOO_REVOCATION_CAPACITY = int(os.getenv("BAMBOO_REVOCATION_CAPACITY", "100000"))
+    BAMBOO_REVOCATION_ERROR_RATE = float(os.getenv("BAMBOO_REVOCATION_ERROR_RATE", "0.001"))
+    # Verified tokens are cached per process, set the size to 0 to disable the cache. Changes
+    # to users and roles reach the other processes at their next revocation sync, the TTL
+    # only bounds how long they are missed while Redis is unreachable.
+    BAMBOO_TOKEN_CACHE_SIZE = int(os.getenv("BAMBOO_TOKEN_CACHE_SIZE", "1024"))
+    BAMBOO_TOKEN_CACHE_TTL = int(os.getenv("BAMBOO_TOKEN_CACHE_TTL", "60"))
+    # Embed the permission snapshot in access tokens and authorize from the claims alone.
+    BAMBOO_TOKEN_CLAIMS = getenv_bool("BAMBOO_TOKEN_CLAIMS", False)
+    BAMBOO_AUTH_VERSION_CACHE_TTL = int(os.getenv("BAMBOO_AUTH_VERSION_CACHE_TTL", "10"))
+    # Existing hashes are upgraded on login when the method changes.
+    BAMBOO_PASSWORD_HASH_METHOD = os.getenv("BAMBOO_PASSWORD_HASH_METHOD", "scrypt:32768:8:1")
+    BAMBOO_HASHING_WORKERS = int(os.getenv("BAMBOO_HASHING_WORKERS", "2"))
+    BAMBOO_HASHING_QUEUE_SIZE = int(os.getenv("BAMBOO_HASHING_QUEUE_SIZE", "8"))
 
     SWAGGER_UI_CSS = "https://cdnjs.cloudflare.com/ajax/libs/swagger-ui/5.11.0/swagger-ui.min.css"
     SWAGGER_UI_BUNDLE_JS = (
@@ -34,9 +128,38 @@ class TestingConfig(BaseConfig):
     RQ_CONNECTION_CLASS = "fakeredis.FakeStrictRedis"
 
 
+def postgres_connect_args(uri: str) -> dict[str, Any]:
+    """Server-side timeouts of PostgreSQL sessions, in milliseconds, 0 to disable.
+
+    They are sent as startup options, which poolers in transaction mode may not pass on.
+    """
+    if not uri.startswith("postgresql"):
+        return {}
+    timeouts = {
+        "statement_timeout": os.getenv("BAMBOO_DB_STATEMENT_TIMEOUT", "30000"),
+        "idle_in_transaction_session_timeout": os.getenv(
+            "BAMBOO_DB_IDLE_IN_TRANSACTION_TIMEOUT", "60000"
+        ),
+    }
+    return {"connect_args": {"options": " ".join(f"-c {k}={v}" for k, v in timeouts.items())}}
+
+
 class ProductionConfig(BaseConfig):
     RQ_REDIS_URL = os.getenv("RQ_REDIS_URL", "redis://redis:6379/0")
     SQLALCHEMY_DATABASE_URI = os.getenv("DATABASE_URL", prefix + (DATA_DIR / "data.db").as_posix())
+    # Per process: size the pools so that all the gunicorn and job workers fit in the
+    # server's max_connections. The waits and timeouts are reported at /api/admin/pools.
+    SQLALCHEMY_ENGINE_OPTIONS: ClassVar[dict[str, Any]] = {
+        "poolclass": InstrumentedQueuePool,
+        "pool_size": int(os.getenv("BAMBOO_DB_POOL_SIZE", "5")),
+        "max_overflow": int(os.getenv("BAMBOO_DB_MAX_OVERFLOW", "10")),
+        # Seconds to wait for a connection before giving up.
+        "pool_timeout": float(os.getenv("BAMBOO_DB_POOL_TIMEOUT", "10")),
+        # Seconds before connections are replaced, below the server and proxy idle timeouts.
+        "pool_recycle": int(os.getenv("BAMBOO_DB_POOL_RECYCLE", "1800")),
+        "pool_pre_ping": getenv_bool("BAMBOO_DB_POOL_PRE_PING", True),
+        **postgres_connect_args(SQLALCHEMY_DATABASE_URI),
+    }
 
 
 config: dict[str, type[BaseConfig]] = {
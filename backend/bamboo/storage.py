@@ -0,0 +1,440 @@
+import abc
+import contextlib
+import dataclasses
+import hashlib
+import json
+import mimetypes
+import os
+import posixpath
+import re
+import shutil
+import tempfile
+from datetime import datetime
+from pathlib import Path
+from typing import Any, BinaryIO, Iterator, Mapping
+
+from flask import Flask, current_app
+
+from bamboo.utils import gen_uuid
+
+try:
+    import fcntl
+except ImportError:  # Windows, where concurrent chunks aren't detected
+    fcntl = None
+
+CHUNK_SIZE = 64 * 1024
+TEMP_DIR = ".tmp"
+UPLOADS_DIR = ".uploads"
+
+
+def blob_path(sha256: str, suffix: str) -> str:
+    """Get the hash-sharded path of a blob, relative to the media directory."""
+    return f"{sha256[:2]}/{sha256[2:4]}/{sha256}{suffix.lower()}"
+
+
+@dataclasses.dataclass
+class StagedFile:
+    """A file written to the temporary directory, waiting to be moved into the storage."""
+
+    path: Path
+    sha256: str
+    size: int
+
+    def discard(self) -> None:
+        self.path.unlink(missing_ok=True)
+
+
+def stage_file(stream: BinaryIO, media_dir: Path) -> StagedFile:
+    """Stream the content to a temporary file while computing its SHA-256."""
+    temp_dir = media_dir / TEMP_DIR
+    temp_dir.mkdir(parents=True, exist_ok=True)
+    path = temp_dir / gen_uuid()
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        with path.open("wb") as f:
+            while chunk := stream.read(CHUNK_SIZE):
+                digest.update(chunk)
+                f.write(chunk)
+                size += len(chunk)
+    except BaseException:
+        path.unlink(missing_ok=True)
+        raise
+    return StagedFile(path=path, sha256=digest.hexdigest(), size=size)
+
+
+def file_sha256(path: Path) -> str:
+    digest = hashlib.sha256()
+    with path.open("rb") as f:
+        while chunk := f.read(CHUNK_SIZE):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class UploadError(Exception):
+    pass
+
+
+class UploadOffsetError(UploadError):
+    def __init__(self, offset: int) -> None:
+        super().__init__(f"Chunk must start at offset {offset}.")
+        self.offset = offset
+
+
+class UploadBusyError(UploadError):
+    def __init__(self) -> None:
+        super().__init__("Another chunk of the upload is being written.")
+
+
+@dataclasses.dataclass
+class UploadSession:
+    """A resumable upload, whose chunks are appended to a part file in order.
+
+    The state is kept next to the part file, so that any process can continue the upload,
+    and the offset is always the size of the part file. Writers hold an exclusive lock on
+    the part file, chunks sent while it's held are refused rather than interleaved.
+    """
+
+    id: str
+    filename: str
+    size: int
+    sha256: str | None
+    directory: Path
+
+    @staticmethod
+    def uploads_dir(media_dir: Path) -> Path:
+        # Under the temporary directory, so that finished uploads are moved, not copied.
+        return media_dir / TEMP_DIR / UPLOADS_DIR
+
+    @property
+    def part_path(self) -> Path:
+        return self.directory / f"{self.id}.part"
+
+    @property
+    def state_path(self) -> Path:
+        return self.directory / f"{self.id}.json"
+
+    @property
+    def offset(self) -> int:
+        return self.part_path.stat().st_size
+
+    @classmethod
+    def create(
+        cls, media_dir: Path, filename: str, size: int, sha256: str | None = None
+    ) -> "UploadSession":
+        directory = cls.uploads_dir(media_dir)
+        directory.mkdir(parents=True, exist_ok=True)
+        session = cls(gen_uuid(), filename, size, sha256, directory)
+        session.part_path.touch()
+        state = {"filename": filename, "size": size, "sha256": sha256}
+        session.state_path.write_text(json.dumps(state))
+        return session
+
+    @classmethod
+    def load(cls, media_dir: Path, session_id: str) -> "UploadSession | None":
+        if not re.fullmatch(r"[0-9a-f]{32}", session_id):
+            return None
+        directory = cls.uploads_dir(media_dir)
+        try:
+            state = json.loads((directory / f"{session_id}.json").read_text())
+        except FileNotFoundError:
+            return None
+        return cls(session_id, directory=directory, **state)
+
+    @contextlib.contextmanager
+    def locked_part(self) -> Iterator[BinaryIO]:
+        try:
+            f = self.part_path.open("r+b")
+        except FileNotFoundError:
+            raise UploadError("Upload is finalized.") from None
+        with f:
+            if fcntl is not None:
+                try:
+                    # Not waiting, the other request may be streaming a whole chunk.
+                    fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    raise UploadBusyError() from None
+            if not self.state_path.exists():
+                raise UploadError("Upload is finalized.")
+            yield f
+
+    def append(self, stream: BinaryIO, start: int, length: int) -> int:
+        """Append a chunk starting at `start`, which must be the current offset.
+
+        Returns:
+            The new offset.
+        """
+        if start + length > self.size:
+            raise UploadError("Chunk exceeds the upload size.")
+        with self.locked_part() as f:
+            # Another chunk may have been appended since the offset was read.
+            if start != (offset := os.fstat(f.fileno()).st_size):
+                raise UploadOffsetError(offset)
+            f.seek(start)
+            written = 0
+            try:
+                while written < length and (
+                    chunk := stream.read(min(CHUNK_SIZE, length - written))
+                ):
+                    f.write(chunk)
+                    written += len(chunk)
+            finally:
+                if written != length:
+                    # Drop the incomplete chunk, so it can be sent again.
+                    f.truncate(start)
+        if written != length:
+            raise UploadError("Incomplete chunk.")
+        return start + length
+
+    def stage(self, sha256: str | None = None) -> StagedFile:
+        """Verify the complete upload and turn it into a staged file.
+
+        The checksum is given either here or when creating the session.
+        """
+        expected = sha256 or self.sha256
+        if expected is None:
+            raise UploadError("The SHA-256 of the upload is required.")
+        with self.locked_part():
+            if self.offset != self.size:
+                raise UploadError(f"Upload is incomplete, {self.offset} of {self.size} bytes.")
+            digest = file_sha256(self.part_path)
+            if digest != expected.lower():
+                raise UploadError("Checksum mismatch.")
+            self.state_path.unlink()
+        return StagedFile(path=self.part_path, sha256=digest, size=self.size)
+
+
+@dataclasses.dataclass
+class FileInfo:
+    path: str
+    size: int
+    mtime_ns: int
+
+
+class Storage(abc.ABC):
+    """Where the media files are kept, addressed by paths relative to the storage root.
+
+    Uploads are always staged on the local disk, and moved into the storage once complete.
+    """
+
+    @abc.abstractmethod
+    def put(self, path: str, stream: BinaryIO) -> None:
+        """Store the content of the stream."""
+
+    @abc.abstractmethod
+    def put_file(self, path: str, local_path: Path) -> None:
+        """Move a local file into the storage."""
+
+    @abc.abstractmethod
+    def open(self, path: str) -> BinaryIO:
+        """Open the file for reading, it's streamed rather than read at once."""
+
+    @abc.abstractmethod
+    def stat(self, path: str) -> FileInfo | None:
+        """Get the size and mtime of the file, or None if it doesn't exist."""
+
+    @abc.abstractmethod
+    def url(self, path: str) -> str:
+        pass
+
+    @abc.abstractmethod
+    def delete(self, path: str) -> None:
+        """Delete the file, missing files are ignored."""
+
+    @abc.abstractmethod
+    def iter_files(self) -> Iterator[FileInfo]:
+        pass
+
+    @contextlib.contextmanager
+    def local_copy(self, path: str, temp_dir: Path) -> Iterator[Path]:
+        """Download the file into a directory of its own under `temp_dir`.
+
+        Files written next to the copy are removed along with it.
+        """
+        temp_dir.mkdir(parents=True, exist_ok=True)
+        with tempfile.TemporaryDirectory(dir=temp_dir) as directory:
+            local_path = Path(directory) / posixpath.basename(path)
+            with self.open(path) as src, local_path.open("wb") as dst:
+                shutil.copyfileobj(src, dst, CHUNK_SIZE)
+            yield local_path
+
+
+class LocalStorage(Storage):
+    """Files in a local directory, served under `base_url`."""
+
+    def __init__(self, root: Path, base_url: str) -> None:
+        self.root = root
+        self.base_url = base_url
+
+    def put(self, path: str, stream: BinaryIO) -> None:
+        staged = stage_file(stream, self.root)
+        self.put_file(path, staged.path)
+
+    def put_file(self, path: str, local_path: Path) -> None:
+        target = self.root / path
+        if target == local_path:
+            return
+        target.parent.mkdir(parents=True, exist_ok=True)
+        os.replace(local_path, target)
+
+    def open(self, path: str) -> BinaryIO:
+        return (self.root / path).open("rb")
+
+    def stat(self, path: str) -> FileInfo | None:
+        try:
+            st = (self.root / path).stat()
+        except (FileNotFoundError, NotADirectoryError):
+            return None
+        return FileInfo(path, st.st_size, st.st_mtime_ns)
+
+    def url(self, path: str) -> str:
+        return f"{self.base_url}/{path}"
+
+    def delete(self, path: str) -> None:
+        (self.root / path).unlink(missing_ok=True)
+
+    def iter_files(self, directory: Path | None = None) -> Iterator[FileInfo]:
+        with os.scandir(directory or self.root) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    yield from self.iter_files(Path(entry.path))
+                elif entry.is_file(follow_symlinks=False):
+                    st = entry.stat(follow_symlinks=False)
+                    path = Path(entry.path).relative_to(self.root).as_posix()
+                    yield FileInfo(path, st.st_size, st.st_mtime_ns)
+
+    @contextlib.contextmanager
+    def local_copy(self, path: str, temp_dir: Path) -> Iterator[Path]:
+        # Files written next to it are already in place.
+        yield self.root / path
+
+
+class S3Storage(Storage):
+    """Objects in an S3-compatible bucket, shared by all the app and worker nodes.
+
+    One client is used per process, its connection pool is sized by `max_connections`.
+    Files over `multipart_threshold` bytes are uploaded in parts of that size, in parallel.
+    Files are linked from `public_url`, the bucket or a CDN in front of it, if set, otherwise
+    they are streamed by the app under `base_url`.
+    """
+
+    def __init__(
+        self,
+        bucket: str,
+        base_url: str,
+        prefix: str = "",
+        endpoint_url: str | None = None,
+        region: str | None = None,
+        public_url: str | None = None,
+        max_connections: int = 10,
+        multipart_threshold: int = 8 * 1024 * 1024,
+    ) -> None:
+        try:
+            import boto3
+            from boto3.s3.transfer import TransferConfig
+            from botocore.config import Config
+        except ImportError as e:  # pragma: no cover
+            raise RuntimeError("The S3 storage requires boto3, install bamboo[s3].") from e
+        self.client = boto3.client(
+            "s3",
+            endpoint_url=endpoint_url or None,
+            region_name=region or None,
+            config=Config(max_pool_connections=max_connections, retries={"mode": "standard"}),
+        )
+        self.transfer_config = TransferConfig(
+            multipart_threshold=multipart_threshold,
+            multipart_chunksize=multipart_threshold,
+            max_concurrency=max_connections,
+        )
+        self.bucket = bucket
+        self.base_url = base_url
+        self.prefix = prefix.strip("/") + "/" if prefix.strip("/") else ""
+        self.public_url = public_url.rstrip("/") if public_url else None
+
+    def key(self, path: str) -> str:
+        return self.prefix + path
+
+    def put(self, path: str, stream: BinaryIO) -> None:
+        self.client.upload_fileobj(
+            stream,
+            self.bucket,
+            self.key(path),
+            ExtraArgs=self._extra_args(path),
+            Config=self.transfer_config,
+        )
+
+    def put_file(self, path: str, local_path: Path) -> None:
+        self.client.upload_file(
+            str(local_path),
+            self.bucket,
+            self.key(path),
+            ExtraArgs=self._extra_args(path),
+            Config=self.transfer_config,
+        )
+        local_path.unlink()
+
+    def _extra_args(self, path: str) -> dict[str, str]:
+        content_type = mimetypes.guess_type(path)[0]
+        return {"ContentType": content_type} if content_type else {}
+
+    def open(self, path: str) -> BinaryIO:
+        try:
+            return self.client.get_object(Bucket=self.bucket, Key=self.key(path))["Body"]
+        except self.client.exceptions.NoSuchKey:
+            raise FileNotFoundError(path) from None
+
+    def stat(self, path: str) -> FileInfo | None:
+        try:
+            head = self.client.head_object(Bucket=self.bucket, Key=self.key(path))
+        except self.client.exceptions.ClientError as e:
+            if e.response["Error"]["Code"] in ("404", "NoSuchKey"):
+                return None
+            raise
+        return FileInfo(path, head["ContentLength"], _timestamp_ns(head["LastModified"]))
+
+    def url(self, path: str) -> str:
+        if self.public_url is not None:
+            return f"{self.public_url}/{self.key(path)}"
+        return f"{self.base_url}/{path}"
+
+    def delete(self, path: str) -> None:
+        self.client.delete_object(Bucket=self.bucket, Key=self.key(path))
+
+    def iter_files(self) -> Iterator[FileInfo]:
+        paginator = self.client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=self.prefix):
+            for obj in page.get("Contents", ()):
+                yield FileInfo(
+                    obj["Key"][len(self.prefix) :],
+                    obj["Size"],
+                    _timestamp_ns(obj["LastModified"]),
+                )
+
+
+def _timestamp_ns(dt: datetime) -> int:
+    return int(dt.timestamp() * 1_000_000) * 1000
+
+
+def create_storage(config: Mapping[str, Any]) -> Storage:
+    if (name := config["BAMBOO_STORAGE"]) == "local":
+        return LocalStorage(Path(config["BAMBOO_MEDIA_DIR"]), config["MEDIA_URL"])
+    if name == "s3":
+        return S3Storage(
+            bucket=config["BAMBOO_S3_BUCKET"],
+            base_url=config["MEDIA_URL"],
+            prefix=config["BAMBOO_S3_PREFIX"],
+            endpoint_url=config["BAMBOO_S3_ENDPOINT_URL"],
+            region=config["BAMBOO_S3_REGION"],
+            public_url=config["BAMBOO_S3_PUBLIC_URL"],
+            max_connections=config["BAMBOO_S3_MAX_CONNECTIONS"],
+            multipart_threshold=config["BAMBOO_S3_MULTIPART_THRESHOLD"],
+        )
+    raise ValueError(f"Unknown storage: {name}")
+
+
+def get_storage() -> Storage:
+    return current_app.extensions["bamboo.storage"]
+
+
+def init_app(app: Flask) -> None:
+    app.extensions["bamboo.storage"] = create_storage(app.config)
@@ -1,14 +1,26 @@
+import hashlib
+import math
+import threading
+import time
 import uuid
+from collections import OrderedDict
 from datetime import UTC, datetime, timedelta
 from typing import (
     Any,
+    Callable,
     Container,
+    Generic,
+    Hashable,
     Iterable,
     MutableMapping,
+    TypeVar,
 )
 
 from jose import jwt
 
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+
 
 def utc_now() -> datetime:
     """Get the current time in UTC."""
@@ -104,3 +116,108 @@ def decode_jwt(
 def gen_uuid() -> str:
     """Generate a uuid hex string."""
     return str(uuid.uuid4().hex)
+
+
+class TTLCache(Generic[K, V]):
+    """A thread-safe LRU cache whose entries expire after a TTL.
+
+    Every entry expires after `ttl` seconds at the latest, or earlier if an explicit
+    `expires_at` (a `time.time()` timestamp) is given when it is set.
+
+    Args:
+        maxsize: The maximum number of entries, the least recently used ones are evicted first.
+            A non-positive value disables the cache.
+        ttl: The maximum lifetime of an entry in seconds.
+    """
+
+    def __init__(self, maxsize: int, ttl: float) -> None:
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data: OrderedDict[K, tuple[float, V]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: K) -> V | None:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None or item[0] <= time.monotonic():
+                if item is not None:
+                    del self._data[key]
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return item[1]
+
+    def set(self, key: K, value: V, expires_at: float | None = None) -> None:
+        if self.maxsize <= 0:
+            return
+        lifetime = self.ttl
+        if expires_at is not None:
+            lifetime = min(lifetime, expires_at - time.time())
+        if lifetime <= 0:
+            return
+        with self._lock:
+            self._data[key] = (time.monotonic() + lifetime, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key: K) -> V | None:
+        with self._lock:
+            item = self._data.pop(key, None)
+        return None if item is None else item[1]
+
+    def discard_if(self, predicate: Callable[[V], bool]) -> int:
+        """Remove all entries whose value matches the predicate, return the number removed."""
+        with self._lock:
+            keys = [key for key, (_, value) in self._data.items() if predicate(value)]
+            for key in keys:
+                del self._data[key]
+        return len(keys)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> dict[str, int]:
+        """Get the size and the hit/miss counters of the cache."""
+        return {"size": len(self._data), "hits": self.hits, "misses": self.misses}
+
+
+class BloomFilter:
+    """A Bloom filter of strings.
+
+    Args:
+        capacity: The expected number of items.
+        error_rate: The false positive rate when the filter holds `capacity` items.
+    """
+
+    def __init__(self, capacity: int, error_rate: float = 0.001) -> None:
+        capacity = max(capacity, 1)
+        self.size = math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)
+        self.hash_count = max(1, round(self.size / capacity * math.log(2)))
+        self.count = 0
+        self._bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, item: str) -> Iterable[int]:
+        # Kirsch-Mitzenmacher double hashing from a single digest.
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return ((h1 + i * h2) % self.size for i in range(self.hash_count))
+
+    def add(self, item: str) -> None:
+        for position in self._positions(item):
+            self._bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, item: str) -> bool:
+        bits = self._bits
+        return all(
+            bits[position >> 3] & (1 << (position & 7)) for position in self._positions(item)
+        )
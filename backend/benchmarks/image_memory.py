@@ -0,0 +1,80 @@
+"""Peak memory of generating the image variants, per input size and format.
+
+Run from the backend directory:
+
+    python -m benchmarks.image_memory [--sizes 1000,2000,4000,8000] [--formats png,jpg]
+
+Every measurement runs in a fresh process, the peak RSS of the process is reported along with
+the RSS of a full decode of the same file for comparison.
+"""
+import argparse
+import multiprocessing
+import resource
+import tempfile
+import time
+from pathlib import Path
+from typing import Callable
+
+from PIL import Image
+
+from bamboo.jobs import render_variants
+
+
+def peak_rss_mb() -> float:
+    # Kilobytes on Linux.
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def full_decode(path: Path) -> None:
+    with Image.open(path) as image:
+        image.convert("RGB")
+
+
+def variants(path: Path) -> None:
+    render_variants(path, "_small", 0.3, (160, 480, 1024))
+
+
+def baseline(path: Path) -> None:
+    pass
+
+
+def measure(func: Callable[[Path], None], path: Path) -> tuple[float, float]:
+    start = time.perf_counter()
+    func(path)
+    return peak_rss_mb(), time.perf_counter() - start
+
+
+def create_image(path: Path, size: int) -> None:
+    # Noise doesn't compress, like photos, so the file sizes are realistic.
+    with Image.effect_noise((size, size), 64) as noise:
+        Image.merge("RGB", (noise, noise.transpose(Image.Transpose.ROTATE_90), noise)).save(path)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", default="1000,2000,4000,8000")
+    parser.add_argument("--formats", default="png,jpg")
+    args = parser.parse_args()
+
+    context = multiprocessing.get_context("spawn")
+    with tempfile.TemporaryDirectory() as directory, context.Pool(1, maxtasksperchild=1) as pool:
+        base_rss, _ = pool.apply(measure, (baseline, Path(directory)))
+        print(f"baseline process: {base_rss:.0f} MB")
+        print(f"{'input':>16} {'file':>8} {'full decode':>12} {'variants':>10} {'time':>7}")
+        for size in map(int, args.sizes.split(",")):
+            for fmt in args.formats.split(","):
+                path = Path(directory) / f"{size}.{fmt}"
+                pool.apply(create_image, (path, size))
+                decode_rss, _ = pool.apply(measure, (full_decode, path))
+                variants_rss, elapsed = pool.apply(measure, (variants, path))
+                print(
+                    f"{size:>6}x{size:<6} {fmt:>3} {path.stat().st_size / 1e6:>6.1f}MB "
+                    f"{decode_rss - base_rss:>10.0f}MB {variants_rss - base_rss:>8.0f}MB "
+                    f"{elapsed:>6.2f}s"
+                )
+                for generated in Path(directory).glob(f"{size}_*"):
+                    generated.unlink()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""Per-request overhead of the token revocation check.
+
+Run from the backend directory:
+
+    python -m benchmarks.revocation [--revoked 100000] [--checks 100000]
+
+A fake Redis server is used by default, pass `--redis-url` to measure against a real one,
+where the network hop saved by the Bloom filter matters much more.
+"""
+import argparse
+import time
+import uuid
+
+import fakeredis
+from redis import Redis
+
+from bamboo.security import RevocationList
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--revoked", type=int, default=100_000)
+    parser.add_argument("--checks", type=int, default=100_000)
+    parser.add_argument("--redis-url")
+    args = parser.parse_args()
+
+    connection = Redis.from_url(args.redis_url) if args.redis_url else fakeredis.FakeStrictRedis()
+    connection.delete(RevocationList.key, RevocationList.log_key)
+    expires_at = time.time() + 3600
+    revoked = [uuid.uuid4().hex for _ in range(args.revoked)]
+    pipe = connection.pipeline(transaction=False)
+    for jti in revoked:
+        pipe.zadd(RevocationList.key, {jti: expires_at})
+        pipe.zadd(RevocationList.log_key, {jti: time.time()})
+    pipe.execute()
+
+    revocations = RevocationList(
+        lambda: connection,
+        capacity=args.revoked,
+        error_rate=0.001,
+        sync_interval=float("inf"),
+        retention=7 * 86400,
+    )
+    start = time.perf_counter()
+    revocations.sync()
+    print(f"initial sync of {args.revoked} revoked ids: {time.perf_counter() - start:.3f}s")
+
+    candidates = [uuid.uuid4().hex for _ in range(args.checks)]
+    start = time.perf_counter()
+    hits = sum(revocations.is_revoked(jti) for jti in candidates)
+    elapsed = time.perf_counter() - start
+    print(
+        f"not-revoked check: {elapsed / args.checks * 1e6:.2f}us per request "
+        f"({hits} false positives confirmed by Redis)"
+    )
+
+    start = time.perf_counter()
+    for jti in candidates[:1000]:
+        connection.zscore(RevocationList.key, jti)
+    elapsed = time.perf_counter() - start
+    print(f"Redis lookup without the filter: {elapsed / 1000 * 1e6:.2f}us per request")
+
+    sample = revoked[: args.checks]
+    start = time.perf_counter()
+    assert all(revocations.is_revoked(jti) for jti in sample)
+    elapsed = time.perf_counter() - start
+    print(f"revoked check: {elapsed / len(sample) * 1e6:.2f}us per request")
+
+
+if __name__ == "__main__":
+    main()
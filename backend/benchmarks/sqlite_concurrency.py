@@ -0,0 +1,109 @@
+"""Reads and writes overlapping on SQLite, with the default and the configured pragmas.
+
+Run from the backend directory:
+
+    python -m benchmarks.sqlite_concurrency [--readers 4] [--seconds 5]
+
+One thread writes rows in small transactions while the readers query the table. In the
+rollback journal mode a write locks out every reader until it commits, in WAL mode the
+readers keep going on the last committed snapshot.
+"""
+import argparse
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+import sqlalchemy as sa
+
+from bamboo.database.models import use_sqlite_pragmas
+from bamboo.settings import BaseConfig
+
+
+def run(db_path: Path, pragmas: dict, readers: int, seconds: float) -> dict[str, float]:
+    engine = sa.create_engine(f"sqlite:///{db_path}", pool_size=readers + 1)
+    use_sqlite_pragmas(engine, pragmas)
+    with engine.begin() as connection:
+        connection.exec_driver_sql(
+            "CREATE TABLE item (id INTEGER PRIMARY KEY, name TEXT, created REAL)"
+        )
+        connection.exec_driver_sql("CREATE INDEX ix_item_created ON item (created)")
+    stop = threading.Event()
+    counts = {"writes": 0, "reads": 0, "busy": 0}
+    read_latencies: list[float] = []
+    lock = threading.Lock()
+
+    def write() -> None:
+        with engine.connect() as connection:
+            while not stop.is_set():
+                try:
+                    with connection.begin():
+                        for _ in range(10):
+                            connection.exec_driver_sql(
+                                "INSERT INTO item (name, created) VALUES (?, ?)",
+                                ("x" * 100, time.time()),
+                            )
+                except sa.exc.OperationalError:
+                    with lock:
+                        counts["busy"] += 1
+                    continue
+                with lock:
+                    counts["writes"] += 10
+
+    def read() -> None:
+        with engine.connect() as connection:
+            while not stop.is_set():
+                start = time.perf_counter()
+                try:
+                    connection.exec_driver_sql(
+                        "SELECT count(*), max(created) FROM item WHERE created > ?",
+                        (time.time() - 1,),
+                    ).one()
+                    connection.rollback()
+                except sa.exc.OperationalError:
+                    connection.rollback()
+                    with lock:
+                        counts["busy"] += 1
+                    continue
+                with lock:
+                    counts["reads"] += 1
+                    read_latencies.append(time.perf_counter() - start)
+
+    threads = [threading.Thread(target=write)]
+    threads += [threading.Thread(target=read) for _ in range(readers)]
+    for thread in threads:
+        thread.start()
+    time.sleep(seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    engine.dispose()
+    read_latencies.sort()
+    return {
+        "writes/s": counts["writes"] / seconds,
+        "reads/s": counts["reads"] / seconds,
+        "busy errors": counts["busy"],
+        "read p99 ms": read_latencies[int(len(read_latencies) * 0.99)] * 1000
+        if read_latencies
+        else float("nan"),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--readers", type=int, default=4)
+    parser.add_argument("--seconds", type=float, default=5)
+    args = parser.parse_args()
+
+    profiles = {
+        "default": {"busy_timeout": 5000},
+        "configured": BaseConfig.BAMBOO_SQLITE_PRAGMAS,
+    }
+    with tempfile.TemporaryDirectory() as directory:
+        for name, pragmas in profiles.items():
+            result = run(Path(directory) / f"{name}.db", pragmas, args.readers, args.seconds)
+            print(f"{name:>10}: " + ", ".join(f"{k} {v:,.1f}" for k, v in result.items()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,31 @@
+import pytest
+
+from bamboo.blueprints.auth import Permission
+
+
+@pytest.mark.parametrize("permission", [Permission.CONTENT])
+def test_pool_stats_permission(client, auth):
+    assert client.get("/api/admin/pools").status_code == 401
+    assert client.get("/api/admin/pools", auth=auth).status_code == 403
+
+
+@pytest.mark.parametrize("permission", [Permission.SITE])
+def test_pool_stats(client, auth):
+    response = client.get("/api/admin/pools", auth=auth)
+    assert response.status_code == 200, response.json
+    # The in-memory test database has a single connection.
+    [stats] = response.json
+    assert stats["name"] == "default"
+    assert stats["pool"] == "StaticPool"
+    assert "checked_out" not in stats
+
+
+@pytest.mark.parametrize("permission", [Permission.SITE])
+def test_cache_stats(client, auth):
+    assert client.get("/api/admin/caches", auth=auth).status_code == 200
+    response = client.get("/api/admin/caches", auth=auth)
+    stats = {cache["name"]: cache for cache in response.json}
+    assert stats["token"]["size"] == 1
+    assert stats["token"]["hits"] == 1
+    assert stats["token"]["misses"] == 1
+    assert "auth_version" in stats
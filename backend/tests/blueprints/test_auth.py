@@ -1,8 +1,16 @@
 from flask import current_app
-
-from bamboo.blueprints.auth import Permission, token_auth
+from redis import RedisError
+from werkzeug.security import generate_password_hash
+
+from bamboo.blueprints.auth import (
+    Permission,
+    get_auth_version_cache,
+    get_token_cache,
+    token_auth,
+)
 from bamboo.database import db, models
-from bamboo.utils import encode_jwt
+from bamboo.security import HashingPoolFull, RevocationList, get_revocation_list
+from bamboo.utils import decode_jwt, encode_jwt
 
 
 def test_auth_required(app, client):
@@ -188,3 +196,235 @@ def test_refresh(client):
     rv = client.post("/api/auth/refresh", headers={"Authorization": f"Bearer {token}"})
     assert rv.status_code == 200
     assert rv.json["access_token"] is not None
+
+
+def test_token_cache(app, client):
+    role = models.Role(name="manage_user", permissions=Permission.USER)
+    profile = models.Media.from_file("test.png")
+    user = models.User(name="test", profile_image=profile, role=role)
+    db.session.add_all([user, profile, role])
+    db.session.commit()
+
+    @app.get("/user-only")
+    @token_auth.auth_required(permissions=Permission.USER)
+    def manage_user_only():
+        return {"message": "Success"}
+
+    cache = get_token_cache()
+    token = encode_jwt(payload={"user_id": user.id}, secret_key=current_app.config["SECRET_KEY"])
+    headers = {"Authorization": f"Bearer {token}"}
+
+    rv = client.get("/user-only", headers=headers)
+    assert rv.status_code == 200
+    assert cache.stats() == {"size": 1, "hits": 0, "misses": 1}
+
+    rv = client.get("/user-only", headers=headers)
+    assert rv.status_code == 200
+    assert cache.stats() == {"size": 1, "hits": 1, "misses": 1}
+
+    # Changing the role drops the cached identities of its users.
+    role.permissions = Permission.SITE
+    db.session.commit()
+    assert len(cache) == 0
+    rv = client.get("/user-only", headers=headers)
+    assert rv.status_code == 403
+
+    # So does changing the user.
+    user.active = False
+    db.session.commit()
+    assert len(cache) == 0
+    rv = client.get("/user-only", headers=headers)
+    assert rv.status_code == 401
+
+
+def test_token_cache_broadcast(app, client):
+    role = models.Role(name="manage_user", permissions=Permission.USER)
+    user = models.User(name="test", profile_image=models.Media.from_file("test.png"), role=role)
+    db.session.add(user)
+    db.session.commit()
+    revocation_list = get_revocation_list()
+    revocation_list.sync_interval = 0
+    generation = int(revocation_list.connection.get(revocation_list.generation_key) or 0)
+
+    token = encode_jwt(payload={"user_id": user.id}, secret_key=current_app.config["SECRET_KEY"])
+    headers = {"Authorization": f"Bearer {token}"}
+    assert client.get("/api/auth/current", headers=headers).status_code == 200
+    cache = get_token_cache()
+    assert len(cache) == 1
+
+    # Other changes don't affect the identities.
+    user.name = "renamed"
+    role.name = "renamed"
+    db.session.commit()
+    assert int(revocation_list.connection.get(revocation_list.generation_key) or 0) == generation
+    assert len(cache) == 1
+
+    # Committed changes are announced to the other processes.
+    user.is_superuser = True
+    db.session.commit()
+    assert int(revocation_list.connection.get(revocation_list.generation_key)) == generation + 1
+    user.is_superuser = False
+    db.session.flush()
+    db.session.rollback()
+    assert int(revocation_list.connection.get(revocation_list.generation_key)) == generation + 1
+
+    # And another process drops its cached identities at the next sync.
+    assert client.get("/api/auth/current", headers=headers).status_code == 200
+    assert len(cache) == 1
+    revocation_list.invalidate()
+    assert client.get("/api/auth/current", headers=headers).status_code == 200
+    assert cache.stats()["misses"] == 3
+
+
+def test_token_claims(app, client):
+    app.config["BAMBOO_TOKEN_CLAIMS"] = True
+    role = models.Role(name="manage_user", permissions=Permission.USER)
+    profile = models.Media.from_file("test.png")
+    user = models.User(name="test", username="test", profile_image=profile, role=role)
+    user.password = "123456"
+    db.session.add_all([user, profile, role])
+    db.session.commit()
+
+    @app.get("/user-only")
+    @token_auth.auth_required(permissions=Permission.USER)
+    def manage_user_only():
+        return {"message": "Success"}
+
+    rv = client.post("/api/auth/login", json={"username": "test", "password": "123456"})
+    token = rv.json["access_token"]
+    payload = decode_jwt(token, secret_key=current_app.config["SECRET_KEY"])
+    assert payload["perms"] == Permission.USER
+    assert payload["su"] is False
+    assert payload["ver"] == user.auth_version
+
+    headers = {"Authorization": f"Bearer {token}"}
+    rv = client.get("/user-only", headers=headers)
+    assert rv.status_code == 200
+    assert get_auth_version_cache().get(user.id) == (user.auth_version, True)
+
+    # Changing the permissions of the role revokes the token.
+    role.permissions = Permission.USER | Permission.SITE
+    db.session.commit()
+    rv = client.get("/user-only", headers=headers)
+    assert rv.status_code == 401
+
+    rv = client.post("/api/auth/login", json={"username": "test", "password": "123456"})
+    headers = {"Authorization": f"Bearer {rv.json['access_token']}"}
+    rv = client.get("/user-only", headers=headers)
+    assert rv.status_code == 200
+
+    user.active = False
+    db.session.commit()
+    rv = client.get("/user-only", headers=headers)
+    assert rv.status_code == 401
+
+
+def test_login_rehash(app, client):
+    role = models.Role(name="manage_user", permissions=Permission.USER)
+    profile = models.Media.from_file("test.png")
+    user = models.User(name="test", username="test", profile_image=profile, role=role)
+    user.password_hash = generate_password_hash("123456", method="pbkdf2:sha256:1000")
+    db.session.add_all([user, profile, role])
+    db.session.commit()
+    auth_version = user.auth_version
+    revocation_list = get_revocation_list()
+    generation = revocation_list.connection.get(revocation_list.generation_key)
+
+    rv = client.post("/api/auth/login", json={"username": "test", "password": "123456"})
+    assert rv.status_code == 200
+    assert user.password_hash.startswith(app.config["BAMBOO_PASSWORD_HASH_METHOD"] + "$")
+    assert user.validate_password("123456")
+    # The tokens issued before stay valid, and the cached ones too.
+    assert user.auth_version == auth_version
+    assert revocation_list.connection.get(revocation_list.generation_key) == generation
+
+    user.password = "654321"
+    db.session.commit()
+    assert user.auth_version == auth_version + 1
+
+
+def test_login_rehash_saturated(app, client, mocker):
+    profile = models.Media.from_file("test.png")
+    admin = models.User(name="admin", username="admin", profile_image=profile, is_superuser=True)
+    admin.password_hash = generate_password_hash("123456", method="pbkdf2:sha256:1000")
+    db.session.add_all([admin, profile])
+    db.session.commit()
+
+    # The password is checked, but there's no room to compute the new hash.
+    mocker.patch("bamboo.blueprints.auth.hash_password", side_effect=HashingPoolFull)
+    rv = client.post("/api/auth/login", json={"username": "admin", "password": "123456"})
+    assert rv.status_code == 200
+    assert admin.password_hash.startswith("pbkdf2:sha256:1000$")
+
+
+def test_login_saturated(client, mocker):
+    profile = models.Media.from_file("test.png")
+    admin = models.User(name="admin", username="admin", profile_image=profile, is_superuser=True)
+    admin.password = "123456"
+    db.session.add_all([admin, profile])
+    db.session.commit()
+
+    mocker.patch("bamboo.security.HashingPool.submit", side_effect=HashingPoolFull)
+    rv = client.post("/api/auth/login", json={"username": "admin", "password": "123456"})
+    assert rv.status_code == 429
+    assert rv.headers["Retry-After"] == "1"
+
+
+def test_logout(client, mocker):
+    role = models.Role(name="manage_user", permissions=Permission.USER)
+    profile = models.Media.from_file("test.png")
+    user = models.User(name="test", username="test", profile_image=profile, role=role)
+    user.password = "123456"
+    db.session.add_all([user, profile, role])
+    db.session.commit()
+
+    rv = client.post("/api/auth/login", json={"username": "test", "password": "123456"})
+    tokens = rv.json
+    headers = {"Authorization": f"Bearer {tokens['access_token']}"}
+    rv = client.get("/api/auth/current", headers=headers)
+    assert rv.status_code == 200
+
+    rv = client.post(
+        "/api/auth/logout", headers=headers, json={"refresh_token": tokens["refresh_token"]}
+    )
+    assert rv.status_code == 204
+
+    rv = client.get("/api/auth/current", headers=headers)
+    assert rv.status_code == 401
+    assert rv.json["message"] == "Token has been revoked."
+    rv = client.post(
+        "/api/auth/refresh", headers={"Authorization": f"Bearer {tokens['refresh_token']}"}
+    )
+    assert rv.status_code == 401
+
+    rv = client.post("/api/auth/login", json={"username": "test", "password": "123456"})
+    headers = {"Authorization": f"Bearer {rv.json['access_token']}"}
+    revoke = mocker.patch.object(RevocationList, "revoke", side_effect=RedisError)
+    rv = client.post("/api/auth/logout", headers=headers)
+    assert rv.status_code == 503
+    assert rv.headers["Retry-After"] == "5"
+    revoke.side_effect = None
+    rv = client.post("/api/auth/logout", headers=headers)
+    assert rv.status_code == 204
+
+
+def test_refresh_rotation(client):
+    role = models.Role(name="manage_user", permissions=Permission.USER)
+    profile = models.Media.from_file("test.png")
+    user = models.User(name="test", username="test", profile_image=profile, role=role)
+    user.password = "123456"
+    db.session.add_all([user, profile, role])
+    db.session.commit()
+
+    rv = client.post("/api/auth/login", json={"username": "test", "password": "123456"})
+    refresh_token = rv.json["refresh_token"]
+
+    rv = client.post("/api/auth/refresh", headers={"Authorization": f"Bearer {refresh_token}"})
+    assert rv.status_code == 200
+    new_refresh_token = rv.json["refresh_token"]
+    assert new_refresh_token != refresh_token
+
+    rv = client.post("/api/auth/refresh", headers={"Authorization": f"Bearer {refresh_token}"})
+    assert rv.status_code == 401
+    rv = client.post("/api/auth/refresh", headers={"Authorization": f"Bearer {new_refresh_token}"})
+    assert rv.status_code == 200
@@ -13,7 +13,7 @@ def test_get_cities_permission(client):
 def test_get_cities(client, auth):
     response = client.get("api/city/all", auth=auth)
     assert response.status_code == 200
-    assert response.json == []
+    assert response.json["items"] == []
 
     site = models.Site(name="Somewhere")
     city = models.City(name="Shanghai", site=site)
@@ -22,8 +22,8 @@ def test_get_cities(client, auth):
 
     response = client.get("api/city/all", auth=auth)
     assert response.status_code == 200
-    assert len(response.json) == 1
-    assert response.json[0]["name"] == city.name
+    assert len(response.json["items"]) == 1
+    assert response.json["items"][0]["name"] == city.name
 
 
 @pytest.mark.parametrize("permission", [Permission.USER])
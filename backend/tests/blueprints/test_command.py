@@ -0,0 +1,99 @@
+import os
+from datetime import datetime
+from pathlib import Path
+
+from PIL import Image
+
+from bamboo.database import db, models
+from bamboo.jobs import rq
+from bamboo.storage import create_storage
+
+
+def test_rebuild_variants(app):
+    app.config["BAMBOO_IMAGE_VARIANT_WIDTHS"] = (40,)
+    media_dir = Path(app.config["BAMBOO_MEDIA_DIR"])
+    image_path = media_dir / "rebuild.png"
+    with Image.new("RGB", (100, 50)) as image:
+        image.save(image_path)
+    media = models.Media.from_file("rebuild.png")
+    duplicate = models.Media.from_file("rebuild.png")
+    db.session.add_all([media, duplicate, models.Media.from_file("slides.pdf")])
+    db.session.commit()
+
+    runner = app.test_cli_runner()
+    result = runner.invoke(args=["media", "rebuild-variants", "--workers", "1"])
+    assert result.exit_code == 0, result.output
+    assert "1 rebuilt, 0 skipped, 0 failed" in result.output
+    db.session.expire_all()
+    assert [variant["width"] for variant in media.variants] == [40, 40]
+    assert duplicate.variants == media.variants
+
+    result = runner.invoke(args=["media", "rebuild-variants", "--workers", "1"])
+    assert "0 rebuilt, 1 skipped, 0 failed" in result.output
+
+    # Changing the settings makes the variants stale.
+    app.config["BAMBOO_IMAGE_VARIANT_WIDTHS"] = (40, 80)
+    result = runner.invoke(args=["media", "rebuild-variants", "--workers", "1"])
+    assert "1 rebuilt, 0 skipped, 0 failed" in result.output
+    db.session.expire_all()
+    assert [variant["width"] for variant in media.variants] == [40, 40, 80, 80]
+
+    result = runner.invoke(args=["media", "rebuild-variants", "--force", "--enqueue"])
+    assert "1 queued, 0 skipped, 0 failed" in result.output
+    assert rq.get_queue("low").count == 1
+
+    image_path.unlink()
+    (media_dir / "rebuild_small.png").unlink()
+    for variant in media.variants:
+        (media_dir / variant["path"]).unlink()
+
+
+def test_gc(app, tmp_path):
+    app.config["BAMBOO_MEDIA_DIR"] = tmp_path.as_posix()
+    app.extensions["bamboo.storage"] = create_storage(app.config)
+    old = datetime(2000, 1, 1)
+    for name in ("aa/shared.png", "aa/shared_small.png", "bb/gone.png", "bb/gone_small.png"):
+        (tmp_path / name).parent.mkdir(exist_ok=True)
+        (tmp_path / name).write_bytes(b"x" * 10)
+    (tmp_path / "bb/gone_w40.webp").write_bytes(b"x" * 10)
+    (tmp_path / "stray.bin").write_bytes(b"x" * 10)
+    os.utime(tmp_path / "stray.bin", (0, 0))
+    (tmp_path / ".tmp").mkdir()
+    (tmp_path / ".tmp/in-flight").write_bytes(b"x")
+
+    shared = models.Blob(sha256="a" * 64, path="aa/shared.png", size=10)
+    gone = models.Blob(sha256="b" * 64, path="bb/gone.png", size=10)
+    profile = models.Media.from_file("shared.png", path="aa/shared.png")
+    profile.blob = shared
+    duplicate = models.Media.from_file("shared.png", path="aa/shared.png")
+    duplicate.blob = shared
+    unused = models.Media.from_file("gone.png", path="bb/gone.png")
+    unused.blob = gone
+    unused.variants = [{"path": "bb/gone_w40.webp", "width": 40, "height": 20}]
+    for media in (profile, duplicate, unused):
+        media.created_at = old
+    recent = models.Media.from_file("recent.png")
+    user = models.User(name="test", username="test", profile_image=profile)
+    db.session.add_all([user, duplicate, unused, recent])
+    db.session.commit()
+    assert shared.ref_count == 2
+
+    runner = app.test_cli_runner()
+    result = runner.invoke(args=["media", "gc", "--dry-run", "--batch-size", "1"])
+    assert result.exit_code == 0, result.output
+    assert "Would delete 2 media, 1 blobs and 3 files" in result.output
+    assert "Would delete 1 files without media" in result.output
+    assert db.session.scalar(db.select(db.func.count()).select_from(models.Media)) == 4
+    assert (tmp_path / "stray.bin").exists()
+
+    result = runner.invoke(args=["media", "gc", "--batch-size", "1"])
+    assert result.exit_code == 0, result.output
+    assert "Deleted 2 media, 1 blobs and 3 files" in result.output
+    assert "Deleted 1 files without media" in result.output
+    db.session.expire_all()
+    assert set(db.session.scalars(db.select(models.Media.id))) == {profile.id, recent.id}
+    assert db.session.scalars(db.select(models.Blob)).all() == [shared]
+    assert shared.ref_count == 1
+    files = sorted(p.relative_to(tmp_path).as_posix() for p in tmp_path.rglob("*") if p.is_file())
+    # The temporary file is spared until it is old enough.
+    assert files == [".tmp/in-flight", "aa/shared.png", "aa/shared_small.png"]
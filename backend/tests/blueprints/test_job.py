@@ -0,0 +1,76 @@
+import io
+from datetime import timedelta
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+from PIL import Image
+from rq.utils import utcnow
+
+from bamboo.blueprints.auth import Permission
+from bamboo.jobs import create_job_backend, record_duration, rq
+
+
+def test_get_job_permission(client):
+    assert client.get("/api/jobs/unknown").status_code == 401
+    assert client.get("/api/jobs/queues").status_code == 401
+
+
+@pytest.mark.parametrize("permission", [Permission.CONTENT])
+def test_upload_job(app, client, auth):
+    image = io.BytesIO()
+    Image.new("RGB", (20, 10)).save(image, "PNG")
+    response = client.post("/api/media/", data={"file": (io.BytesIO(image.getvalue()), "job.png")})
+    assert response.status_code == 200, response.json
+    job_id = response.json["job_id"]
+    (Path(app.config["BAMBOO_MEDIA_DIR"]) / response.json["path"]).unlink()
+
+    response = client.get(f"/api/jobs/{job_id}", auth=auth)
+    assert response.status_code == 200, response.json
+    assert response.json["status"] == "queued"
+    assert response.json["queue"] == "high"
+    assert response.json["enqueued_at"] is not None
+    assert response.json["started_at"] is None
+    assert client.get("/api/jobs/unknown", auth=auth).status_code == 404
+
+    now = utcnow()
+    for seconds in range(1, 21):
+        job = SimpleNamespace(
+            origin="high", started_at=now, ended_at=now + timedelta(seconds=seconds)
+        )
+        record_duration(job, rq.connection)
+    response = client.get("/api/jobs/queues", auth=auth)
+    assert response.status_code == 200
+    metrics = {queue["name"]: queue for queue in response.json}
+    assert list(metrics) == ["high", "default", "low"]
+    assert metrics["high"]["depth"] == 1
+    assert metrics["high"]["oldest_age"] >= 0
+    assert metrics["high"]["samples"] == 20
+    assert metrics["high"]["p50"] == 10
+    assert metrics["high"]["p95"] == 19
+    assert metrics["low"] == {
+        "name": "low",
+        "depth": 0,
+        "oldest_age": None,
+        "samples": 0,
+        "p50": None,
+        "p95": None,
+    }
+
+
+@pytest.mark.parametrize("permission", [Permission.CONTENT])
+def test_local_job(app, client, auth):
+    app.config["BAMBOO_JOB_BACKEND"] = "sync"
+    app.extensions["bamboo.job_backend"] = create_job_backend(app)
+    image = io.BytesIO()
+    Image.new("RGB", (20, 10)).save(image, "PNG")
+    response = client.post("/api/media/", data={"file": (io.BytesIO(image.getvalue()), "job.png")})
+    assert response.status_code == 200, response.json
+    media_path = Path(app.config["BAMBOO_MEDIA_DIR"]) / response.json["path"]
+
+    response = client.get(f"/api/jobs/{response.json['job_id']}", auth=auth)
+    assert response.status_code == 200, response.json
+    assert response.json["status"] == "finished"
+    assert response.json["queue"] == "local"
+    for path in media_path.parent.glob(f"{media_path.stem}*"):
+        path.unlink()
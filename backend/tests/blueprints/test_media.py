@@ -1,19 +1,17 @@
+import hashlib
 import io
 from pathlib import Path
 
-from PIL import Image
+import pytest
+from PIL import ExifTags, Image, ImageCms, UnidentifiedImageError
 
 from bamboo.database import db
+from bamboo.database.models import Blob, Media
 
 
 def test_upload_media(app, client, mocker):
     db.create_all()
     mocked_function = mocker.patch("bamboo.jobs.gen_small_image.queue", autospec=True)
-    mocker.patch(
-        "bamboo.blueprints.media.gen_uuid",
-        return_value="xxxxxxxx",
-        autospec=True,
-    )
     content = b"abcdef"
     response = client.post(
         "/api/media/",
@@ -24,7 +22,8 @@ def test_upload_media(app, client, mocker):
     media_dir = Path(app.config["BAMBOO_MEDIA_DIR"])
     assert response.status_code == 200, response.json
     assert response.json["id"] == 1
-    filename = "xxxxxxxx_test.png"
+    digest = hashlib.sha256(content).hexdigest()
+    filename = f"{digest[:2]}/{digest[2:4]}/{digest}.png"
     # check mocked function called
     mocked_function.assert_called_once_with(media_dir / filename)
     assert response.json["path"] == filename
@@ -36,6 +35,33 @@ def test_upload_media(app, client, mocker):
     file.unlink()
 
 
+def test_upload_media_deduplicated(app, client, mocker):
+    mocked_function = mocker.patch("bamboo.jobs.gen_small_image.queue", autospec=True)
+    content = b"same content"
+    paths = []
+    for upload_filename in ("logo.png", "logo-copy.PNG"):
+        response = client.post("/api/media/", data={"file": (io.BytesIO(content), upload_filename)})
+        assert response.status_code == 200, response.json
+        paths.append(response.json["path"])
+
+    assert paths[0] == paths[1]
+    mocked_function.assert_called_once()
+    assert response.json["size"] == len(content)
+    blob = db.session.scalars(db.select(Blob)).one()
+    assert blob.ref_count == 2
+    assert blob.size == len(content)
+    assert [media.filename for media in db.session.scalars(db.select(Media))] == [
+        "logo.png",
+        "logo-copy.PNG",
+    ]
+
+    db.session.delete(db.session.get(Media, 1))
+    db.session.commit()
+    db.session.refresh(blob)
+    assert blob.ref_count == 1
+    (Path(app.config["BAMBOO_MEDIA_DIR"]) / blob.path).unlink()
+
+
 def test_gen_small_image(app):
     # create test image
     media_dir = Path(app.config["BAMBOO_MEDIA_DIR"])
@@ -58,3 +84,385 @@ def test_gen_small_image(app):
     # delete test file
     image_path.unlink()
     small_image_path.unlink()
+
+
+def test_gen_image_variants(app):
+    app.config["BAMBOO_IMAGE_VARIANT_WIDTHS"] = [40, 120, 400]
+    media_dir = Path(app.config["BAMBOO_MEDIA_DIR"])
+    image_path = media_dir / "variants.jpg"
+    with Image.new("RGB", (200, 100)) as image:
+        image.save(image_path)
+    media = Media.from_file("variants.jpg")
+    db.session.add(media)
+    db.session.commit()
+
+    from bamboo.jobs import gen_small_image
+
+    gen_small_image(image_path)
+
+    db.session.refresh(media)
+    assert [(v["width"], v["height"], v["content_type"]) for v in media.srcset] == [
+        (40, 20, "image/jpeg"),
+        (40, 20, "image/webp"),
+        (120, 60, "image/jpeg"),
+        (120, 60, "image/webp"),
+    ]
+    assert media.srcset[1]["url"] == "/media/variants_w40.webp"
+    assert (media.width, media.height) == (200, 100)
+    assert media.dominant_color == "#000000"
+    assert media.lqip.startswith("data:image/webp;base64,")
+    generated = [media_dir / "variants_small.jpg"]
+    generated += [media_dir / variant["path"] for variant in media.variants]
+    for path in generated:
+        with Image.open(path) as variant:
+            assert variant.width in (40, 60, 120)
+        path.unlink()
+    image_path.unlink()
+
+
+def test_image_encoding_profiles(app):
+    app.config["BAMBOO_IMAGE_VARIANT_WIDTHS"] = [40, 80]
+    app.config["BAMBOO_IMAGE_PROFILES"] = {"w40": {"quality": 50, "extra_formats": []}}
+    media_dir = Path(app.config["BAMBOO_MEDIA_DIR"])
+    image_path = media_dir / "profiles.jpg"
+    exif = Image.Exif()
+    exif[ExifTags.Base.Orientation] = 6
+    exif[ExifTags.Base.Make] = "Camera"
+    icc_profile = ImageCms.ImageCmsProfile(ImageCms.createProfile("sRGB")).tobytes()
+    with Image.new("RGB", (200, 100)) as image:
+        image.save(image_path, exif=exif, icc_profile=icc_profile)
+    media = Media.from_file("profiles.jpg")
+    db.session.add(media)
+    db.session.commit()
+
+    from bamboo.jobs import gen_small_image
+
+    gen_small_image(image_path)
+
+    db.session.refresh(media)
+    # The orientation is applied.
+    assert (media.width, media.height) == (100, 200)
+    assert [(v["width"], v["height"], v["content_type"]) for v in media.variants] == [
+        (40, 80, "image/jpeg"),
+        (80, 160, "image/jpeg"),
+        (80, 160, "image/webp"),
+    ]
+    assert media.encoding["small"]["quality"] == 70
+    assert media.encoding["w40"]["quality"] == 50
+    assert media.encoding["w80"]["quality"] == 80
+    generated = [media_dir / "profiles_small.jpg"]
+    generated += [media_dir / variant["path"] for variant in media.variants]
+    for path in generated:
+        with Image.open(path) as variant:
+            assert not variant.getexif()
+            assert "icc_profile" not in variant.info
+            if variant.format == "JPEG":
+                assert variant.info["progressive"]
+        path.unlink()
+    image_path.unlink()
+
+
+def test_png_variants_quantized(app):
+    app.config["BAMBOO_IMAGE_VARIANT_WIDTHS"] = []
+    media_dir = Path(app.config["BAMBOO_MEDIA_DIR"])
+    image_path = media_dir / "quantized.png"
+    Image.linear_gradient("L").convert("RGB").save(image_path)
+
+    from bamboo.jobs import gen_small_image
+
+    gen_small_image(image_path)
+    small_path = media_dir / "quantized_small.png"
+    with Image.open(small_path) as small:
+        assert small.mode == "P"
+    small_path.unlink()
+    image_path.unlink()
+
+
+def test_upload_image_metadata(app, client, mocker):
+    mocker.patch("bamboo.jobs.gen_small_image.queue", autospec=True)
+    buffer = io.BytesIO()
+    Image.new("RGB", (64, 48), "#ff0000").save(buffer, "PNG")
+    content = buffer.getvalue()
+    response = client.post("/api/media/", data={"file": (io.BytesIO(content), "red.png")})
+    assert response.status_code == 200, response.json
+    assert response.json["width"] == 64
+    assert response.json["height"] == 48
+    assert response.json["size"] == len(content)
+    # The variants don't exist yet.
+    assert response.json["variant_state"] == "pending"
+    assert response.json["url_small"] == response.json["url"]
+    assert response.json["srcset"] == []
+
+    image_path = Path(app.config["BAMBOO_MEDIA_DIR"]) / response.json["path"]
+    from bamboo.jobs import gen_small_image
+
+    gen_small_image(image_path)
+    assert not list(image_path.parent.glob("*.tmp"))
+
+    # A second upload of the same image gets the metadata without decoding it again.
+    response = client.post("/api/media/", data={"file": (io.BytesIO(content), "red2.png")})
+    assert response.json["dominant_color"] == "#ff0000"
+    assert response.json["lqip"].startswith("data:image/webp;base64,")
+    assert response.json["variant_state"] == "ready"
+    assert response.json["url_small"].endswith("_small.png")
+    for path in image_path.parent.iterdir():
+        path.unlink()
+
+
+def test_gen_small_image_failed(app):
+    media_dir = Path(app.config["BAMBOO_MEDIA_DIR"])
+    image_path = media_dir / "broken.png"
+    image_path.write_bytes(b"not an image")
+    media = Media.from_file("broken.png")
+    media.variant_state = "pending"
+    db.session.add(media)
+    db.session.commit()
+
+    from bamboo.jobs import gen_small_image
+
+    with pytest.raises(UnidentifiedImageError):
+        gen_small_image(image_path)
+    db.session.refresh(media)
+    assert media.variant_state == "failed"
+    assert media.url_small == media.url
+    image_path.unlink()
+
+
+def test_media_endpoint_conditional(app, client):
+    content = b"0123456789"
+    digest = hashlib.sha256(content).hexdigest()
+    path = Path(app.config["BAMBOO_MEDIA_DIR"]) / digest[:2] / digest[2:4] / f"{digest}.pdf"
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(content)
+    url = f"/media/{digest[:2]}/{digest[2:4]}/{digest}.pdf"
+
+    response = client.get(url)
+    assert response.status_code == 200
+    assert response.data == content
+    assert response.headers["ETag"] == f'"{digest}"'
+    assert "immutable" in response.headers["Cache-Control"]
+
+    response = client.get(url, headers={"If-None-Match": f'"{digest}"'})
+    assert response.status_code == 304
+
+    response = client.get(url, headers={"Range": "bytes=2-4"})
+    assert response.status_code == 206
+    assert response.data == b"234"
+
+    app.config["BAMBOO_MEDIA_OFFLOAD"] = "x-accel-redirect"
+    response = client.get(url)
+    assert response.status_code == 200
+    assert response.data == b""
+    assert response.headers["X-Accel-Redirect"] == f"/_media/{url.removeprefix('/media/')}"
+    assert response.headers["Content-Type"] == "application/pdf"
+    response = client.get(url, headers={"If-None-Match": f'"{digest}"'})
+    assert response.status_code == 304
+    assert "X-Accel-Redirect" not in response.headers
+    for missing in ["/media/..%2f..%2fetc/passwd", f"/media/{digest}.png"]:
+        response = client.get(missing)
+        assert response.status_code == 404
+        assert "X-Accel-Redirect" not in response.headers
+
+    app.config["BAMBOO_MEDIA_OFFLOAD"] = "x-sendfile"
+    response = client.get(url)
+    assert response.headers["X-Sendfile"] == str(path)
+    path.unlink()
+
+
+def test_chunked_upload(app, client, mocker):
+    mocked_function = mocker.patch("bamboo.jobs.gen_small_image.queue", autospec=True)
+    content = bytes(range(256)) * 40
+    digest = hashlib.sha256(content).hexdigest()
+
+    response = client.post("/api/media/uploads", json={"filename": "deck.exe", "size": 10})
+    assert response.status_code == 422
+    response = client.post(
+        "/api/media/uploads", json={"filename": "deck.pdf", "size": len(content)}
+    )
+    assert response.status_code == 201
+    upload_id = response.json["id"]
+    assert response.json["offset"] == 0
+    url = f"/api/media/uploads/{upload_id}"
+
+    def put(start, end):
+        return client.put(
+            url,
+            data=content[start:end],
+            headers={"Content-Range": f"bytes {start}-{end - 1}/{len(content)}"},
+        )
+
+    assert put(0, 4000).json["offset"] == 4000
+    # A chunk sent twice, e.g. after a dropped connection, is refused with the offset.
+    response = put(0, 4000)
+    assert response.status_code == 409
+    assert response.json["detail"]["offset"] == 4000
+    assert client.get(url).json["offset"] == 4000
+    response = client.put(url, headers={"Content-Range": f"bytes */{len(content)}"})
+    assert response.status_code == 200
+    assert response.json["offset"] == 4000
+
+    response = client.post(f"{url}/finalize", json={})
+    assert response.status_code == 422
+
+    assert put(4000, len(content)).json["offset"] == len(content)
+    # Not given when creating the upload either.
+    response = client.post(f"{url}/finalize", json={})
+    assert response.status_code == 422
+    assert response.json["message"] == "The SHA-256 of the upload is required."
+    response = client.post(f"{url}/finalize", json={"sha256": "0" * 64})
+    assert response.status_code == 422
+    assert response.json["message"] == "Checksum mismatch."
+
+    response = client.post(f"{url}/finalize", json={"sha256": digest})
+    assert response.status_code == 200, response.json
+    assert response.json["path"] == f"{digest[:2]}/{digest[2:4]}/{digest}.pdf"
+    assert response.json["file_type"] == "slides"
+    assert response.json["size"] == len(content)
+    mocked_function.assert_not_called()
+    path = Path(app.config["BAMBOO_MEDIA_DIR"]) / response.json["path"]
+    assert path.read_bytes() == content
+    path.unlink()
+
+    assert client.get(url).status_code == 404
+
+
+def test_upload_image_too_large(app, client, mocker):
+    mocked_function = mocker.patch("bamboo.jobs.gen_small_image.queue", autospec=True)
+    app.config["BAMBOO_IMAGE_MAX_PIXELS"] = 100
+    buffer = io.BytesIO()
+    Image.new("RGB", (20, 10)).save(buffer, "PNG")
+    response = client.post(
+        "/api/media/", data={"file": (io.BytesIO(buffer.getvalue()), "large.png")}
+    )
+    assert response.status_code == 422
+    assert "20x10" in response.json["message"]
+    mocked_function.assert_not_called()
+    assert db.session.scalars(db.select(Media)).all() == []
+    assert not [p for p in (Path(app.config["BAMBOO_MEDIA_DIR"]) / ".tmp").iterdir() if p.is_file()]
+
+    # Images stored before the limit was lowered are skipped by the job.
+    image_path = Path(app.config["BAMBOO_MEDIA_DIR"]) / "large.png"
+    image_path.write_bytes(buffer.getvalue())
+    media = Media.from_file("large.png")
+    db.session.add(media)
+    db.session.commit()
+    from bamboo.jobs import gen_small_image
+
+    gen_small_image(image_path)
+    db.session.refresh(media)
+    assert media.variant_state == "failed"
+    assert not (Path(app.config["BAMBOO_MEDIA_DIR"]) / "large_small.png").exists()
+
+    # Over the limit of Pillow.
+    app.config["BAMBOO_IMAGE_MAX_PIXELS"] = None
+    mocker.patch.object(Image, "MAX_IMAGE_PIXELS", 50)
+    media.variant_state = None
+    db.session.commit()
+    gen_small_image(image_path)
+    db.session.refresh(media)
+    assert media.variant_state == "failed"
+    image_path.unlink()
+    db.session.delete(media)
+    db.session.commit()
+
+    response = client.post(
+        "/api/media/", data={"file": (io.BytesIO(buffer.getvalue()), "large.png")}
+    )
+    assert response.status_code == 422
+    mocked_function.assert_not_called()
+    assert db.session.scalars(db.select(Media)).all() == []
+    assert not [p for p in (Path(app.config["BAMBOO_MEDIA_DIR"]) / ".tmp").iterdir() if p.is_file()]
+
+
+def make_pdf(pages: list[str]) -> bytes:
+    """A minimal PDF with a line of text on each page."""
+    count = len(pages)
+    kids = " ".join(f"{3 + 2 * i} 0 R" for i in range(count))
+    objects = [
+        "<< /Type /Catalog /Pages 2 0 R >>",
+        f"<< /Type /Pages /Kids [{kids}] /Count {count} >>",
+    ]
+    for i, text in enumerate(pages):
+        stream = f"BT /F1 24 Tf 20 100 Td ({text}) Tj ET"
+        objects.append(
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 400 200] /Contents {4 + 2 * i} 0 R "
+            f"/Resources << /Font << /F1 {3 + 2 * count} 0 R >> >> >>"
+        )
+        objects.append(f"<< /Length {len(stream)} >>\nstream\n{stream}\nendstream")
+    objects.append("<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+    content = b"%PDF-1.4\n"
+    offsets = []
+    for number, obj in enumerate(objects, 1):
+        offsets.append(len(content))
+        content += f"{number} 0 obj\n{obj}\nendobj\n".encode()
+    xref = len(content)
+    content += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode()
+    content += "".join(f"{offset:010d} 00000 n \n" for offset in offsets).encode()
+    content += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\n".encode()
+    return content + f"startxref\n{xref}\n%%EOF\n".encode()
+
+
+def test_slide_previews(app, client, mocker):
+    pypdfium2 = pytest.importorskip("pypdfium2")
+    from bamboo.jobs import gen_slide_previews
+
+    mocked_function = mocker.patch("bamboo.jobs.gen_slide_previews.queue", autospec=True)
+    app.config.update(BAMBOO_SLIDE_PREVIEW_PAGES=2, BAMBOO_SLIDE_TEXT_MAX_CHARS=20)
+    content = make_pdf(["Hello Bamboo", "Second page", "Third page"])
+    response = client.post("/api/media/", data={"file": (io.BytesIO(content), "talk.pdf")})
+    assert response.status_code == 200, response.json
+    assert response.json["file_type"] == "slides"
+    assert response.json["variant_state"] == "pending"
+    assert response.json["previews"] == []
+    media_dir = Path(app.config["BAMBOO_MEDIA_DIR"])
+    pdf_path = media_dir / response.json["path"]
+    mocked_function.assert_called_once_with(pdf_path)
+
+    get_page = mocker.spy(pypdfium2.PdfDocument, "__getitem__")
+    gen_slide_previews(pdf_path)
+    # The third page has no preview, and the text is complete already.
+    assert get_page.call_count == 2
+    media = db.session.get(Media, response.json["id"])
+    db.session.refresh(media)
+    assert media.variant_state == "ready"
+    assert media.page_count == 3
+    # The text stops at the character limit.
+    assert media.text == "Hello Bamboo\fSecond "
+    assert [(p["page"], p["width"], p["height"]) for p in media.previews] == [
+        (1, 480, 240),
+        (2, 480, 240),
+    ]
+    stem = response.json["path"].removesuffix(".pdf")
+    assert media.url_small == f"/media/{stem}_p1.jpg"
+    for preview in media.previews:
+        with Image.open(media_dir / preview["path"]) as image:
+            assert image.format == "JPEG"
+            assert image.size == (480, 240)
+
+    # Identical uploads share the previews and the text.
+    response = client.post("/api/media/", data={"file": (io.BytesIO(content), "copy.pdf")})
+    assert response.json["variant_state"] == "ready"
+    assert response.json["page_count"] == 3
+    assert response.json["previews"][0]["url"] == f"/media/{stem}_p1.jpg"
+    assert db.session.get(Media, response.json["id"]).text == media.text
+    mocked_function.assert_called_once()
+
+    for preview in media.previews:
+        (media_dir / preview["path"]).unlink()
+    pdf_path.unlink()
+
+
+def test_slide_previews_broken(app):
+    pytest.importorskip("pypdfium2")
+    from bamboo.jobs import gen_slide_previews
+
+    pdf_path = Path(app.config["BAMBOO_MEDIA_DIR"]) / "broken.pdf"
+    pdf_path.write_bytes(b"%PDF-1.4 not really")
+    media = Media.from_file("broken.pdf")
+    media.variant_state = "pending"
+    db.session.add(media)
+    db.session.commit()
+    gen_slide_previews(pdf_path)
+    db.session.refresh(media)
+    assert media.variant_state == "failed"
+    pdf_path.unlink()
@@ -13,7 +13,7 @@ def test_get_sites_permission(client):
 def test_get_sites(client, auth):
     response = client.get("api/site/all", auth=auth)
     assert response.status_code == 200
-    assert response.json == []
+    assert response.json["items"] == []
 
     site = models.Site(name="Site 1")
     db.session.add(site)
@@ -21,8 +21,8 @@ def test_get_sites(client, auth):
 
     response = client.get("api/site/all", auth=auth)
     assert response.status_code == 200
-    assert len(response.json) == 1
-    assert response.json[0]["name"] == "Site 1"
+    assert len(response.json["items"]) == 1
+    assert response.json["items"][0]["name"] == "Site 1"
 
 
 @pytest.mark.parametrize("permission", [Permission.USER])
@@ -30,29 +30,29 @@ def test_get_staffs_permission(client):
 def test_get_staffs(client, auth):
     response = client.get("api/staff/list", auth=auth)
     assert response.status_code == 200
-    assert response.json == []
+    assert response.json["items"] == []
 
     city1, city2, user, staff = _prepare()
 
     response = client.get("api/staff/list", auth=auth)
     assert response.status_code == 200
-    assert len(response.json) == 1
+    assert len(response.json["items"]) == 1
 
-    the_staff = response.json[0]
+    the_staff = response.json["items"][0]
     assert the_staff["category"] == "sponsor"
     assert the_staff["staff"]["name"] == user.name and the_staff["city"]["name"] == city1.name
 
     response = client.get(f"api/staff/list?city_id={city1.id}", auth=auth)
     assert response.status_code == 200
-    assert len(response.json) == 1
+    assert len(response.json["items"]) == 1
 
     response = client.get(f"api/staff/list?city_id={city2.id}", auth=auth)
     assert response.status_code == 200
-    assert len(response.json) == 0
+    assert len(response.json["items"]) == 0
 
     response = client.get("api/staff/list?city_id=100", auth=auth)
     assert response.status_code == 200
-    assert len(response.json) == 0
+    assert len(response.json["items"]) == 0
 
 
 @pytest.mark.parametrize("permission", [Permission.USER])
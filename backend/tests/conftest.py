@@ -8,6 +8,7 @@ from werkzeug.datastructures import Authorization
 from bamboo import create_app
 from bamboo.blueprints.auth import Permission
 from bamboo.database import db, models
+from bamboo.jobs import rq
 from bamboo.utils import encode_jwt
 
 
@@ -16,6 +17,8 @@ def app() -> Generator[APIFlask, None, None]:
     app = create_app("testing")
     with app.app_context():
         yield app
+        # The fake Redis server is shared by the tests.
+        rq.connection.flushall()
 
 
 @pytest.fixture
@@ -0,0 +1,135 @@
+import contextlib
+from typing import Iterator
+
+import pytest
+import sqlalchemy as sa
+from flask_migrate import downgrade, upgrade
+
+from bamboo.blueprints.auth import Permission
+from bamboo.database import db, models
+
+
+@contextlib.contextmanager
+def captured_selects() -> Iterator[list[tuple[str, tuple]]]:
+    statements = []
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith("SELECT"):
+            statements.append((statement, parameters))
+
+    sa.event.listen(db.engine, "before_cursor_execute", capture)
+    try:
+        yield statements
+    finally:
+        sa.event.remove(db.engine, "before_cursor_execute", capture)
+
+
+def query_plan(statement: str, parameters=()) -> str:
+    rows = db.session.connection().exec_driver_sql(f"EXPLAIN QUERY PLAN {statement}", parameters)
+    return "\n".join(row.detail for row in rows)
+
+
+def plan_of(statements: list[tuple[str, tuple]], table: str) -> str:
+    statement, parameters = next(
+        (statement, parameters)
+        for statement, parameters in statements
+        if f"FROM {table}" in statement and "WHERE" in statement
+    )
+    return query_plan(statement, parameters)
+
+
+def test_venue_schedule_uses_index(client):
+    site = models.Site(name="Test site", config={})
+    venue = models.Venue(name="Hall", address="", city=models.City(name="Test city", site=site))
+    db.session.add(venue)
+    db.session.commit()
+
+    with captured_selects() as statements:
+        response = client.get(f"/api/venue/{venue.id}/schedules")
+    assert response.status_code == 200
+    plan = plan_of(statements, "schedule_item")
+    assert "USING INDEX ix_schedule_item_venue_id_start" in plan
+    assert "TEMP B-TREE" not in plan
+
+
+@pytest.mark.parametrize("permission", [Permission.STAFF])
+def test_staff_list_uses_index(client, auth):
+    city = models.City(name="Shanghai", site=models.Site(name="Somewhere"))
+    db.session.add(city)
+    db.session.commit()
+
+    with captured_selects() as statements:
+        response = client.get(f"/api/staff/list?city_id={city.id}", auth=auth)
+    assert response.status_code == 200
+    plan = plan_of(statements, "staff")
+    assert "USING INDEX ix_staff_city_id_created_at_staff_id" in plan
+    assert "TEMP B-TREE" not in plan
+
+
+@pytest.mark.parametrize("permission", [Permission.SITE])
+def test_list_pages_use_index(client, auth):
+    city = models.City(name="Shanghai", site=models.Site(name="Somewhere"))
+    db.session.add(city)
+    db.session.commit()
+
+    for url, table in [("/api/site/all", "site"), ("/api/city/all", "city")]:
+        with captured_selects() as statements:
+            response = client.get(url, auth=auth)
+        assert response.status_code == 200
+        statement, parameters = next(s for s in statements if f"FROM {table}" in s[0])
+        plan = query_plan(statement, parameters)
+        assert f"INDEX ix_{table}_created_at_id" in plan
+        assert "TEMP B-TREE" not in plan
+
+
+def test_site_lookups_use_index():
+    statement = db.select(models.City).filter_by(site_id=1).order_by(models.City.start)
+    plan = query_plan(str(statement.compile(db.engine, compile_kwargs={"literal_binds": True})))
+    assert "USING INDEX ix_city_site_id_start" in plan
+    assert "TEMP B-TREE" not in plan
+
+    for model in (models.Page, models.Blog):
+        statement = db.select(model).filter_by(site_id=1, path="/about")
+        plan = query_plan(str(statement.compile(db.engine, compile_kwargs={"literal_binds": True})))
+        assert f"USING INDEX ix_{model.__tablename__}_site_id_path" in plan
+
+
+def test_page_path_unique():
+    site = models.Site(name="Test site", config={})
+    db.session.add_all(
+        [
+            models.Page(title="About", path="/about", content="", site=site),
+            models.Page(title="About", path="/about", content="", site=site),
+        ]
+    )
+    with pytest.raises(sa.exc.IntegrityError):
+        db.session.commit()
+    db.session.rollback()
+
+
+def test_migration():
+    def index_names(table: str) -> set[str]:
+        return {index["name"] for index in sa.inspect(db.engine).get_indexes(table)}
+
+    # The tables are created with the indexes already.
+    upgrade()
+    assert "ix_schedule_item_venue_id_start" in index_names("schedule_item")
+    assert "ix_schedule_item_venue_id" not in index_names("schedule_item")
+
+    assert "ix_staff_city_id_created_at_staff_id" in index_names("staff")
+
+    downgrade(revision="eeeaa7daa99d")
+    assert "ix_site_created_at_id" not in index_names("site")
+    assert "ix_staff_city_id_created_at_staff_id" in index_names("staff")
+
+    downgrade(revision="base")
+    assert "ix_schedule_item_venue_id_start" not in index_names("schedule_item")
+    assert "ix_schedule_item_venue_id" in index_names("schedule_item")
+    assert "ix_page_site_id_path" not in index_names("page")
+    assert "ix_staff_city_id_created_at_staff_id" not in index_names("staff")
+
+    upgrade()
+    assert "ix_schedule_item_venue_id_start" in index_names("schedule_item")
+    assert "ix_schedule_item_venue_id" not in index_names("schedule_item")
+    assert "ix_page_site_id_path" in index_names("page")
+    assert "ix_partnership_city_id_created_at_organization_id" in index_names("partnership")
@@ -0,0 +1,71 @@
+import contextlib
+from typing import Iterator
+
+import pytest
+import sqlalchemy as sa
+
+from bamboo.blueprints.auth import Permission
+from bamboo.database import db, models
+from bamboo.database.loading import eager_options
+from bamboo.schemas.site import SiteOut
+from bamboo.schemas.staff import StaffOut
+
+
+@contextlib.contextmanager
+def count_queries() -> Iterator[list[str]]:
+    statements = []
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    sa.event.listen(db.engine, "before_cursor_execute", capture)
+    try:
+        yield statements
+    finally:
+        sa.event.remove(db.engine, "before_cursor_execute", capture)
+
+
+def add_staff(city: models.City, count: int) -> None:
+    for i in range(count):
+        profile = models.Media.from_file("test.png")
+        user = models.User(name=f"Volunteer {i}", profile_image=profile)
+        db.session.add(models.Staff(city=city, staff=user, category="volunteer"))
+    db.session.commit()
+    db.session.expire_all()
+
+
+def test_eager_options():
+    options = eager_options(models.Staff, StaffOut)
+    # city (and its site), staff (and its profile image)
+    assert len(options) == 2
+    assert eager_options(models.Staff, StaffOut) is options
+    assert eager_options(models.Site, SiteOut) == ()
+
+
+@pytest.mark.parametrize("permission", [Permission.STAFF])
+def test_list_queries_dont_grow_with_rows(client, auth):
+    site = models.Site(name="Somewhere")
+    city = models.City(name="Shanghai", site=site)
+    add_staff(city, 2)
+    # Warm up the caches of the authentication.
+    client.get("/api/staff/list", auth=auth)
+
+    def list_staffs(rows: int) -> int:
+        with count_queries() as statements:
+            response = client.get("/api/staff/list", query_string={"limit": 100}, auth=auth)
+        assert len(response.json["items"]) == rows
+        assert {staff["city"]["site"]["name"] for staff in response.json["items"]} == {site.name}
+        return len(statements)
+
+    # A single query, the city, its site, the user and the profile image being joined.
+    assert list_staffs(2) == 1
+    add_staff(city, 38)
+    assert list_staffs(40) == 1
+
+    db.session.add_all([models.City(name=f"City {i}", site=site) for i in range(20)])
+    db.session.commit()
+    db.session.expire_all()
+    with count_queries() as statements:
+        response = client.get("/api/city/all", query_string={"limit": 100}, auth=auth)
+    assert {city["site"]["name"] for city in response.json["items"]} == {site.name}
+    assert len(statements) == 1
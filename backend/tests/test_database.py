@@ -0,0 +1,170 @@
+import threading
+
+import pytest
+import redis
+import sqlalchemy as sa
+from sqlalchemy.orm import Session
+
+from bamboo import create_app
+from bamboo.blueprints.auth import Permission
+from bamboo.database import db, models
+from bamboo.database.models import use_sqlite_pragmas
+from bamboo.database.pool import InstrumentedQueuePool, get_pool_stats
+from bamboo.database.routing import STICKY_COOKIE, get_replicas
+from bamboo.jobs import optimize_database, rq
+from bamboo.settings import BaseConfig, TestingConfig, postgres_connect_args
+from bamboo.utils import encode_jwt
+
+
+def test_sqlite_pragmas(tmp_path):
+    engine = sa.create_engine(f"sqlite:///{tmp_path / 'test.db'}")
+    use_sqlite_pragmas(engine, BaseConfig.BAMBOO_SQLITE_PRAGMAS)
+    with engine.connect() as connection:
+
+        def pragma(name: str):
+            return connection.exec_driver_sql(f"PRAGMA {name}").scalar()
+
+        assert pragma("foreign_keys") == 1
+        assert pragma("journal_mode") == "wal"
+        # NORMAL
+        assert pragma("synchronous") == 1
+        assert pragma("busy_timeout") == 5000
+        assert pragma("cache_size") == -16000
+        # MEMORY
+        assert pragma("temp_store") == 2
+    engine.dispose()
+
+
+def test_sqlite_wal_readers_and_writer(tmp_path):
+    engine = sa.create_engine(f"sqlite:///{tmp_path / 'test.db'}")
+    use_sqlite_pragmas(engine, {**BaseConfig.BAMBOO_SQLITE_PRAGMAS, "busy_timeout": 0})
+    with engine.begin() as connection:
+        connection.exec_driver_sql("CREATE TABLE item (id INTEGER PRIMARY KEY)")
+        connection.exec_driver_sql("INSERT INTO item DEFAULT VALUES")
+    with engine.connect() as writer, engine.connect() as reader:
+        writer.exec_driver_sql("BEGIN IMMEDIATE")
+        writer.exec_driver_sql("INSERT INTO item DEFAULT VALUES")
+        # The reader sees the last commit while the write is in progress.
+        assert reader.exec_driver_sql("SELECT count(*) FROM item").scalar() == 1
+        writer.exec_driver_sql("COMMIT")
+        reader.rollback()
+        assert reader.exec_driver_sql("SELECT count(*) FROM item").scalar() == 2
+    engine.dispose()
+
+
+def test_optimize_database(app):
+    assert db.engine.dialect.name == "sqlite"
+    optimize_database()
+
+    result = app.test_cli_runner().invoke(args=["schedule-jobs"])
+    assert result.exit_code == 0, result.output
+    assert "Scheduled optimize-database" in result.output
+    assert "cron-optimize-database" in [job.id for job in rq.get_scheduler().get_jobs()]
+
+    app.config["BAMBOO_SQLITE_OPTIMIZE_CRON"] = ""
+    result = app.test_cli_runner().invoke(args=["schedule-jobs"])
+    assert result.exit_code == 0, result.output
+    assert list(rq.get_scheduler().get_jobs()) == []
+
+
+def test_schedule_jobs_without_redis(app, mocker):
+    mocker.patch("bamboo.jobs.optimize_database.cron", side_effect=redis.ConnectionError("refused"))
+    result = app.test_cli_runner().invoke(args=["schedule-jobs"])
+    assert result.exit_code == 0, result.output
+    assert "Failed to schedule the periodic jobs: refused" in result.output
+
+    app.config["BAMBOO_JOB_BACKEND"] = "sync"
+    result = app.test_cli_runner().invoke(args=["schedule-jobs"])
+    assert result.exit_code == 0, result.output
+    assert "Skipped the periodic jobs" in result.output
+
+
+def test_instrumented_pool(tmp_path):
+    engine = sa.create_engine(
+        f"sqlite:///{tmp_path / 'test.db'}",
+        poolclass=InstrumentedQueuePool,
+        pool_size=1,
+        max_overflow=0,
+        pool_timeout=0.1,
+    )
+    with engine.connect():
+        assert get_pool_stats("default", engine)["checked_out"] == 1
+        with pytest.raises(sa.exc.TimeoutError):
+            engine.connect()
+    stats = get_pool_stats("default", engine)
+    assert stats["checked_out"] == 0
+    assert stats["checked_in"] == 1
+    assert stats["waits"] == 1
+    assert stats["timeouts"] == 1
+    assert stats["wait_time"] >= 0.1
+
+    # Released while the second checkout waits.
+    connection = engine.connect()
+    threading.Timer(0.05, connection.close).start()
+    with engine.connect():
+        pass
+    stats = get_pool_stats("default", engine)
+    assert stats["waits"] == 2
+    assert stats["timeouts"] == 1
+    engine.dispose()
+
+
+def test_postgres_connect_args(monkeypatch):
+    assert postgres_connect_args("sqlite:////data/data.db") == {}
+    monkeypatch.setenv("BAMBOO_DB_STATEMENT_TIMEOUT", "5000")
+    assert postgres_connect_args("postgresql://localhost/bamboo") == {
+        "connect_args": {
+            "options": "-c statement_timeout=5000 -c idle_in_transaction_session_timeout=60000"
+        }
+    }
+
+
+@pytest.fixture
+def replica_app(tmp_path, monkeypatch):
+    # Two files standing in for the primary and a replica, which isn't kept in sync here.
+    monkeypatch.setattr(TestingConfig, "SQLALCHEMY_DATABASE_URI", f"sqlite:///{tmp_path}/p.db")
+    monkeypatch.setattr(TestingConfig, "BAMBOO_DB_REPLICA_URLS", [f"sqlite:///{tmp_path}/r.db"])
+    app = create_app("testing")
+    with app.app_context():
+        db.create_all()
+        db.metadata.create_all(get_replicas()["replica-0"])
+        yield app
+        db.session.remove()
+        for engine in [*db.engines.values(), *get_replicas().values()]:
+            engine.dispose()
+
+
+def test_replica_routing(replica_app):
+    replica = get_replicas()["replica-0"]
+    permission = Permission.SITE
+    for engine in (db.engine, replica):
+        with Session(engine) as session:
+            role = models.Role(name="test-role", permissions=permission)
+            profile = models.Media.from_file("test.png")
+            session.add(models.User(name="test", username="test", profile_image=profile, role=role))
+            session.add(models.Site(name=f"on {engine.url.database[-4:]}"))
+            session.commit()
+    token = encode_jwt(payload={"user_id": 1}, secret_key=replica_app.config["SECRET_KEY"])
+    client = replica_app.test_client()
+    headers = {"Authorization": f"Bearer {token}"}
+
+    response = client.get("/api/site/all", headers=headers)
+    assert [site["name"] for site in response.json["items"]] == ["on r.db"]
+    response = client.get("/api/site/1", headers=headers)
+    assert response.json["name"] == "on r.db"
+
+    # Writes go to the primary, and the client reads it for a while after.
+    response = client.patch("/api/site/1", json={"name": "renamed"}, headers=headers)
+    assert response.status_code == 200
+    assert response.json["name"] == "renamed"
+    cookie = client.get_cookie(STICKY_COOKIE)
+    assert cookie is not None
+    assert cookie.max_age == replica_app.config["BAMBOO_DB_STICKY_SECONDS"]
+    response = client.get("/api/site/all", headers=headers)
+    assert [site["name"] for site in response.json["items"]] == ["renamed"]
+
+    client.delete_cookie(STICKY_COOKIE)
+    response = client.get("/api/site/all", headers=headers)
+    assert [site["name"] for site in response.json["items"]] == ["on r.db"]
+    with Session(replica) as session:
+        assert session.get(models.Site, 1).name == "on r.db"
@@ -0,0 +1,109 @@
+import os
+import threading
+from pathlib import Path
+
+import pytest
+from flask import current_app
+from PIL import Image
+from rq.job import JobStatus
+
+from bamboo.database import db, models
+from bamboo.jobs import create_job_backend, gen_small_image, get_job_policy, get_job_state, rq
+
+
+@rq.job
+def describe_worker(value):
+    return current_app.config["BAMBOO_CONFIG_NAME"], worker_name(), value
+
+
+@rq.job
+def fail_once(path):
+    if not os.path.exists(path):
+        Path(path).touch()
+        raise RuntimeError("First run")
+    return worker_name()
+
+
+def worker_name():
+    return f"{os.getpid()}:{threading.get_ident()}"
+
+
+def test_job_deduplicated(app):
+    image_path = Path(app.config["BAMBOO_MEDIA_DIR"]) / "dedup.png"
+    job = gen_small_image.queue(image_path)
+    assert job.origin == "high"
+    assert job.timeout == 300
+    assert job.retries_left == 2
+    assert gen_small_image.queue(image_path).id == job.id
+    assert rq.get_queue("high").count == 1
+
+    # Another image or other variant settings are another job.
+    assert gen_small_image.queue(image_path.with_name("other.png")).id != job.id
+    app.config["BAMBOO_IMAGE_VARIANT_WIDTHS"] = (100,)
+    assert gen_small_image.queue(image_path).id != job.id
+    app.config["BAMBOO_IMAGE_VARIANT_WIDTHS"] = (160, 480, 1024)
+
+    # A finished job is queued again.
+    job.set_status(JobStatus.FINISHED)
+    assert gen_small_image.queue(image_path, queue="low").origin == "low"
+
+
+def test_job_policy_overrides(app):
+    app.config["BAMBOO_JOB_POLICIES"] = {"gen_small_image": {"timeout": 600, "queue": "low"}}
+    policy = get_job_policy("gen_small_image")
+    assert policy.timeout == 600
+    assert policy.queue == "low"
+    assert policy.retries == 2
+    assert get_job_policy("unknown").queue == "default"
+
+
+@pytest.mark.parametrize("backend", ["thread", "process"])
+def test_pool_job_backend(app, backend):
+    app.config["BAMBOO_JOB_BACKEND"] = backend
+    app.extensions["bamboo.job_backend"] = create_job_backend(app)
+    job = describe_worker.queue(1)
+    config_name, worker, value = job.future.result(timeout=60)
+    assert (config_name, value) == ("testing", 1)
+    assert worker != worker_name()
+    assert job.get_status() == JobStatus.FINISHED
+
+
+@pytest.mark.parametrize("backend", ["thread", "process"])
+def test_pool_job_backend_retries(app, backend, tmp_path):
+    app.config["BAMBOO_JOB_BACKEND"] = backend
+    app.config["BAMBOO_JOB_WORKERS"] = 1
+    app.config["BAMBOO_JOB_POLICIES"] = {"fail_once": {"retries": 1, "retry_intervals": (1,)}}
+    app.extensions["bamboo.job_backend"] = create_job_backend(app)
+    job = fail_once.queue(str(tmp_path / "failed"))
+    # The worker is free while the job waits to be retried.
+    assert describe_worker.queue(1).future.result(timeout=60)[2] == 1
+    assert job.get_status() == JobStatus.SCHEDULED
+    assert job.future.result(timeout=60) != worker_name()
+    assert job.get_status() == JobStatus.FINISHED
+
+
+def test_sync_job_backend(app):
+    app.config["BAMBOO_JOB_BACKEND"] = "sync"
+    app.extensions["bamboo.job_backend"] = create_job_backend(app)
+    media_dir = Path(app.config["BAMBOO_MEDIA_DIR"])
+    image_path = media_dir / "sync.png"
+    with Image.new("RGB", (100, 50)) as image:
+        image.save(image_path)
+    media = models.Media.from_file("sync.png")
+    db.session.add(media)
+    db.session.commit()
+
+    job = gen_small_image.queue(image_path)
+    assert job.get_status() == JobStatus.FINISHED
+    assert get_job_state(job.id)["status"] == "finished"
+    db.session.refresh(media)
+    assert media.width == 100
+    assert rq.get_queue("high").count == 0
+
+    assert describe_worker.queue(2).future.result()[1] == worker_name()
+    # Retrying would wait in the caller.
+    app.config["BAMBOO_JOB_POLICIES"] = {"fail_once": {"retries": 1, "retry_intervals": (60,)}}
+    job = fail_once.queue(str(media_dir / "sync-failed"))
+    assert job.get_status() == JobStatus.FAILED
+    for path in media_dir.glob("sync*"):
+        path.unlink()
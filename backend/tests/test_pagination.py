@@ -0,0 +1,96 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from bamboo.blueprints.auth import Permission
+from bamboo.database import db, models
+from bamboo.schemas.pagination import MAX_PAGE_SIZE, Cursor
+
+
+def walk(client, url, auth, **query) -> list[dict]:
+    pages = []
+    cursor = None
+    while True:
+        response = client.get(url, query_string={**query, "cursor": cursor or []}, auth=auth)
+        assert response.status_code == 200, response.json
+        pages.append(response.json)
+        if (cursor := response.json["next"]) is None:
+            return pages
+
+
+@pytest.mark.parametrize("permission", [Permission.SITE])
+def test_keyset_pages(client, auth):
+    # Written by the database default, without the microseconds on SQLite, and most in the
+    # same second.
+    db.session.add_all([models.Site(name=f"Site {i}") for i in range(5)])
+    base = datetime(2024, 5, 1, 12, 0, 0)
+    db.session.add_all(
+        [
+            models.Site(name="Older", created_at=base),
+            models.Site(name="Older, same time", created_at=base),
+            models.Site(name="Oldest", created_at=base - timedelta(microseconds=500)),
+        ]
+    )
+    db.session.commit()
+    expected = db.session.scalars(
+        db.select(models.Site.name).order_by(models.Site.created_at.desc(), models.Site.id.desc())
+    ).all()
+    assert expected[-3:] == ["Older, same time", "Older", "Oldest"]
+
+    pages = walk(client, "/api/site/all", auth, limit=3)
+    assert [len(page["items"]) for page in pages] == [3, 3, 2]
+    assert [site["name"] for page in pages for site in page["items"]] == expected
+    assert all(page["total"] is None for page in pages)
+
+    # Added while paging, the new site doesn't shift the next pages.
+    response = client.get("/api/site/all", query_string={"limit": 3}, auth=auth)
+    db.session.add(models.Site(name="Newest", created_at=datetime(2100, 1, 1)))
+    db.session.commit()
+    response = client.get(
+        "/api/site/all", query_string={"limit": 3, "cursor": response.json["next"]}, auth=auth
+    )
+    assert [site["name"] for site in response.json["items"]] == expected[3:6]
+
+    response = client.get("/api/site/all", query_string={"total": True}, auth=auth)
+    assert response.json["total"] == 9
+    assert len(response.json["items"]) == 9
+    assert response.json["next"] is None
+
+
+@pytest.mark.parametrize("permission", [Permission.STAFF])
+def test_keyset_pages_composite_key(client, auth):
+    site = models.Site(name="Somewhere")
+    cities = [models.City(name=f"City {i}", site=site) for i in range(2)]
+    for i in range(3):
+        user = models.User(name=f"User {i}", profile_image=models.Media.from_file("test.png"))
+        db.session.add_all([models.Staff(city=city, staff=user, category="") for city in cities])
+    db.session.commit()
+
+    pages = walk(client, "/api/staff/list", auth, limit=4, total=True)
+    assert [len(page["items"]) for page in pages] == [4, 2]
+    assert [page["total"] for page in pages] == [6, 6]
+    keys = {(staff["city"]["id"], staff["staff"]["id"]) for p in pages for staff in p["items"]}
+    assert len(keys) == 6
+
+    pages = walk(client, "/api/staff/list", auth, limit=2, city_id=cities[0].id)
+    assert [len(page["items"]) for page in pages] == [2, 1]
+    assert {staff["city"]["name"] for page in pages for staff in page["items"]} == {"City 0"}
+
+    response = client.get("/api/staff/list", query_string={"city_id": 100, "total": 1}, auth=auth)
+    assert response.json == {"items": [], "next": None, "total": 0}
+
+
+@pytest.mark.parametrize("permission", [Permission.SITE])
+def test_page_limits(client, auth):
+    response = client.get("/api/site/all", query_string={"limit": MAX_PAGE_SIZE + 1}, auth=auth)
+    assert response.status_code == 422
+    response = client.get("/api/site/all", query_string={"limit": 0}, auth=auth)
+    assert response.status_code == 422
+
+    for cursor in ["x", "bnVsbA", Cursor()._serialize((datetime.now(),), "next", None)]:
+        response = client.get("/api/site/all", query_string={"cursor": cursor}, auth=auth)
+        assert response.status_code == 422, cursor
+    # A cursor of another list.
+    cursor = Cursor()._serialize((datetime.now(), 1, 2), "next", None)
+    response = client.get("/api/site/all", query_string={"cursor": cursor}, auth=auth)
+    assert response.status_code == 400
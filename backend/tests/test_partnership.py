@@ -67,7 +67,7 @@ def test_get_partnership_list(client):
         },
     )
     assert response.status_code == 200
-    assert len(response.json) == 0
+    assert len(response.json["items"]) == 0
 
     test_create_partnership(client)
     response = client.get(
@@ -76,7 +76,7 @@ def test_get_partnership_list(client):
             "city_id": 1,
         },
     )
-    assert len(response.json) == 1
+    assert len(response.json["items"]) == 1
 
 
 def test_delete_partnership(client):
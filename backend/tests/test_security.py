@@ -0,0 +1,91 @@
+import threading
+import time
+
+import fakeredis
+import pytest
+from redis import ConnectionError
+
+from bamboo.security import (
+    HashingPool,
+    HashingPoolFull,
+    RevocationList,
+    normalize_hash_method,
+)
+
+
+def test_hashing_pool_rejects_when_saturated():
+    pool = HashingPool(max_workers=1, max_queue=1)
+    release = threading.Event()
+    running = pool.submit(release.wait)
+    queued = pool.submit(lambda: "done")
+    with pytest.raises(HashingPoolFull):
+        pool.submit(lambda: "rejected")
+    release.set()
+    assert running.result() is True
+    assert queued.result() == "done"
+    assert pool.submit(lambda: "accepted").result() == "accepted"
+
+
+@pytest.mark.parametrize(
+    "method,expected",
+    [
+        ("scrypt", "scrypt:32768:8:1"),
+        ("scrypt:16384:8:1", "scrypt:16384:8:1"),
+        ("pbkdf2", "pbkdf2:sha256:600000"),
+        ("pbkdf2:sha512", "pbkdf2:sha512:600000"),
+        ("pbkdf2:sha256:1000", "pbkdf2:sha256:1000"),
+    ],
+)
+def test_normalize_hash_method(method, expected):
+    assert normalize_hash_method(method) == expected
+
+
+def test_revocation_list(mocker):
+    connection = fakeredis.FakeStrictRedis()
+    revocations = RevocationList(
+        lambda: connection, capacity=100, error_rate=0.01, sync_interval=60, retention=3600
+    )
+    other = RevocationList(
+        lambda: connection, capacity=100, error_rate=0.01, sync_interval=60, retention=3600
+    )
+    expires_at = time.time() + 60
+    assert not revocations.is_revoked("a")
+    assert not other.is_revoked("a")
+
+    revocations.revoke("a", expires_at)
+    assert revocations.is_revoked("a")
+    # Other processes only see it after the next sync.
+    zscore = mocker.spy(connection, "zscore")
+    assert not other.is_revoked("a")
+    zscore.assert_not_called()
+    other.sync()
+    assert other.is_revoked("a")
+    assert not other.is_revoked("b")
+
+    # Expired tokens are pruned.
+    revocations.revoke("c", time.time() - 1)
+    assert not revocations.is_revoked("c")
+
+
+def test_revocation_list_redis_down(mocker):
+    connection = mocker.Mock()
+    connection.pipeline.side_effect = ConnectionError
+    connection.zscore.side_effect = ConnectionError
+    revocations = RevocationList(
+        lambda: connection, capacity=100, error_rate=0.01, sync_interval=0.1, retention=3600
+    )
+    # Without a filter the tokens are accepted, Redis isn't asked again until the next sync.
+    for _ in range(3):
+        assert not revocations.is_revoked("a")
+    assert connection.pipeline.call_count == 1
+    connection.zscore.assert_not_called()
+
+    time.sleep(0.1)
+    connection.pipeline.side_effect = None
+    connection.pipeline.return_value.execute.return_value = ([b"a"], [(b"a", time.time())])
+    connection.get.return_value = None
+    # Filter hits are trusted while Redis can't confirm them.
+    assert revocations.is_revoked("a")
+    assert revocations.is_revoked("a")
+    assert not revocations.is_revoked("b")
+    assert connection.zscore.call_count == 1
@@ -0,0 +1,190 @@
+import io
+import threading
+from pathlib import Path
+
+import pytest
+from moto import mock_aws
+from PIL import Image
+
+from bamboo.database import db
+from bamboo.database.models import Media
+from bamboo.jobs import gen_small_image
+from bamboo.storage import (
+    LocalStorage,
+    S3Storage,
+    UploadBusyError,
+    UploadError,
+    UploadOffsetError,
+    UploadSession,
+    create_storage,
+)
+
+BUCKET = "bamboo-media"
+
+
+@pytest.fixture
+def s3(app, monkeypatch):
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "us-east-1")
+    with mock_aws():
+        app.config.update(BAMBOO_STORAGE="s3", BAMBOO_S3_BUCKET=BUCKET, BAMBOO_S3_PREFIX="media")
+        storage = create_storage(app.config)
+        storage.client.create_bucket(Bucket=BUCKET)
+        app.extensions["bamboo.storage"] = storage
+        yield storage
+
+
+def test_local_storage(tmp_path):
+    storage = LocalStorage(tmp_path, "/media")
+    storage.put("a/b.txt", io.BytesIO(b"content"))
+    with storage.open("a/b.txt") as f:
+        assert f.read() == b"content"
+    assert storage.stat("a/b.txt").size == 7
+    assert storage.stat("a/missing.txt") is None
+    assert [info.path for info in storage.iter_files()] == ["a/b.txt"]
+    assert storage.url("a/b.txt") == "/media/a/b.txt"
+    with storage.local_copy("a/b.txt", tmp_path / ".tmp") as path:
+        assert path == tmp_path / "a/b.txt"
+    storage.delete("a/b.txt")
+    storage.delete("a/b.txt")
+    assert storage.stat("a/b.txt") is None
+
+
+def test_upload_session_concurrent_chunks(tmp_path):
+    session = UploadSession.create(tmp_path, "deck.pdf", 8)
+    reading, release = threading.Event(), threading.Event()
+
+    class SlowStream(io.BytesIO):
+        def read(self, size=-1):
+            reading.set()
+            release.wait(5)
+            return super().read(size)
+
+    first = threading.Thread(target=session.append, args=(SlowStream(b"abcd"), 0, 4))
+    first.start()
+    reading.wait(5)
+    # Refused right away while the first chunk is written, then by its offset.
+    with pytest.raises(UploadBusyError):
+        session.append(io.BytesIO(b"wxyz"), 0, 4)
+    release.set()
+    first.join()
+    with pytest.raises(UploadOffsetError) as exc_info:
+        session.append(io.BytesIO(b"wxyz"), 0, 4)
+    assert exc_info.value.offset == 4
+    assert session.part_path.read_bytes() == b"abcd"
+
+    with pytest.raises(UploadError, match="required"):
+        session.stage()
+    session.append(io.BytesIO(b"efgh"), 4, 4)
+    staged = session.stage("9c56cc51b374c3ba189210d5b6d4bf57790d351c96c47c02190ecf1e430635ab")
+    assert staged.size == 8
+    with pytest.raises(UploadError, match="finalized"):
+        session.append(io.BytesIO(b"ijkl"), 8, 0)
+    staged.discard()
+
+
+def test_s3_storage(s3: S3Storage, tmp_path):
+    s3.put("a/b.txt", io.BytesIO(b"content"))
+    assert s3.client.head_object(Bucket=BUCKET, Key="media/a/b.txt")["ContentType"] == "text/plain"
+    with s3.open("a/b.txt") as f:
+        assert f.read() == b"content"
+    with pytest.raises(FileNotFoundError):
+        s3.open("a/missing.txt")
+    assert s3.stat("a/b.txt").size == 7
+    assert s3.stat("a/missing.txt") is None
+    assert [info.path for info in s3.iter_files()] == ["a/b.txt"]
+    assert s3.url("a/b.txt") == "/media/a/b.txt"
+
+    with s3.local_copy("a/b.txt", tmp_path) as path:
+        assert path.read_bytes() == b"content"
+        # Written next to the copy, like the variants.
+        (path.parent / "b_small.txt").write_bytes(b"small")
+        s3.put_file("a/b_small.txt", path.parent / "b_small.txt")
+    assert list(tmp_path.iterdir()) == []
+    assert s3.stat("a/b_small.txt").size == 5
+
+    s3.delete("a/b.txt")
+    s3.delete("a/b.txt")
+    assert [info.path for info in s3.iter_files()] == ["a/b_small.txt"]
+
+
+def test_s3_multipart_upload(app, s3: S3Storage, tmp_path):
+    # Parts can't be smaller than 5 MiB.
+    app.config["BAMBOO_S3_MULTIPART_THRESHOLD"] = 5 * 1024 * 1024
+    s3 = create_storage(app.config)
+    local_path = tmp_path / "large.bin"
+    local_path.write_bytes(b"x" * (11 * 1024 * 1024))
+    s3.put_file("large.bin", local_path)
+    assert not local_path.exists()
+    head = s3.client.head_object(Bucket=BUCKET, Key="media/large.bin")
+    # The ETag of a multipart upload ends with the number of parts.
+    assert head["ETag"].strip('"').endswith("-3")
+    assert head["ContentLength"] == 11 * 1024 * 1024
+
+
+def test_s3_media(app, s3: S3Storage, client):
+    media_dir = Path(app.config["BAMBOO_MEDIA_DIR"])
+    app.config["BAMBOO_IMAGE_VARIANT_WIDTHS"] = (40,)
+    buffer = io.BytesIO()
+    with Image.new("RGB", (100, 50), "red") as image:
+        image.save(buffer, "PNG")
+    content = buffer.getvalue()
+    response = client.post("/api/media/", data={"file": (io.BytesIO(content), "red.png")})
+    assert response.status_code == 200, response.json
+    path = response.json["path"]
+    assert not (media_dir / path).exists()
+    assert s3.stat(path).size == len(content)
+
+    gen_small_image(media_dir / path)
+    media = db.session.get(Media, response.json["id"])
+    db.session.refresh(media)
+    assert media.variant_state == "ready"
+    stem = path.removesuffix(".png")
+    assert sorted(info.path for info in s3.iter_files()) == [
+        path,
+        f"{stem}_small.png",
+        f"{stem}_w40.png",
+        f"{stem}_w40.webp",
+    ]
+    assert not (media_dir / path).parent.exists()
+
+    # Streamed by the app without a public URL.
+    response = client.get(f"/media/{path}")
+    assert response.status_code == 200
+    assert response.data == content
+    assert response.headers["Content-Type"] == "image/png"
+    assert response.cache_control.immutable
+    response = client.get(f"/media/{stem}_w40.webp", headers={"If-None-Match": "nope"})
+    assert response.status_code == 200
+    etag = response.headers["ETag"]
+    response = client.get(f"/media/{stem}_w40.webp", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert client.get("/media/missing.png").status_code == 404
+
+    app.config["BAMBOO_S3_PUBLIC_URL"] = "https://cdn.example.com/"
+    app.extensions["bamboo.storage"] = create_storage(app.config)
+    assert media.url == f"https://cdn.example.com/media/{path}"
+    assert media.url_small == f"https://cdn.example.com/media/{stem}_small.png"
+    assert media.srcset[0]["url"] == f"https://cdn.example.com/media/{stem}_w40.png"
+    response = client.get(f"/media/{path}")
+    assert response.status_code == 302
+    assert response.location == f"https://cdn.example.com/media/{path}"
+
+
+def test_s3_create_admin(app, s3: S3Storage):
+    result = app.test_cli_runner().invoke(
+        args=[
+            "create-admin",
+            "--username=admin",
+            "--password=secret",
+            "--name=Admin",
+            "--email=admin@example.com",
+        ]
+    )
+    assert result.exit_code == 0, result.output
+    assert s3.stat("user.png") is not None
+
+    result = app.test_cli_runner().invoke(args=["media", "rebuild-variants"])
+    assert result.exit_code != 0
+    assert "--enqueue" in result.output
@@ -1,9 +1,10 @@
+import time
 from datetime import timedelta
 
 import pytest
 from jose.exceptions import ExpiredSignatureError, JWTClaimsError, JWTError
 
-from bamboo.utils import decode_jwt, encode_jwt
+from bamboo.utils import BloomFilter, TTLCache, decode_jwt, encode_jwt
 
 
 def test_simple_jwt():
@@ -75,3 +76,35 @@ def test_invalid_jwt():
 
     with pytest.raises(JWTError):
         decode_jwt(encoded_token=encoded_token + "wrong suffix", secret_key="bamboo")
+
+
+def test_ttl_cache(mocker):
+    cache = TTLCache[str, int](maxsize=2, ttl=10)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    cache.set("c", 3)
+    # "b" is the least recently used entry
+    assert cache.get("b") is None
+    assert cache.get("c") == 3
+    assert cache.stats() == {"size": 2, "hits": 2, "misses": 1}
+
+    assert cache.discard_if(lambda value: value > 2) == 1
+    assert cache.get("c") is None
+
+    # expired entries are never returned
+    cache.set("d", 4, expires_at=time.time() - 1)
+    assert cache.get("d") is None
+    now = time.monotonic()
+    mocker.patch("bamboo.utils.time.monotonic", return_value=now + 11)
+    assert cache.get("a") is None
+
+
+def test_bloom_filter():
+    bloom = BloomFilter(capacity=1000, error_rate=0.01)
+    items = [f"item-{i}" for i in range(1000)]
+    for item in items:
+        bloom.add(item)
+    assert all(item in bloom for item in items)
+    false_positives = sum(f"other-{i}" in bloom for i in range(10000))
+    assert false_positives < 300
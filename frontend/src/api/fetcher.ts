@@ -54,9 +54,12 @@ async function getNewToken(): Promise<string> {
   if (!state.value.refreshToken)
     return ''
   try {
-    const response = await axios.post<{ access_token: string }>('/api/auth/refresh', {}, {
+    const response = await axios.post<{ access_token: string, refresh_token?: string }>('/api/auth/refresh', {}, {
       headers: { Authorization: `Bearer ${state.value.refreshToken}` },
     })
+    // Refresh tokens are rotated, the one just used is revoked.
+    if (response.data.refresh_token)
+      state.value.refreshToken = response.data.refresh_token
     return response.data.access_token
   }
   catch (error) {
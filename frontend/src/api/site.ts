@@ -10,6 +10,12 @@ interface ISiteOut {
   deployment_secret: string
 }
 
+interface IPage<T> {
+  items: T[]
+  next: string | null
+  total: number | null
+}
+
 export function useAllSites() {
-  return useFetch<ISiteOut[]>('/site/all')
+  return useFetch<IPage<ISiteOut>>('/site/all')
 }
@@ -9,6 +9,7 @@ case "$command" in
     echo "Migrating the database"
     flask create-tables
     flask db upgrade
+    flask schedule-jobs
     echo "Starting the app"
     exec gunicorn app:app
     ;;